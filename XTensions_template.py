@@ -15,17 +15,17 @@
 import time
 import ImarisLib
 import BridgeLib
-from tqdm import tqdm
-
-
-import numpy as np
 from cvbi.gui import *
 
 # Template Extension description for function
+# Heavy modules (numpy, pandas, cvbi.stats, cvbi.image ...) are imported within the function, the first
+# dialog then appears without waiting for them
 
 
 def XTensions_template(aImarisId):
 
+    from tqdm import tqdm
+
     vImarisLib = ImarisLib.ImarisLib()
     vImaris = vImarisLib.GetApplication(aImarisId)
     vDataSet = vImaris.GetDataSet()
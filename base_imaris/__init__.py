@@ -1 +1,23 @@
-import time as time
\ No newline at end of file
+import time as time
+from cvbi.lazy import get_lazy_getattr
+
+# Submodules are imported when one of their functions is first used, pandas / scipy are not loaded on import
+__getattr__ = get_lazy_getattr(__name__,
+                               {'ImarisSession': 'session',
+                                'get_objectID': 'connection_helpers',
+                                'get_all_objectIDs': 'connection_helpers',
+                                'GetFileName': 'connection_helpers',
+                                'GetSurpassObjects': 'objects',
+                                'GetSurpassObject': 'objects',
+                                'get_scene_catalog': 'objects',
+                                'get_statistics': 'stats',
+                                'get_statistics_cell': 'stats',
+                                'get_statistics_track': 'stats',
+                                'iter_statistics_cell': 'stats',
+                                'get_statistics_instances': 'batch',
+                                'StatisticsCache': 'cache',
+                                'get_tracks_assembly': 'tracks',
+                                'StatisticsWriter': 'writeback',
+                                'IncrementalMetrics': 'incremental'},
+                               submodules=['session', 'connection_helpers', 'objects', 'stats', 'batch', 'cache',
+                                           'tracks', 'fake', 'writeback', 'incremental'])
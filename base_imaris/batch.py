@@ -0,0 +1,164 @@
+import time
+import threading
+from cvbi.base_imaris.session import ImarisSession
+from cvbi.base_imaris.objects import get_scene_catalog
+from cvbi.base_imaris.stats import get_statistics
+
+#
+# Statistics extraction from several running Imaris applications at once
+#
+
+
+def _get_requests(catalog, object_types, object_names):
+    """
+
+    :param catalog: SurpassCatalog of the application
+    :param object_types: imaris object types searched
+    :param object_names: set of object names or paths to keep, None keeps all
+    :return: List of (object type, object name), every object once, named by its path if its name is shared
+    """
+
+    requests = {}
+    for object_type in object_types:
+        for object_name, paths in catalog.names.get(object_type.lower(), {}).items():
+            for path in paths:
+                if object_names is not None and object_name not in object_names and path not in object_names:
+                    continue
+                requests[path] = (object_type, object_name if len(paths) == 1 else path)
+
+    return(sorted(requests.values(), key=lambda request: (object_types.index(request[0]), request[1])))
+
+
+def _extract_instance(session, object_names, object_types, names, level, time_range, max_workers):
+    """
+
+    :param session: ImarisSession of a single application
+    :return: Imaris file name and dictionary of object name -> statistics
+    """
+
+    vImaris = session.get_application()
+    imaris_file = vImaris.GetCurrentFileName()
+    catalog = get_scene_catalog(session)
+
+    ret = {}
+    for object_type, object_name in _get_requests(catalog, object_types, object_names):
+        ret[object_name] = get_statistics(vImaris=session, object_type=object_type, object_name=object_name,
+                                          names=names, level=level, time_range=time_range,
+                                          max_workers=max_workers)
+
+    return(imaris_file, ret)
+
+
+def get_statistics_instances(aImarisIds=None, object_names=None, object_types=('spots', 'surfaces'), names=None,
+                             level='cell', time_range=None, max_instances=4, timeout=None, imaris_lib=None,
+                             max_workers=4, max_hung=4):
+    """
+
+    Extract statistics from several Imaris applications concurrently, one session per application.
+    A failing or slow application does not affect the others.
+
+    e.g. :
+
+    results, errors = get_statistics_instances(object_types=['spots'], level='track', timeout=600)
+    results[(0, '/data/exp1.ims')]['Th1']
+
+    :param aImarisIds: Imaris application IDs, default is all running applications
+    :param object_names: object names (or paths) to extract, default is all objects of object_types.
+                         Objects sharing a name are extracted once each, under their path.
+    :param object_types: imaris object types searched
+    :param names: statistic names to fetch, default is all statistics
+    :param level: 'cell' or 'track'
+    :param time_range: (first, last) 'Time Index' kept, cell level only
+    :param max_instances: number of applications processed at the same time, an application which timed out
+                          no longer counts and the next one starts
+    :param timeout: seconds allowed per application, counted from the start of its extraction
+    :param imaris_lib: Callable creating the ImarisLib object, default is ImarisLib.ImarisLib
+    :param max_workers: number of concurrent per-name requests within an application
+    :param max_hung: number of timed out applications whose request may still be hanging, once reached the
+                     applications not started yet fail instead of adding more hanging threads
+    :return:
+    results = dictionary of (application ID, Imaris file) -> {object name -> statistics}
+    errors = dictionary of application ID -> exception for failed or timed out applications
+    """
+
+    if aImarisIds is None:
+        aImarisIds = ImarisSession(imaris_lib=imaris_lib).get_object_ids()
+
+    if object_names is not None:
+        object_names = set(object_names)
+
+    # every application and object type once
+    aImarisIds = list(dict.fromkeys(aImarisIds))
+    object_types = list(dict.fromkeys(object_type.lower() for object_type in object_types))
+
+    results = {}
+    errors = {}
+    finished = {}
+    timed_out = set()
+    hung = {}
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def run(aImarisId):
+        try:
+            session = ImarisSession(aImarisId=aImarisId, imaris_lib=imaris_lib)
+            outcome = (True, _extract_instance(session, object_names, list(object_types), names, level,
+                                               time_range, max_workers))
+        except Exception as e:
+            outcome = (False, e)
+        with lock:
+            # the outcome of an application which timed out is dropped
+            hung.pop(aImarisId, None)
+            if aImarisId not in timed_out:
+                finished[aImarisId] = outcome
+        done.set()
+
+    queued = list(aImarisIds)
+    running = {}
+    while queued or running:
+        # one daemon thread per application, a hanging ICE call cannot be interrupted but its thread is
+        # abandoned after the timeout and does not hold a slot
+        while queued and len(running) < max_instances:
+            aImarisId = queued.pop(0)
+            with lock:
+                n_hung = len(hung)
+            if n_hung >= max_hung:
+                errors[aImarisId] = RuntimeError('Imaris application ' + str(aImarisId) + ' not started, ' +
+                                                 str(n_hung) + ' timed out applications are still hanging')
+                continue
+            thread = threading.Thread(target=run, args=(aImarisId,))
+            thread.daemon = True
+            running[aImarisId] = time.time()
+            thread.start()
+
+        if not running:
+            break
+
+        done.wait(timeout=min(1.0, timeout) if timeout is not None else None)
+
+        with lock:
+            done.clear()
+            for aImarisId in [i for i in running if i in finished]:
+                del running[aImarisId]
+                success, value = finished.pop(aImarisId)
+                if success:
+                    imaris_file, ret = value
+                    results[(aImarisId, imaris_file)] = ret
+                else:
+                    errors[aImarisId] = value
+
+        if timeout is not None:
+            now = time.time()
+            for aImarisId, start in list(running.items()):
+                if now - start > timeout:
+                    # the request cannot be interrupted, its result is discarded
+                    with lock:
+                        if aImarisId in finished:
+                            continue
+                        timed_out.add(aImarisId)
+                        hung[aImarisId] = start
+                    errors[aImarisId] = TimeoutError('Imaris application ' + str(aImarisId) +
+                                                     ' did not finish within ' + str(timeout) + 's')
+                    del running[aImarisId]
+
+    return(results, errors)
@@ -0,0 +1,213 @@
+import os
+import json
+import time
+import hashlib
+import numpy as np
+import pandas as pd
+from cvbi.base_imaris.objects import GetSurpassObject
+from cvbi.base_imaris.session import get_application
+from cvbi.base_imaris.stats import get_statistics
+
+#
+# Persistent on-disk cache for statistics extracted from Imaris
+#
+
+
+def get_object_fingerprint(object_cells):
+    """
+
+    Cheap fingerprint of an Imaris object, changes when objects, tracks or statistics change
+
+    :param object_cells: Imaris spots / surfaces object
+    :return: Hex digest of object count, track IDs, track edges and statistic names
+    """
+
+    h = hashlib.sha1()
+
+    ids = np.asarray(object_cells.GetIds(), dtype=np.int64)
+    h.update(str(len(ids)).encode())
+    h.update(ids.tobytes())
+
+    try:
+        h.update(np.asarray(object_cells.GetTrackIds(), dtype=np.int64).tobytes())
+        h.update(np.asarray(object_cells.GetTrackEdges(), dtype=np.int64).tobytes())
+    except AttributeError:
+        pass
+
+    if hasattr(object_cells, 'GetStatisticsNames'):
+        h.update('\n'.join(sorted(object_cells.GetStatisticsNames())).encode())
+
+    return(h.hexdigest())
+
+
+def _write_frame(df, path):
+    """
+
+    :param df: Wide statistics frame
+    :param path: File path without extension
+    :return: Path written, Parquet if available, NPZ otherwise
+    """
+
+    try:
+        df.to_parquet(path + '.parquet', index=False)
+        return(path + '.parquet')
+    except ImportError:
+        arrays = dict(('c%d' % i, df.iloc[:, i].values) for i in range(df.shape[1]))
+        np.savez(path + '.npz', __columns__=np.array(list(df.columns), dtype=object), **arrays)
+        return(path + '.npz')
+
+
+def _read_frame(path):
+    """
+
+    :param path: Cached .parquet or .npz file
+    :return: Wide statistics frame
+    """
+
+    if path.endswith('.parquet'):
+        return(pd.read_parquet(path))
+
+    with np.load(path, allow_pickle=True) as f:
+        columns = list(f['__columns__'])
+        return(pd.DataFrame(dict((name, f['c%d' % i]) for i, name in enumerate(columns)), columns=columns))
+
+
+class StatisticsCache(object):
+    """
+
+    Stores wide statistics frames on disk, keyed by Imaris file, object type and name, the query and a
+    fingerprint of the object. Entries are evicted least recently used first once max_bytes is exceeded.
+
+    e.g. :
+
+    cache = StatisticsCache()
+    data_cells = cache.get_statistics(vImaris, object_type='spots', object_name='Th1', level='cell')
+
+    :param cache_dir: Cache directory, default is ~/.cvbi/cache
+    :param max_bytes: Maximum size of all cached files
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=2 * 1024**3):
+        self.cache_dir = cache_dir or os.path.join(os.path.expanduser('~'), '.cvbi', 'cache')
+        self.max_bytes = max_bytes
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def _entries(self):
+        """
+
+        :return: List of (metadata path, metadata) for all cache entries
+        """
+
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.json'):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    with open(path) as f:
+                        entries.append((path, json.load(f)))
+                except (IOError, ValueError):
+                    continue
+        return(entries)
+
+    def _remove(self, meta_path, meta):
+        for path in [os.path.join(self.cache_dir, meta.get('data', '')), meta_path]:
+            if os.path.isfile(path):
+                os.remove(path)
+
+    def get_statistics(self, vImaris, object_type, object_name, names=None, level='cell', time_range=None,
+                       refresh=False):
+        """
+
+        Cached version of base_imaris.stats.get_statistics
+
+        :param vImaris: imaris instance or ImarisSession
+        :param object_type: imaris object type
+        :param object_name: imaris object name
+        :param names: statistic names to fetch, default is all statistics
+        :param level: 'cell' or 'track'
+        :param time_range: (first, last) 'Time Index' kept, cell level only
+        :param refresh: Fetch from Imaris even if a cached entry exists
+        :return: Wide statistics frame
+        """
+
+        object_cells = GetSurpassObject(vImaris=vImaris, search=object_type, name=object_name)
+
+        key = {'file': get_application(vImaris).GetCurrentFileName(),
+               'object_type': object_type.lower(),
+               'object_name': object_name,
+               'names': sorted(names) if names is not None else None,
+               'level': level,
+               'time_range': list(time_range) if time_range is not None else None,
+               'fingerprint': get_object_fingerprint(object_cells)}
+        digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+        meta_path = os.path.join(self.cache_dir, digest + '.json')
+
+        if not refresh and os.path.isfile(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            data_path = os.path.join(self.cache_dir, meta['data'])
+            if os.path.isfile(data_path):
+                # touch the entry for least recently used eviction
+                now = time.time()
+                os.utime(meta_path, (now, now))
+                df = _read_frame(data_path)
+                df.columns.name = 'names' if level == 'cell' else 'colname'
+                return(df)
+
+        df = get_statistics(vImaris=vImaris, object_type=object_type, object_name=object_name,
+                            names=names, level=level, time_range=time_range)
+
+        data_path = _write_frame(df, os.path.join(self.cache_dir, digest))
+        meta = dict(key)
+        meta['data'] = os.path.basename(data_path)
+        meta['bytes'] = os.path.getsize(data_path)
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
+
+        self.evict()
+        return(df)
+
+    def evict(self):
+        """
+
+        :return: Removes least recently used entries until the cache fits in max_bytes
+        """
+
+        entries = sorted(self._entries(), key=lambda entry: os.path.getmtime(entry[0]))
+        total = sum(meta.get('bytes', 0) for _, meta in entries)
+        for meta_path, meta in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(meta_path, meta)
+            total -= meta.get('bytes', 0)
+
+    def invalidate(self, imaris_file=None, object_name=None, object_type=None):
+        """
+
+        :param imaris_file: Remove entries of this Imaris file, default is any file
+        :param object_name: Remove entries of this object, default is any object
+        :param object_type: Remove entries of this object type, default is any type
+        :return: Number of entries removed
+        """
+
+        removed = 0
+        for meta_path, meta in self._entries():
+            if imaris_file is not None and meta.get('file') != imaris_file:
+                continue
+            if object_name is not None and meta.get('object_name') != object_name:
+                continue
+            if object_type is not None and meta.get('object_type') != object_type.lower():
+                continue
+            self._remove(meta_path, meta)
+            removed += 1
+
+        return(removed)
+
+    def clear(self):
+        """
+
+        :return: Removes all entries
+        """
+
+        return(self.invalidate())
@@ -1,74 +1,87 @@
-import ImarisLib
 import time
+from cvbi.base_imaris.session import ImarisSession
 
-def get_objectID():
+_session = None
+
+
+def get_session(session=None):
+
+    """
+
+    :param session: ImarisSession to use, default is a session shared by all helpers in this process
+    :return: ImarisSession
+
+    """
+
+    global _session
+
+    if session is not None:
+        return(session)
+
+    if _session is None:
+        _session = ImarisSession()
+
+    return(_session)
+
+def get_objectID(session=None):
 
     """
 
     Get objectID for current Imaris application (aImarisID)
+    :param session: ImarisSession, default is the shared session
     :return: aImarisID value to be used within the XTension
 
     """
 
-    vImarisLib = ImarisLib.ImarisLib()
-    vServer = vImarisLib.GetServer()
-    vNumberOfObjects = vServer.GetNumberOfObjects()
+    session = get_session(session)
 
     try:
-        for vIndex in range(vNumberOfObjects):
-            vObjectId = vServer.GetObjectID(vIndex)
+        for vObjectId in session.get_object_ids():
             # work with the ID (return first one)
             return(vObjectId)
     except:
         # If the process fails return an invalid id
+        session.reconnect()
         print('No ID Found')
         time.sleep(5)
         return(-1)
 
-def get_all_objectIDs():
+def get_all_objectIDs(session=None):
 
     """
 
     Get objectIDs for active Imaris applications (aImarisID)
+    :param session: ImarisSession, default is the shared session
     :return: Dictionary of ImarisIDs and corresponding data files
 
     """
 
-    vImarisLib = ImarisLib.ImarisLib()
-    vServer = vImarisLib.GetServer()
-    vNumberOfObjects = vServer.GetNumberOfObjects()
-
-    objectIDs = {}
+    session = get_session(session)
 
     try:
-        for vIndex in range(vNumberOfObjects):
-            aImarisId = vServer.GetObjectID(vIndex)
-            vImarisLib = ImarisLib.ImarisLib()
-            vImaris = vImarisLib.GetApplication(aImarisId)
-            imaris_file = vImaris.GetCurrentFileName()
-            objectIDs[aImarisId] = imaris_file
+        objectIDs = session.get_file_names()
     except:
         # If the process fails return an invalid id
+        session.reconnect()
         print('No ID Found')
         time.sleep(5)
         return(-1)
 
     return(objectIDs)
 
-def GetFileName():
+def GetFileName(session=None):
 
     """
 
     Get file name of the current Imaris  dataset
 
+    :param session: ImarisSession, default is the shared session
     :return: File path
 
     """
 
-    aImarisId = get_objectID()
-    vImarisLib = ImarisLib.ImarisLib()
-    vImaris = vImarisLib.GetApplication(aImarisId)
+    session = get_session(session)
+    vImaris = session.get_application(check=True)
     imaris_filepath = vImaris.GetCurrentFileName()
 
     return(imaris_filepath)
-
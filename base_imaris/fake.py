@@ -0,0 +1,292 @@
+import numpy as np
+
+#
+# Local stand-in for the Imaris ICE API (ImarisLib, server, application, Surpass scene and objects),
+# exposes the calls used within base_imaris so that extensions can run without Imaris
+#
+
+
+class FakeStatisticValues(object):
+    """
+
+    Stand-in for cStatisticValues returned by GetStatistics
+
+    """
+
+    def __init__(self, mIds, mNames, mValues, mUnits=None, mFactors=None, mFactorNames=None):
+        self.mIds = list(mIds)
+        self.mNames = list(mNames)
+        self.mValues = list(mValues)
+        self.mUnits = list(mUnits) if mUnits is not None else ['' for _ in self.mIds]
+        self.mFactors = mFactors if mFactors is not None else []
+        self.mFactorNames = mFactorNames if mFactorNames is not None else []
+
+
+class FakeDataItem(object):
+
+    def __init__(self, name, kind):
+        self.name = name
+        self.kind = kind
+
+    def GetName(self):
+        return(self.name)
+
+    def SetName(self, aName):
+        self.name = aName
+
+
+class FakeDataContainer(FakeDataItem):
+    """
+
+    Stand-in for the Surpass scene and groups within it
+
+    :param name: Group name
+    :param children: List of fake objects / groups
+    """
+
+    def __init__(self, name='Surpass Scene', children=None):
+        FakeDataItem.__init__(self, name=name, kind='group')
+        self.children = list(children) if children is not None else []
+
+    def GetNumberOfChildren(self):
+        return(len(self.children))
+
+    def GetChild(self, aChildIndex):
+        return(self.children[aChildIndex])
+
+    def AddChild(self, aChild, aPosition=-1):
+        if aPosition < 0:
+            self.children.append(aChild)
+        else:
+            self.children.insert(aPosition, aChild)
+
+    def RemoveChild(self, aChild):
+        self.children.remove(aChild)
+
+
+class FakeSurpassObject(FakeDataItem):
+    """
+
+    Stand-in for spots / surfaces / cells / filaments objects
+
+    :param name: Object name
+    :param kind: One of spots, surfaces, cells, filaments, frame
+    :param ids: Object IDs
+    :param track_ids: Track ID of every track edge
+    :param track_edges: Track edges as pairs of indices into ids
+    :param statistics: FakeStatisticValues with object and track level statistics
+    """
+
+    def __init__(self, name, kind='spots', ids=None, track_ids=None, track_edges=None, statistics=None):
+        FakeDataItem.__init__(self, name=name, kind=kind)
+        self.ids = list(ids) if ids is not None else []
+        self.track_ids = list(track_ids) if track_ids is not None else []
+        self.track_edges = [list(edge) for edge in track_edges] if track_edges is not None else []
+        self.statistics = statistics if statistics is not None else FakeStatisticValues([], [], [])
+
+    def GetIds(self):
+        return(list(self.ids))
+
+    def GetTrackIds(self):
+        return(list(self.track_ids))
+
+    def GetTrackEdges(self):
+        return([list(edge) for edge in self.track_edges])
+
+    def GetStatistics(self):
+        return(self.statistics)
+
+    def GetStatisticsNames(self):
+        return(sorted(set(self.statistics.mNames)))
+
+    def GetStatisticsByName(self, aName):
+        s = self.statistics
+        use = [i for i, name in enumerate(s.mNames) if name == aName]
+        return(FakeStatisticValues(mIds=[s.mIds[i] for i in use],
+                                   mNames=[s.mNames[i] for i in use],
+                                   mValues=[s.mValues[i] for i in use],
+                                   mUnits=[s.mUnits[i] for i in use]))
+
+    def AddStatistics(self, aNames, aValues, aUnits, aFactors, aFactorNames, aIds):
+        s = self.statistics
+        s.mIds.extend(aIds)
+        s.mNames.extend(aNames)
+        s.mValues.extend(aValues)
+        s.mUnits.extend(aUnits)
+
+    def RemoveStatistics(self, aStatisticName):
+        s = self.statistics
+        use = [i for i, name in enumerate(s.mNames) if name != aStatisticName]
+        self.statistics = FakeStatisticValues(mIds=[s.mIds[i] for i in use],
+                                              mNames=[s.mNames[i] for i in use],
+                                              mValues=[s.mValues[i] for i in use],
+                                              mUnits=[s.mUnits[i] for i in use])
+
+
+class FakeFactory(object):
+    """
+
+    Stand-in for the Imaris factory, IsX / ToX calls on fake objects
+
+    """
+
+    def _is(self, item, kind):
+        return(getattr(item, 'kind', None) == kind)
+
+    def IsFrame(self, item):
+        return(self._is(item, 'frame'))
+
+    def IsSpots(self, item):
+        return(self._is(item, 'spots'))
+
+    def IsSurfaces(self, item):
+        return(self._is(item, 'surfaces'))
+
+    def IsFilaments(self, item):
+        return(self._is(item, 'filaments'))
+
+    def IsCells(self, item):
+        return(self._is(item, 'cells'))
+
+    def IsDataContainer(self, item):
+        return(self._is(item, 'group'))
+
+    def ToFrame(self, item):
+        return(item)
+
+    def ToSpots(self, item):
+        return(item)
+
+    def ToSurfaces(self, item):
+        return(item)
+
+    def ToFilaments(self, item):
+        return(item)
+
+    def ToCells(self, item):
+        return(item)
+
+    def ToDataContainer(self, item):
+        return(item)
+
+
+class FakeApplication(object):
+    """
+
+    Stand-in for an Imaris application
+
+    :param file_name: Current file name
+    :param scene: FakeDataContainer with the Surpass scene
+    :param dataset: Dataset served by GetDataSet, e.g. image.dataset.NumpyDataSet
+    """
+
+    def __init__(self, file_name='fake.ims', scene=None, dataset=None):
+        self.file_name = file_name
+        self.scene = scene if scene is not None else FakeDataContainer()
+        self.dataset = dataset
+        self.factory = FakeFactory()
+
+    def GetCurrentFileName(self):
+        return(self.file_name)
+
+    def GetSurpassScene(self):
+        return(self.scene)
+
+    def GetFactory(self):
+        return(self.factory)
+
+    def GetDataSet(self):
+        return(self.dataset)
+
+
+class FakeServer(object):
+    """
+
+    Stand-in for the Imaris server listing running applications
+
+    :param applications: Dictionary of aImarisId -> FakeApplication
+    """
+
+    def __init__(self, applications=None):
+        self.applications = applications if applications is not None else {}
+
+    def GetNumberOfObjects(self):
+        return(len(self.applications))
+
+    def GetObjectID(self, aIndex):
+        return(sorted(self.applications.keys())[aIndex])
+
+
+class FakeImarisLib(object):
+    """
+
+    Stand-in for ImarisLib.ImarisLib, all instances created from the same server share its applications
+
+    e.g. :
+
+    server = FakeServer({0: FakeApplication('a.ims', scene)})
+    session = ImarisSession(imaris_lib=lambda: FakeImarisLib(server))
+
+    :param server: FakeServer
+    """
+
+    def __init__(self, server=None):
+        self.server = server if server is not None else FakeServer()
+
+    def GetServer(self):
+        return(self.server)
+
+    def GetApplication(self, aImarisId):
+        return(self.server.applications.get(aImarisId))
+
+
+def get_fake_tracked_object(name='Spots', kind='spots', n_tracks=10, track_length=5, statistics_names=None,
+                            seed=0):
+    """
+
+    Build a fake tracked object with random positions and the statistics get_statistics_cell expects
+
+    :param name: Object name
+    :param kind: Object type
+    :param n_tracks: Number of tracks
+    :param track_length: Number of time points per track
+    :param statistics_names: Extra random statistics added for every object
+    :param seed: Random seed
+    :return: FakeSurpassObject
+    """
+
+    rng = np.random.RandomState(seed)
+    n = n_tracks * track_length
+
+    ids = np.arange(n)
+    time_index = np.tile(np.arange(1, track_length + 1), n_tracks)
+    track_of = np.repeat(np.arange(n_tracks), track_length)
+    positions = np.cumsum(rng.normal(size=(n, 3)), axis=0)
+
+    edges = [[i, i + 1] for i in range(n) if (i + 1) % track_length != 0]
+    track_ids = [1000000000 + track_of[i] for i, _ in edges]
+
+    columns = {'Position X': positions[:, 0],
+               'Position Y': positions[:, 1],
+               'Position Z': positions[:, 2],
+               'Time Index': time_index,
+               'Time Since Track Start': (time_index - 1) * 30.0,
+               'Speed': rng.random_sample(n) * 0.1,
+               'Displacement^2': rng.random_sample(n) * 100}
+    for stat_name in (statistics_names or []):
+        columns[stat_name] = rng.random_sample(n)
+
+    mIds, mNames, mValues = [], [], []
+    for stat_name, stat_values in columns.items():
+        mIds.extend(ids.tolist())
+        mNames.extend([stat_name] * n)
+        mValues.extend(np.asarray(stat_values, dtype=np.float64).tolist())
+
+    for track in range(n_tracks):
+        mIds.append(1000000000 + track)
+        mNames.append('Track Duration')
+        mValues.append((track_length - 1) * 30.0)
+
+    statistics = FakeStatisticValues(mIds=mIds, mNames=mNames, mValues=mValues)
+    return(FakeSurpassObject(name=name, kind=kind, ids=ids.tolist(), track_ids=track_ids, track_edges=edges,
+                             statistics=statistics))
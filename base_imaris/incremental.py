@@ -0,0 +1,178 @@
+import hashlib
+import numpy as np
+import pandas as pd
+from cvbi.base_imaris.objects import GetSurpassObject
+from cvbi.base_imaris.session import get_application
+from cvbi.base_imaris.stats import _fetch_statistics, _get_cell_table
+from cvbi.base_imaris.tracks import get_tracks_assembly, get_track_hashes
+
+#
+# Incremental cell, track and dataset metrics after tracks were split, joined or deleted in Imaris
+#
+
+# statistics used by stats.movement.get_metrics_cells and get_metrics_tracks
+METRIC_STATISTICS = ['Position X', 'Position Y', 'Position Z', 'Time Index', 'Time Since Track Start', 'Speed',
+                     'Displacement^2', 'Displacement Delta Length']
+
+
+def _add_counts(counts, other, sign=1):
+    """
+
+    :return: counts + sign * other, element by element so that integer counts stay integers
+    """
+
+    return(pd.Series(dict((name, counts[name] + sign * other[name]) for name in counts.index), dtype=object))
+
+
+class IncrementalMetrics(object):
+    """
+
+    Keeps the metrics of every track with a content hash of its objects and edges. Each update compares the
+    hashes with the previous run of the same object, computes cell and track metrics of added or changed tracks
+    only, drops the removed ones and patches the dataset counts instead of recounting every track.
+
+    e.g. :
+
+    metrics = IncrementalMetrics()
+    results = metrics.update(vImaris, 'spots', 'Th1', cell_moving='Th1')
+    # ... split, join or delete tracks in Imaris ...
+    results = metrics.update(vImaris, 'spots', 'Th1', cell_moving='Th1')   # recomputes the edited tracks only
+
+    :param names: Statistics fetched for the cell metrics
+    :param unit: Time unit of get_metrics_tracks
+    :param max_workers: number of concurrent per-name requests
+    """
+
+    def __init__(self, names=None, unit='s', max_workers=4):
+        self.names = list(names) if names is not None else METRIC_STATISTICS
+        self.unit = unit
+        self.max_workers = max_workers
+        self.states = {}
+
+    def _get_labels_digest(self, cluster_labels):
+        if cluster_labels is None:
+            return(None)
+        h = hashlib.sha1()
+        h.update(np.asarray(cluster_labels.index.values, dtype=np.int64).tobytes())
+        h.update(np.asarray(cluster_labels.values, dtype=np.int64).tobytes())
+        return(h.hexdigest())
+
+    def update(self, vImaris, object_type, object_name, cell_moving=None, t_limit=60, cluster_labels=None,
+               force=False):
+        """
+
+        :param vImaris: imaris instance or ImarisSession
+        :param object_type: imaris object type
+        :param object_name: imaris object name
+        :param cell_moving: Cell type, see get_metrics_dataset
+        :param t_limit: Total time that calculations were run on, see get_metrics_dataset
+        :param cluster_labels: pandas Series of objectID -> cluster label, default is -1 (no cluster) for every
+                               cell. Changed labels recompute every track.
+        :param force: Recompute every track
+        :return: dictionary with
+        cells = get_metrics_cells of every track, sorted by trackID and time
+        tracks = get_metrics_track of every track with its trackID
+        dataset = get_metrics_dataset of the tracks
+        added = track IDs computed in this update (new, split, joined or otherwise edited tracks)
+        removed = track IDs of the previous update which no longer exist as they were
+        """
+
+        from cvbi.stats.movement import get_metrics_cells, get_metrics_tracks, get_metrics_dataset, \
+            get_metrics_dataset_counts
+
+        object_cells = GetSurpassObject(vImaris=vImaris, search=object_type, name=object_name)
+        key = (get_application(vImaris).GetCurrentFileName(), object_type.lower(), object_name)
+
+        ids = np.asarray(object_cells.GetIds(), dtype=np.int64)
+        edges = np.asarray(object_cells.GetTrackEdges(), dtype=np.int64).reshape((-1, 2))
+        tracks = get_tracks_assembly(ids=ids, edges=edges, edge_track_ids=object_cells.GetTrackIds())
+        hashes = get_track_hashes(tracks, ids, edges)
+        track_ids = pd.Series(tracks['track_ids'], index=hashes)
+        track_hashes = pd.Series(hashes, index=tracks['track_ids'])
+
+        labels_digest = self._get_labels_digest(cluster_labels)
+        state = self.states.get(key)
+        if force or state is None or state['labels'] != labels_digest:
+            state = {'labels': labels_digest,
+                     'cells': None,
+                     'cell_hashes': np.zeros(0, dtype=object),
+                     'tracks': None,
+                     'counts': None}
+
+        previous = state['tracks']
+        is_new = ~track_ids.index.isin(previous.index) if previous is not None else np.ones(len(hashes), dtype=bool)
+        removed = previous.index[~previous.index.isin(hashes)] if previous is not None else pd.Index([])
+
+        # cell and track metrics of the new tracks
+        cells_new, tracks_new = None, None
+        if is_new.any():
+            cell_codes = np.repeat(np.arange(len(hashes)), np.diff(tracks['offsets']))
+            in_new = is_new[cell_codes]
+            object_ids, cell_track_ids = tracks['object_ids'][in_new], tracks['cell_track_ids'][in_new]
+            order = np.lexsort((object_ids, cell_track_ids))
+
+            # Imaris returns statistics of every object, only the rows of new tracks are reshaped
+            stat_ids, stat_names, stat_values = _fetch_statistics(object_cells, names=self.names,
+                                                                  max_workers=self.max_workers)
+            data_cells = _get_cell_table(stat_ids, stat_names, stat_values, object_ids[order], cell_track_ids[order])
+            if cluster_labels is not None:
+                data_cells['cluster_label'] = cluster_labels.reindex(data_cells.objectID.values).fillna(-1).values
+            else:
+                data_cells['cluster_label'] = -1
+
+            cells_new = get_metrics_cells(data_cells)
+            tracks_new = get_metrics_tracks(cells_new, unit=self.unit)
+            tracks_new.index = pd.Index(track_hashes.loc[tracks_new.trackID.values].values)
+
+        # patch the dataset counts
+        counts = state['counts']
+        if counts is not None and len(removed):
+            counts = _add_counts(counts, get_metrics_dataset_counts(previous.loc[removed]), sign=-1)
+        if counts is None:
+            counts = get_metrics_dataset_counts(pd.DataFrame(columns=['start', 'end', 'track_always_in',
+                                                                      'track_always_out']))
+        if tracks_new is not None:
+            counts = _add_counts(counts, get_metrics_dataset_counts(tracks_new))
+
+        # unchanged tracks keep their metrics, under their current Imaris track ID
+        cell_parts, hash_parts, track_parts = [], [], []
+        if previous is not None:
+            keep_cells = ~pd.Index(state['cell_hashes']).isin(removed)
+            cells_kept = state['cells'].loc[keep_cells]
+            cells_kept = cells_kept.assign(trackID=track_ids.loc[state['cell_hashes'][keep_cells]].values)
+            tracks_kept = previous.loc[~previous.index.isin(removed)]
+            tracks_kept = tracks_kept.assign(trackID=track_ids.loc[tracks_kept.index].values)
+            cell_parts.append(cells_kept)
+            hash_parts.append(state['cell_hashes'][keep_cells])
+            track_parts.append(tracks_kept)
+        if tracks_new is not None:
+            cell_parts.append(cells_new)
+            hash_parts.append(track_hashes.loc[cells_new.trackID.values].values)
+            track_parts.append(tracks_new)
+
+        if cell_parts:
+            cells = pd.concat(cell_parts, ignore_index=True)
+            cell_hashes = np.concatenate(hash_parts)
+            order = np.lexsort((cells.time.values, cells.trackID.values))
+            cells = cells.iloc[order].reset_index(drop=True)
+            cell_hashes = cell_hashes[order]
+            tracks_all = pd.concat(track_parts)
+            tracks_all = tracks_all.iloc[np.argsort(tracks_all.trackID.values, kind='stable')]
+        else:
+            cells, cell_hashes, tracks_all = pd.DataFrame(), np.zeros(0, dtype=object), pd.DataFrame()
+
+        self.states[key] = {'labels': labels_digest,
+                            'cells': cells,
+                            'cell_hashes': cell_hashes,
+                            'tracks': tracks_all,
+                            'counts': counts}
+
+        return({'cells': cells,
+                'tracks': tracks_all.reset_index(drop=True),
+                'dataset': get_metrics_dataset(None, cell_moving=cell_moving, t_limit=t_limit, counts=counts),
+                'added': np.sort(track_ids.values[is_new]),
+                'removed': previous.loc[removed].trackID.values if previous is not None else
+                np.zeros(0, dtype=np.int64)})
+
+    def clear(self):
+        self.states.clear()
@@ -1,17 +1,176 @@
+from cvbi.base_imaris.session import ImarisSession
+
 #
 # Methods to work with different objects as defined within Imaris
 #
 
+# Object types and the factory calls used to identify / cast them
+SURPASS_TYPES = [('frame', 'IsFrame', 'ToFrame'),
+                 ('spots', 'IsSpots', 'ToSpots'),
+                 ('surfaces', 'IsSurfaces', 'ToSurfaces'),
+                 ('filaments', 'IsFilaments', 'ToFilaments'),
+                 ('cells', 'IsCells', 'ToCells')]
+
+# catalogs of applications passed without a session, by id of the application
+_catalogs = {}
+MAX_CATALOGS = 8
+
+
+class SurpassCatalog(object):
+    """
+
+    Index of all objects within the Surpass scene, built in a single traversal which descends into groups.
+    Objects are indexed by type and name, objects sharing a name are also indexed by their path
+    (group names and object name joined with '/').
+
+    e.g. :
+
+    catalog = SurpassCatalog(vImaris)
+    catalog.get_objects('spots').keys()
+    ['Th1', 'Group 1/Th1', 'Group 2/Th1']
+
+    catalog.get_object('spots', 'Group 2/Th1')
+
+    :param vImaris: Imaris application
+    """
+
+    def __init__(self, vImaris):
+        self.vImaris = vImaris
+        self.refresh()
+
+    def _walk(self, vFactory, vContainer, path, groups):
+
+        for i in range(vContainer.GetNumberOfChildren()):
+            vChild = vContainer.GetChild(i)
+            vName = vChild.GetName()
+            vPath = path + [vName]
+
+            for object_type, is_type, to_type in SURPASS_TYPES:
+                if getattr(vFactory, is_type)(vChild):
+                    self.paths['/'.join(vPath)] = (object_type, getattr(vFactory, to_type)(vChild))
+                    self.names.setdefault(object_type, {}).setdefault(vName, []).append('/'.join(vPath))
+                    break
+            else:
+                if vFactory.IsDataContainer(vChild):
+                    vGroup = vFactory.ToDataContainer(vChild)
+                    groups.append(('/'.join(vPath), vGroup))
+                    self._walk(vFactory, vGroup, vPath, groups)
+
+    def _get_signature(self):
+        """
+
+        :return: File name and names of the objects and groups at the top of the scene,
+                 one GetName call per top-level child
+        """
+
+        vScene = self.vImaris.GetSurpassScene()
+        if vScene is None:
+            return(None)
+
+        return((self.vImaris.GetCurrentFileName(),
+                tuple(vScene.GetChild(i).GetName() for i in range(vScene.GetNumberOfChildren()))))
+
+    def refresh(self):
+        """
+
+        :return: Rebuilds the index from the Surpass scene
+        """
+
+        self.paths = {}
+        self.names = {}
+        self.groups = []
+
+        vScene = self.vImaris.GetSurpassScene()
+        if vScene is not None:
+            self._walk(self.vImaris.GetFactory(), vScene, [], self.groups)
+
+        self.signature = self._get_signature()
+
+    def is_stale(self):
+        """
+
+        :return: True if the file or the objects at the top of the scene (count or names) changed since the index
+                 was built, changes within groups are found by GetSurpassObject when a lookup misses
+        """
+
+        return(self._get_signature() != self.signature)
+
+    def get_objects(self, search='surfaces'):
+        """
+
+        :param search: Object type from [frame, spots, surfaces, filaments, cells]
+        :return: Dictionary of name -> object, the first object of every name and the paths of duplicate names
+        """
+
+        ret = {}
+        for vName, vPaths in self.names.get(search.lower(), {}).items():
+            ret[vName] = self.paths[vPaths[0]][1]
+            if len(vPaths) > 1:
+                for vPath in vPaths:
+                    ret[vPath] = self.paths[vPath][1]
+
+        return(ret)
+
+    def get_object(self, search, name):
+        """
+
+        :param search: Object type from [frame, spots, surfaces, filaments, cells]
+        :param name: Object name or path
+        :return: Imaris object
+        """
+
+        vPaths = self.names.get(search.lower(), {}).get(name)
+        if vPaths is not None:
+            return(self.paths[vPaths[0]][1])
+
+        if name in self.paths and self.paths[name][0] == search.lower():
+            return(self.paths[name][1])
+
+        raise KeyError(name)
+
+
+def get_scene_catalog(vImaris, refresh=False, check=True):
+
+    """
+    Surpass scene catalog of an Imaris application, cached per session and application ID
+    (or per application if no session is given)
+
+    :param vImaris: Imaris application or ImarisSession
+    :param refresh: Rebuild the catalog
+    :param check: Rebuild the catalog if the file or the objects at the top of the scene changed
+    :return: SurpassCatalog
+
+    """
+
+    if isinstance(vImaris, ImarisSession):
+        vApplication = vImaris.get_application()
+        catalogs, key = vImaris.catalogs, vImaris.aImarisId
+    else:
+        vApplication = vImaris
+        catalogs, key = _catalogs, id(vImaris)
+
+    catalog = catalogs.get(key)
+
+    if catalog is None or catalog.vImaris is not vApplication or refresh or (check and catalog.is_stale()):
+        catalog = SurpassCatalog(vApplication)
+        catalogs.pop(key, None)
+        catalogs[key] = catalog
+        while catalogs is _catalogs and len(_catalogs) > MAX_CATALOGS:
+            del _catalogs[next(iter(_catalogs))]
+
+    return(catalog)
+
 
 def GetSurpassObjects(vImaris, search="surfaces"):
 
     """
     Pass a imaris application generated for a specific applicationID and search for a object type
 
-    Input  : vImaris = Imaris Applcation
-             search = Object type from [frame, spots, surfaces, filaments]
+    Input  : vImaris = Imaris Applcation or ImarisSession
+             search = Object type from [frame, spots, surfaces, filaments, cells]
 
-    Output : A dictionary of all object connections of the specified type
+    Output : A dictionary of all object connections of the specified type, including objects within groups.
+             Objects sharing a name are also listed under their path, e.g. 'Group 1/Th1'
 
     e.g. :
 
@@ -25,49 +184,32 @@ def GetSurpassObjects(vImaris, search="surfaces"):
     surfaces['Th1']
     cde839ab-bc29-47a5-8970-033983753001 -t -e 1.0:tcp -h 172.19.244.153 -p 50334 -t 60000
 
+    The listing always scans the scene, the scan is kept for later GetSurpassObject lookups.
+
     """
 
-    ret = {}
+    return(get_scene_catalog(vImaris, refresh=True).get_objects(search=search))
 
-    vFactory = vImaris.GetFactory()
-    vScene = vImaris.GetSurpassScene()
 
-    if vScene is None:
-        return(ret)
+def GetSurpassObject(vImaris, search, name):
+
+    """
+    Look up a single object by type and name (or path) through the scene catalog
+
+    :param vImaris: Imaris application or ImarisSession
+    :param search: Object type from [frame, spots, surfaces, filaments, cells]
+    :param name: Object name or path
+    :return: Imaris object
+
+    """
+
+    try:
+        vObject = get_scene_catalog(vImaris).get_object(search=search, name=name)
+        if vObject.GetName() in (name, name.split('/')[-1]):
+            return(vObject)
+    except Exception:
+        # missing from the catalog, or a cached proxy of an object deleted from the scene
+        pass
 
-    nChildren = vScene.GetNumberOfChildren()
-
-    for i in range(nChildren):
-        vChild = vScene.GetChild(i)
-
-        if search.lower() == "frame":
-            if vFactory.IsFrame(vChild):
-                vFrame = vFactory.ToFrame(vChild)
-                vName = vChild.GetName()
-                ret[vName] = vFrame
-
-        elif search.lower() == "spots":
-            if vFactory.IsSpots(vChild):
-                vSpots = vFactory.ToSpots(vChild)
-                vName = vChild.GetName()
-                ret[vName] = vSpots
-
-        elif search.lower() == "surfaces":
-            if vFactory.IsSurfaces(vChild):
-                vSurfaces = vFactory.ToSurfaces(vChild)
-                vName = vChild.GetName()
-                ret[vName] = vSurfaces
-
-        elif search.lower() == "filaments":
-            if vFactory.IsFilaments(vChild):
-                vSurfaces = vFactory.ToFilaments(vChild)
-                vName = vChild.GetName()
-                ret[vName] = vSurfaces
-
-        elif search.lower() == "cells":
-            if vFactory.IsCells(vChild):
-                vSurfaces = vFactory.ToCells(vChild)
-                vName = vChild.GetName()
-                ret[vName] = vSurfaces
-
-    return(ret)
\ No newline at end of file
+    # renamed, removed or added within a group, which the staleness check does not see
+    return(get_scene_catalog(vImaris, refresh=True).get_object(search=search, name=name))
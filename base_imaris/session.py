@@ -0,0 +1,149 @@
+#
+# Reusable connection to Imaris, created once per XTension instead of once per helper call
+#
+
+
+class ImarisSession(object):
+    """
+
+    Holds the ImarisLib, server and application proxies and reuses them across calls.
+    Every base_imaris function taking vImaris also accepts a session.
+
+    e.g. :
+
+    session = ImarisSession(aImarisId)
+    vImaris = session.get_application()
+    surfaces = GetSurpassObjects(vImaris=session, search='surfaces')
+
+    :param aImarisId: Imaris application ID, default is the first running application
+    :param imaris_lib: Callable creating the ImarisLib object, default is ImarisLib.ImarisLib
+                       (e.g. base_imaris.fake.FakeImarisLib for a local stand-in)
+    """
+
+    def __init__(self, aImarisId=None, imaris_lib=None):
+        self.aImarisId = aImarisId
+        self._imaris_lib = imaris_lib
+        self._lib = None
+        self._server = None
+        self._applications = {}
+        self.catalogs = {}
+
+    def get_lib(self):
+        """
+
+        :return: ImarisLib object, created on first use
+        """
+
+        if self._lib is None:
+            if self._imaris_lib is None:
+                import ImarisLib
+                self._imaris_lib = ImarisLib.ImarisLib
+            self._lib = self._imaris_lib()
+
+        return(self._lib)
+
+    def get_server(self, check=False):
+        """
+
+        :param check: Reconnect if the cached server does not respond
+        :return: Imaris server proxy
+        """
+
+        if self._server is not None and check and not self.is_alive():
+            self.reconnect()
+
+        if self._server is None:
+            self._server = self.get_lib().GetServer()
+
+        return(self._server)
+
+    def get_object_ids(self):
+        """
+
+        :return: List of IDs (aImarisID) of all running Imaris applications
+        """
+
+        vServer = self.get_server()
+        vNumberOfObjects = vServer.GetNumberOfObjects()
+
+        return([vServer.GetObjectID(vIndex) for vIndex in range(vNumberOfObjects)])
+
+    def get_application(self, aImarisId=None, check=False):
+        """
+
+        :param aImarisId: Imaris application ID, default is the session application
+        :param check: Reconnect if the cached application does not respond
+        :return: Imaris application proxy, cached per application ID
+        """
+
+        if aImarisId is None:
+            if self.aImarisId is None:
+                object_ids = self.get_object_ids()
+                if len(object_ids) == 0:
+                    raise RuntimeError('No running Imaris application found')
+                self.aImarisId = object_ids[0]
+            aImarisId = self.aImarisId
+
+        vImaris = self._applications.get(aImarisId)
+        if vImaris is not None and check and not self.is_alive(vImaris):
+            self.reconnect()
+            vImaris = None
+
+        if vImaris is None:
+            vImaris = self.get_lib().GetApplication(aImarisId)
+            if vImaris is None:
+                raise RuntimeError('Imaris application ' + str(aImarisId) + ' not found')
+            self._applications[aImarisId] = vImaris
+
+        return(vImaris)
+
+    def get_file_names(self):
+        """
+
+        :return: Dictionary of ImarisIDs and corresponding data files
+        """
+
+        return(dict((aImarisId, self.get_application(aImarisId).GetCurrentFileName())
+                    for aImarisId in self.get_object_ids()))
+
+    def is_alive(self, vImaris=None):
+        """
+
+        :param vImaris: Application proxy to check, default checks the server
+        :return: True if the proxy answers a call
+        """
+
+        try:
+            if vImaris is None:
+                if self._server is None:
+                    return(False)
+                self._server.GetNumberOfObjects()
+            else:
+                vImaris.GetCurrentFileName()
+            return(True)
+        except Exception:
+            return(False)
+
+    def reconnect(self):
+        """
+
+        :return: Drops all cached proxies, they are recreated on next use
+        """
+
+        self._lib = None
+        self._server = None
+        self._applications = {}
+        self.catalogs = {}
+
+
+def get_application(vImaris):
+    """
+
+    :param vImaris: Imaris application or ImarisSession
+    :return: Imaris application
+    """
+
+    if isinstance(vImaris, ImarisSession):
+        return(vImaris.get_application())
+
+    return(vImaris)
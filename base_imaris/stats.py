@@ -1,81 +1,398 @@
+import os
+import tempfile
 import pandas as pd
 import numpy as np
-from objects import GetSurpassObjects
+from concurrent.futures import ThreadPoolExecutor
+from cvbi.base_imaris.objects import GetSurpassObject
+from cvbi.base_imaris.tracks import get_object_tracks
 
 
-def get_statistics_cell(vImaris , object_type , object_name):
+def get_wide_statistics(ids, names, values, row_ids=None, min_id=None, chunk_size=2**18):
+    """
+
+    Reshape Imaris long format statistics (mIds, mNames, mValues) into a wide array without pandas reshaping.
+    The long lists are read in chunks and scattered into a preallocated array, so memory depends on the
+    size of the wide array and not on the number of long rows.
 
+    :param ids: statistic object IDs (mIds)
+    :param names: statistic names (mNames)
+    :param values: statistic values (mValues)
+    :param row_ids: object IDs to keep, in output row order, default is all IDs in increasing order
+    :param min_id: keep only IDs above min_id, e.g. 100000 for track level statistics
+    :param chunk_size: number of long rows converted at a time
+    :return:
+    rows = IDs of the rows kept (objects with at least one statistic)
+    columns = sorted statistic names with at least one value
+    data = float64 array of size (len(rows), len(columns)), mean over duplicate (ID, name) pairs, NaN if missing
     """
 
-    :param vImaris: imaris instance
-    :param object_type: imaris object type
-    :param object_name: imaris object name
-    :return: cell level statistics
+    n_long = len(ids)
+    chunks = [(start, min(start + chunk_size, n_long)) for start in range(0, n_long, chunk_size)]
+
+    def read_chunk(start, stop):
+        chunk_ids = np.asarray(ids[start:stop], dtype=np.int64)
+        if min_id is not None:
+            # convert only the names of the rows kept
+            use = np.where(chunk_ids > min_id)[0]
+            chunk_names = np.array([names[start + i] for i in use], dtype=object)
+            return(chunk_ids[use], chunk_names, use)
+        chunk_names = np.asarray(names[start:stop], dtype=object)
+        return(chunk_ids, chunk_names, slice(None))
+
+    # first pass, statistic names (and IDs if not given)
+    column_set = set()
+    id_chunks = []
+    for start, stop in chunks:
+        chunk_ids, chunk_names, _ = read_chunk(start, stop)
+        column_set.update(pd.unique(chunk_names))
+        if row_ids is None:
+            id_chunks.append(np.unique(chunk_ids))
+
+    columns = np.array(sorted(column_set), dtype=object)
+    column_codes = dict((name, code) for code, name in enumerate(columns))
+    if row_ids is None:
+        row_ids = np.unique(np.concatenate(id_chunks)) if id_chunks else np.zeros(0, dtype=np.int64)
+    row_ids = np.asarray(row_ids, dtype=np.int64)
+    n_rows, n_cols = len(row_ids), len(columns)
+
+    # IDs are mapped to rows through a lookup table when they are dense (Imaris IDs usually are)
+    id_min = row_ids.min() if n_rows else 0
+    id_range = (row_ids.max() - id_min + 1) if n_rows else 0
+    if n_rows and id_range <= 4 * n_rows + chunk_size:
+        lookup = np.full(id_range, -1, dtype=np.int64)
+        lookup[row_ids - id_min] = np.arange(n_rows)
+    else:
+        lookup = None
+        sorter = np.argsort(row_ids, kind='mergesort')
+
+    # second pass, scatter values (sums and counts, for the mean over duplicates) into the wide array
+    data = np.zeros(n_rows * n_cols)
+    counts = np.zeros(n_rows * n_cols, dtype=np.uint16)
+    row_present = np.zeros(n_rows, dtype=bool)
+
+    for start, stop in chunks:
+        chunk_ids, chunk_names, use = read_chunk(start, stop)
+        chunk_values = np.asarray(values[start:stop], dtype=np.float64)[use]
+        if n_rows == 0 or len(chunk_ids) == 0:
+            continue
+
+        chunk_codes, chunk_columns = pd.factorize(chunk_names)
+        chunk_codes = np.array([column_codes[name] for name in chunk_columns], dtype=np.int64)[chunk_codes]
+
+        if lookup is not None:
+            offsets = chunk_ids - id_min
+            inside = (offsets >= 0) & (offsets < id_range)
+            chunk_rows = np.where(inside, lookup[np.where(inside, offsets, 0)], -1)
+            keep = chunk_rows >= 0
+        else:
+            positions = np.clip(np.searchsorted(row_ids, chunk_ids, sorter=sorter), 0, n_rows - 1)
+            chunk_rows = sorter[positions]
+            keep = row_ids[chunk_rows] == chunk_ids
+        row_present[chunk_rows[keep]] = True
+
+        keep &= ~np.isnan(chunk_values)
+        flat = chunk_rows[keep] * n_cols + chunk_codes[keep]
+        np.add.at(data, flat, chunk_values[keep])
+        np.add.at(counts, flat, 1)
+
+    data = data.reshape((n_rows, n_cols))
+    counts = counts.reshape((n_rows, n_cols))
+    np.divide(data, counts, out=data, where=counts > 1)
+    data[counts == 0] = np.nan
+
+    # drop objects without statistics and statistics without values, copying only if needed
+    rows_kept = np.where(row_present)[0]
+    columns_kept = np.where(counts.any(axis=0))[0]
+    if len(rows_kept) < n_rows:
+        data = data[rows_kept]
+    if len(columns_kept) < n_cols:
+        data = data[:, columns_kept]
+
+    return(row_ids[rows_kept], list(columns[columns_kept]), data)
+
+
+def _get_track_mapping(object_cells):
+    """
+
+    :param object_cells: Imaris spots / surfaces object
+    :return: object IDs and their track IDs (int64), sorted by track and object
+    """
 
+    # Tracks are the connected components of the track edges
+    tracks = get_object_tracks(object_cells)
+    object_ids, track_ids = tracks['object_ids'], tracks['cell_track_ids']
+
+    # rows sorted by track and object
+    row_order = np.lexsort((object_ids, track_ids))
+
+    return(object_ids[row_order], track_ids[row_order])
+
+
+def _fetch_statistics(object_cells, names=None, max_workers=4):
+    """
+
+    :param object_cells: Imaris spots / surfaces object
+    :param names: statistic names to fetch, default fetches all statistics with a single GetStatistics call
+    :param max_workers: number of concurrent GetStatisticsByName requests
+    :return: ids, names and values of the fetched statistics (long format)
     """
 
-    objects = GetSurpassObjects(vImaris=vImaris, search=object_type)
-    object_cells = objects[object_name]
-    object_cell_stats = object_cells.GetStatistics()
+    if names is None or not hasattr(object_cells, 'GetStatisticsByName'):
+        object_cell_stats = object_cells.GetStatistics()
+        if names is None:
+            return(object_cell_stats.mIds, object_cell_stats.mNames, object_cell_stats.mValues)
 
-    # Get individual cell IDs and track IDs to create set of edges which form a track
+        # Older Imaris versions only ship all statistics, keep the requested names
+        all_names = np.asarray(object_cell_stats.mNames, dtype=object)
+        use = np.isin(all_names, list(names))
+        return(np.asarray(object_cell_stats.mIds, dtype=np.int64)[use],
+               all_names[use],
+               np.asarray(object_cell_stats.mValues, dtype=np.float64)[use])
 
-    cells = object_cells.GetIds()
-    tracks = object_cells.GetTrackIds()
-    edges_indices = object_cells.GetTrackEdges()
-    edges = [[str(cells[start]),str(cells[stop])] for [start, stop] in edges_indices]
+    # One request per statistic name, sent concurrently over the ICE connection
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(object_cells.GetStatisticsByName, names))
 
-    track_cell_mapping = {}
-    for trackID, (start, stop) in zip(tracks, edges_indices):
+    ids = np.concatenate([np.asarray(r.mIds, dtype=np.int64) for r in results] + [np.zeros(0, dtype=np.int64)])
+    values = np.concatenate([np.asarray(r.mValues, dtype=np.float64) for r in results] + [np.zeros(0)])
+    long_names = np.repeat(np.array(list(names), dtype=object), [len(r.mIds) for r in results])
 
-        start = cells[start]
-        stop = cells[stop]
+    return(ids, long_names, values)
 
-        track_cell_mapping[str(start)] = str(trackID)
-        track_cell_mapping[str(stop)] = str(trackID)
 
-    track_cell_mapping_df = pd.DataFrame.from_dict(track_cell_mapping, orient='index')
-    track_cell_mapping_df.reset_index(inplace=True)
-    track_cell_mapping_df.columns = ['objectID', 'trackID']
+def _get_cell_table(ids, long_names, values, object_ids, track_ids):
+    """
 
-    stats_df = pd.DataFrame({'objectID': [str(objectID) for objectID in object_cell_stats.mIds],
-                             'names': object_cell_stats.mNames,
-                             'values': object_cell_stats.mValues})
+    :param ids: statistic object IDs (long format)
+    :param long_names: statistic names (long format)
+    :param values: statistic values (long format)
+    :param object_ids: object IDs of the rows, sorted by track and object
+    :param track_ids: track ID of every row
+    :return: cell level statistics as get_statistics_cell, for the given objects only
+    """
 
-    stats_track_df = pd.merge(left=track_cell_mapping_df,
-                              right=stats_df,
-                              how='inner')
+    rows, columns, data = get_wide_statistics(ids=ids, names=long_names, values=values, row_ids=object_ids)
 
-    stats_pivot = stats_track_df.pivot_table(index=['trackID', 'objectID'],
-                                             columns='names',
-                                             values='values')
-    stats_pivot_df = stats_pivot.reset_index()
+    stats_pivot_df = pd.DataFrame(data, columns=pd.Index(columns, name='names'), copy=False)
+    stats_pivot_df.insert(0, 'objectID', rows)
+    stats_pivot_df.insert(0, 'trackID', track_ids[np.isin(object_ids, rows)])
     stats_pivot_df['time'] = stats_pivot_df.loc[:, 'Time Index'].values
     stats_pivot_df['track_time'] = stats_pivot_df.loc[:, 'Time Since Track Start'].values
 
     return(stats_pivot_df)
 
 
+def get_statistics(vImaris, object_type, object_name, names=None, level='cell', time_range=None, max_workers=4):
+    """
+
+    Fetch a subset of the statistics of an Imaris object straight into a wide table
+
+    :param vImaris: imaris instance or ImarisSession
+    :param object_type: imaris object type
+    :param object_name: imaris object name
+    :param names: statistic names to fetch (e.g. ['Speed', 'Displacement^2']), default is all statistics
+    :param level: 'cell' for object level statistics of tracked objects, 'track' for track level statistics
+    :param time_range: (first, last) 'Time Index' kept, inclusive, cell level only
+    :param max_workers: number of concurrent per-name requests
+    :return: cell level statistics (as get_statistics_cell) or track level statistics (as get_statistics_track),
+             limited to the requested statistics
+    """
+
+    object_cells = GetSurpassObject(vImaris=vImaris, search=object_type, name=object_name)
+
+    if level == 'track':
+        ids, long_names, values = _fetch_statistics(object_cells, names=names, max_workers=max_workers)
+
+        # track level statistics have IDs above 100000
+        rows, columns, data = get_wide_statistics(ids=ids, names=long_names, values=values, min_id=100000)
+
+        data_df_wide = pd.DataFrame(data, columns=pd.Index(columns, name='colname'), copy=False)
+        data_df_wide.insert(0, 'trackID', rows)
+
+        return(data_df_wide)
+
+    elif level != 'cell':
+        raise ValueError('level should be one of [cell, track], got ' + str(level))
+
+    object_ids, track_ids = _get_track_mapping(object_cells)
+
+    # time columns are always needed at cell level
+    if names is not None:
+        names = list(names) + [name for name in ['Time Index', 'Time Since Track Start'] if name not in names]
+    ids, long_names, values = _fetch_statistics(object_cells, names=names, max_workers=max_workers)
+
+    # restrict rows to the time range before building the wide table
+    if time_range is not None:
+        long_names_array = np.asarray(long_names, dtype=object)
+        is_time = long_names_array == 'Time Index'
+        time_ids = np.asarray(ids, dtype=np.int64)[is_time]
+        time_values = np.asarray(values, dtype=np.float64)[is_time]
+        in_range = time_ids[(time_values >= time_range[0]) & (time_values <= time_range[1])]
+        keep = np.isin(object_ids, in_range)
+        object_ids, track_ids = object_ids[keep], track_ids[keep]
+
+    return(_get_cell_table(ids, long_names, values, object_ids, track_ids))
+
+
+def get_statistics_cell(vImaris , object_type , object_name):
+
+    """
+
+    :param vImaris: imaris instance or ImarisSession
+    :param object_type: imaris object type
+    :param object_name: imaris object name
+    :return: cell level statistics
+
+    """
+
+    return(get_statistics(vImaris=vImaris, object_type=object_type, object_name=object_name, level='cell'))
+
+
 
 def get_statistics_track(vImaris , object_type , object_name):
 
     """
 
-    :param vImaris: imaris instance
+    :param vImaris: imaris instance or ImarisSession
     :param object_type: imaris object type
     :param object_name: imaris object name
     :return: track level statistics
     """
 
-    objects = GetSurpassObjects(vImaris=vImaris, search=object_type)
-    object_cells = objects[object_name]
-    object_cell_stats = object_cells.GetStatistics()
+    return(get_statistics(vImaris=vImaris, object_type=object_type, object_name=object_name, level='track'))
+
+
+def _get_chunk_bounds(starts, n_rows, chunk_size):
+    """
+
+    :param starts: sorted start row of every group (track or time index), first is 0
+    :param n_rows: number of rows
+    :param chunk_size: maximum number of rows per chunk, a larger group is a chunk of its own
+    :return: list of (start, stop) rows, boundaries fall on group starts
+    """
+
+    bounds = []
+    edges = np.append(np.asarray(starts, dtype=np.int64), n_rows)
+    start = 0
+    while start < n_rows:
+        stop = edges[np.searchsorted(edges, start + chunk_size, side='right') - 1]
+        if stop <= start:
+            stop = edges[np.searchsorted(edges, start, side='right')]
+        bounds.append((start, int(stop)))
+        start = int(stop)
+
+    return(bounds)
+
+
+def iter_statistics_cell(vImaris, object_type, object_name, names=None, chunk_size=100000, by='track',
+                         temp_dir=None):
+    """
+
+    Cell level statistics as a generator of wide chunks, for object sets too large to reshape in memory.
+    Statistics are fetched one name at a time and staged in a column-major file on disk, chunks are read back
+    from it. Memory depends on the chunk size and a single statistic, not on the number of statistics.
+
+    e.g. :
+
+    chunks = iter_statistics_cell(vImaris, 'spots', 'Th1', chunk_size=50000)
+    motility = get_motility_tracks_chunked(chunks)
+
+    :param vImaris: imaris instance or ImarisSession
+    :param object_type: imaris object type
+    :param object_name: imaris object name
+    :param names: statistic names to fetch, default is all statistics
+    :param chunk_size: maximum number of rows per chunk, a longer track (or time point) is a chunk of its own
+    :param by: 'track' yields whole tracks per chunk, 'time' yields ranges of 'Time Index'
+    :param temp_dir: directory of the staging file, default is the system temporary directory
+    :return: generator of dataframes with the columns of get_statistics_cell
+    """
+
+    if by not in ['track', 'time']:
+        raise ValueError('by should be one of [track, time], got ' + str(by))
+
+    object_cells = GetSurpassObject(vImaris=vImaris, search=object_type, name=object_name)
+    object_ids, track_ids = _get_track_mapping(object_cells)
+    n_rows = len(object_ids)
+
+    if not hasattr(object_cells, 'GetStatisticsByName'):
+        # Older Imaris versions only ship all statistics at once, nothing to gain from staging
+        data_cells = get_statistics(vImaris=vImaris, object_type=object_type, object_name=object_name, names=names)
+        if by == 'time':
+            data_cells = data_cells.iloc[np.lexsort((data_cells.trackID.values, data_cells.time.values))]
+            starts = np.where(np.append(True, np.diff(data_cells.time.values) != 0))[0]
+        else:
+            starts = np.where(np.append(True, np.diff(data_cells.trackID.values) != 0))[0]
+        for start, stop in _get_chunk_bounds(starts, data_cells.shape[0], chunk_size):
+            yield(data_cells.iloc[start:stop].reset_index(drop=True))
+        return
+
+    if names is None:
+        names = object_cells.GetStatisticsNames()
+    names = sorted(set(names) | set(['Time Index', 'Time Since Track Start']))
+
+    sorter = np.argsort(object_ids, kind='mergesort')
+    staging = tempfile.NamedTemporaryFile(suffix='.dat', dir=temp_dir, delete=False)
+    staging.close()
+
+    data = None
+    try:
+        data = np.memmap(staging.name, dtype=np.float64, mode='w+', shape=(max(n_rows, 1), len(names)), order='F')
+
+        # one statistic at a time, mean over duplicate IDs as get_wide_statistics
+        has_values = np.zeros(len(names), dtype=bool)
+        for j, name in enumerate(names):
+            r = object_cells.GetStatisticsByName(name)
+            ids = np.asarray(r.mIds, dtype=np.int64)
+            values = np.asarray(r.mValues, dtype=np.float64)
+            del r
+
+            column = np.zeros(n_rows)
+            counts = np.zeros(n_rows, dtype=np.uint16)
+            if n_rows and len(ids):
+                rows = sorter[np.clip(np.searchsorted(object_ids, ids, sorter=sorter), 0, n_rows - 1)]
+                keep = (object_ids[rows] == ids) & ~np.isnan(values)
+                np.add.at(column, rows[keep], values[keep])
+                np.add.at(counts, rows[keep], 1)
+            np.divide(column, counts, out=column, where=counts > 1)
+            column[counts == 0] = np.nan
+
+            has_values[j] = counts.any()
+            data[:n_rows, j] = column
+            del ids, values, column, counts
+
+        columns = [name for j, name in enumerate(names) if has_values[j]]
+        column_index = np.where(has_values)[0]
+        time_column = names.index('Time Index')
+        track_time_column = names.index('Time Since Track Start')
+
+        if by == 'track':
+            rows_order = None
+            starts = np.where(np.append(True, track_ids[1:] != track_ids[:-1]))[0] if n_rows else []
+        else:
+            times = np.array(data[:n_rows, time_column])
+            rows_order = np.lexsort((track_ids, times))
+            times = times[rows_order]
+            starts = np.where(np.append(True, times[1:] != times[:-1]))[0] if n_rows else []
+            del times
+
+        for start, stop in _get_chunk_bounds(starts, n_rows, chunk_size):
+            if rows_order is None:
+                chunk_rows = slice(start, stop)
+            else:
+                chunk_rows = np.sort(rows_order[start:stop])
+
+            chunk = np.array(data[chunk_rows])
+            stats_pivot_df = pd.DataFrame(chunk[:, column_index], columns=pd.Index(columns, name='names'),
+                                          copy=False)
+            stats_pivot_df.insert(0, 'objectID', object_ids[chunk_rows])
+            stats_pivot_df.insert(0, 'trackID', track_ids[chunk_rows])
+            stats_pivot_df['time'] = chunk[:, time_column]
+            stats_pivot_df['track_time'] = chunk[:, track_time_column]
 
-    data_list = [[objectID,name,unit,value] for objectID,name,unit,value in zip(object_cell_stats.mIds,
-                                                                                object_cell_stats.mNames,
-                                                                                object_cell_stats.mUnits,
-                                                                                object_cell_stats.mValues) if (objectID>100000)]
-    data_df_long = pd.DataFrame(data_list,columns=['trackID','colname','unit','values'])
-    data_df_wide = data_df_long.pivot_table(index='trackID',columns='colname').loc[:,'values'].reset_index(col_level=1)
+            yield(stats_pivot_df)
 
-    return(data_df_wide)
\ No newline at end of file
+    finally:
+        # the memmap is released before removing its file, also when the consumer stops early or fails
+        # (Windows refuses to remove a mapped file)
+        data = None
+        os.remove(staging.name)
@@ -0,0 +1,152 @@
+import numpy as np
+import pandas as pd
+
+#
+# Track assembly from Imaris track edges
+#
+
+
+def get_tracks_assembly(ids, edges, edge_track_ids=None, times=None):
+    """
+
+    Assemble tracks as connected components of the graph of track edges, including tracks which split or merge
+
+    :param ids: object IDs (GetIds)
+    :param edges: track edges as pairs of indices into ids (GetTrackEdges)
+    :param edge_track_ids: Imaris track ID of every edge (GetTrackIds), default numbers components from 0
+    :param times: time index of every object, orients edges from the earlier to the later object and orders
+                  cells within tracks, default keeps edges as given and orders cells by index
+                  (cells with equal times are ordered by index)
+    :return: dictionary with
+    object_ids = object ID of every cell within a track, sorted by track and time
+    cell_track_ids = track ID of every cell in object_ids
+    track_ids = sorted track IDs
+    offsets = cells offsets[i] : offsets[i+1] of object_ids belong to track_ids[i]
+    cell_index = index into ids of every cell in object_ids
+    splits = dataframe with trackID, objectID (parent) and childID for every edge leaving a cell with several children
+    merges = dataframe with trackID, objectID (child) and parentID for every edge entering a cell with several parents
+    """
+
+    from scipy import sparse
+    from scipy.sparse import csgraph
+
+    ids = np.asarray(ids, dtype=np.int64)
+    edges = np.asarray(edges, dtype=np.int64).reshape((-1, 2))
+    n = len(ids)
+
+    parents, children = edges[:, 0], edges[:, 1]
+    if times is not None:
+        times = np.asarray(times, dtype=np.float64)
+        flip = times[parents] > times[children]
+        parents, children = np.where(flip, children, parents), np.where(flip, parents, children)
+
+    graph = sparse.coo_matrix((np.ones(len(edges), dtype=np.int8), (parents, children)), shape=(n, n)).tocsr()
+    n_components, labels = csgraph.connected_components(graph, directed=True, connection='weak')
+
+    # cells without edges are not tracked
+    in_track = np.zeros(n, dtype=bool)
+    in_track[parents] = True
+    in_track[children] = True
+
+    # Imaris track ID of every component (the smallest one if edges disagree)
+    edge_labels = labels[parents]
+    if edge_track_ids is None:
+        used = np.unique(edge_labels)
+        component_track_ids = np.full(n_components, -1, dtype=np.int64)
+        component_track_ids[used] = np.arange(len(used))
+    else:
+        component_track_ids = np.full(n_components, np.iinfo(np.int64).max, dtype=np.int64)
+        np.minimum.at(component_track_ids, edge_labels, np.asarray(edge_track_ids, dtype=np.int64))
+
+    # cells sorted by track and time (or index), two stable sorts on small integer keys instead of a lexsort
+    cell_index = np.where(in_track)[0]
+    component_rank = np.empty(n_components, dtype=np.int64)
+    component_rank[np.argsort(component_track_ids, kind='stable')] = np.arange(n_components)
+    order = np.arange(len(cell_index))
+    if times is not None:
+        order = np.argsort(times[cell_index], kind='stable')
+    order = order[np.argsort(component_rank[labels[cell_index[order]]], kind='stable')]
+    cell_index = cell_index[order]
+    cell_track_ids = component_track_ids[labels[cell_index]]
+
+    track_starts = np.where(np.append(True, cell_track_ids[1:] != cell_track_ids[:-1]))[0] if len(order) else []
+    offsets = np.append(track_starts, len(order)).astype(np.int64)
+
+    # splits and merges, cells with several children / parents
+    out_degree = np.bincount(parents, minlength=n)
+    in_degree = np.bincount(children, minlength=n)
+
+    split_edges = np.where(out_degree[parents] > 1)[0]
+    split_edges = split_edges[np.lexsort((ids[children[split_edges]], ids[parents[split_edges]]))]
+    splits = pd.DataFrame({'trackID': component_track_ids[labels[parents[split_edges]]],
+                           'objectID': ids[parents[split_edges]],
+                           'childID': ids[children[split_edges]]})
+
+    merge_edges = np.where(in_degree[children] > 1)[0]
+    merge_edges = merge_edges[np.lexsort((ids[parents[merge_edges]], ids[children[merge_edges]]))]
+    merges = pd.DataFrame({'trackID': component_track_ids[labels[children[merge_edges]]],
+                           'objectID': ids[children[merge_edges]],
+                           'parentID': ids[parents[merge_edges]]})
+
+    return({'object_ids': ids[cell_index],
+            'cell_track_ids': cell_track_ids,
+            'track_ids': cell_track_ids[offsets[:-1]],
+            'offsets': offsets,
+            'cell_index': cell_index,
+            'splits': splits,
+            'merges': merges})
+
+
+def get_object_tracks(object_cells, times=None):
+    """
+
+    :param object_cells: Imaris spots / surfaces object
+    :param times: time index of every object in GetIds order, see get_tracks_assembly
+    :return: get_tracks_assembly of the object
+    """
+
+    return(get_tracks_assembly(ids=object_cells.GetIds(),
+                               edges=object_cells.GetTrackEdges(),
+                               edge_track_ids=object_cells.GetTrackIds(),
+                               times=times))
+
+
+def get_track_hashes(tracks, ids, edges):
+    """
+
+    Content hash of every track, the same set of objects joined by the same edges always gives the same hash,
+    whatever the Imaris track ID or the order of GetIds / GetTrackEdges
+
+    :param tracks: get_tracks_assembly of ids and edges
+    :param ids: object IDs (GetIds)
+    :param edges: track edges as pairs of indices into ids (GetTrackEdges)
+    :return: array of hex digests in tracks['track_ids'] order
+    """
+
+    import hashlib
+
+    ids = np.asarray(ids, dtype=np.int64)
+    edges = np.asarray(edges, dtype=np.int64).reshape((-1, 2))
+    offsets = tracks['offsets']
+    n_tracks = len(offsets) - 1
+
+    # objects of every track in ID order
+    cell_codes = np.repeat(np.arange(n_tracks), np.diff(offsets))
+    object_ids = tracks['object_ids'][np.lexsort((tracks['object_ids'], cell_codes))]
+
+    # edges of every track as sorted (ID, ID) pairs
+    track_of = np.full(len(ids), -1, dtype=np.int64)
+    track_of[tracks['cell_index']] = cell_codes
+    edge_ids = np.sort(ids[edges], axis=1)
+    edge_codes = track_of[edges[:, 0]]
+    edge_order = np.lexsort((edge_ids[:, 1], edge_ids[:, 0], edge_codes))
+    edge_ids = np.ascontiguousarray(edge_ids[edge_order])
+    edge_offsets = np.searchsorted(edge_codes[edge_order], np.arange(n_tracks + 1))
+
+    hashes = np.empty(n_tracks, dtype=object)
+    for i in range(n_tracks):
+        h = hashlib.sha1(object_ids[offsets[i]:offsets[i + 1]].tobytes())
+        h.update(edge_ids[edge_offsets[i]:edge_offsets[i + 1]].tobytes())
+        hashes[i] = h.hexdigest()
+
+    return(hashes)
@@ -0,0 +1,159 @@
+import hashlib
+import warnings
+import numpy as np
+from cvbi.base_imaris.objects import GetSurpassObject
+from cvbi.base_imaris.session import get_application
+
+#
+# Write computed metrics back into Imaris as custom statistics
+#
+
+# Imaris statistic category of every object type
+CATEGORIES = {'spots': 'Spot', 'surfaces': 'Surface', 'cells': 'Cell', 'filaments': 'Filament'}
+
+
+def get_statistics_payload(df, columns, id_column='objectID', units=None, category='Spot', time_column=None,
+                           prefix=''):
+    """
+
+    Build the AddStatistics arguments for several columns at once, NaN and infinite values are left out
+
+    :param df: Wide metrics frame, e.g. output of stats.movement.get_metrics_cells
+    :param columns: Columns to write
+    :param id_column: Column with the Imaris IDs, objectID or trackID
+    :param units: Dictionary of column -> unit, default is no unit
+    :param category: Imaris statistic category, e.g. Spot, Surface or Track
+    :param time_column: Column with the time index of every row, written as the Time factor
+    :param prefix: Prefix of the statistic names
+    :return: aNames, aValues, aUnits, aFactors, aFactorNames, aIds (arguments of AddStatistics)
+    """
+
+    ids = np.asarray(df.loc[:, id_column].values, dtype=np.int64)
+    values = np.asarray(df.loc[:, list(columns)].values, dtype=np.float64).T
+    keep = np.isfinite(values)
+    counts = keep.sum(axis=1)
+    n = int(counts.sum())
+
+    column_index = np.repeat(np.arange(len(columns)), counts)
+    row_index = np.nonzero(keep)[1]
+
+    statistic_names = np.array([prefix + str(column) for column in columns], dtype=object)
+    statistic_units = np.array([(units or {}).get(column, '') for column in columns], dtype=object)
+
+    aNames = statistic_names[column_index].tolist()
+    aUnits = statistic_units[column_index].tolist()
+    aValues = values[keep].tolist()
+    aIds = ids[row_index].tolist()
+
+    aFactorNames = ['Category']
+    aFactors = [[category] * n]
+    if time_column is not None:
+        times, time_codes = np.unique(np.asarray(df.loc[:, time_column].values, dtype=np.float64),
+                                      return_inverse=True)
+        time_names = np.array([str(int(t)) if not np.isnan(t) else '' for t in times], dtype=object)
+        aFactorNames.append('Time')
+        aFactors.append(time_names[time_codes.ravel()][row_index].tolist())
+
+    return(aNames, aValues, aUnits, aFactors, aFactorNames, aIds)
+
+
+class StatisticsWriter(object):
+    """
+
+    Writes metrics frames into Imaris objects as custom statistics. Columns are sent together in bulk
+    AddStatistics calls, and a column is only sent again once its IDs or values changed since the last write.
+    Statistics named with the prefix belong to cvbi, a new writer (e.g. of the next XTension run) replaces them.
+
+    e.g. :
+
+    writer = StatisticsWriter()
+    metrics = get_metrics_cells(data_cells)
+    writer.write(vImaris, 'spots', 'Th1', metrics, columns=['meandering_index', 'arrest_coefficient'])
+
+    :param max_values: Largest number of values sent in one AddStatistics call
+    """
+
+    def __init__(self, max_values=2000000):
+        self.max_values = max_values
+        self.digests = {}
+
+    def _get_digest(self, df, column, id_column, unit, time_column):
+        h = hashlib.sha1()
+        h.update(np.asarray(df.loc[:, id_column].values, dtype=np.int64).tobytes())
+        h.update(np.asarray(df.loc[:, column].values, dtype=np.float64).tobytes())
+        h.update(unit.encode())
+        if time_column is not None:
+            h.update(np.asarray(df.loc[:, time_column].values, dtype=np.float64).tobytes())
+        return(h.hexdigest())
+
+    def write(self, vImaris, object_type, object_name, df, columns=None, id_column='objectID', units=None,
+              time_column='time', prefix='cvbi ', force=False):
+        """
+
+        :param vImaris: imaris instance or ImarisSession
+        :param object_type: imaris object type
+        :param object_name: imaris object name
+        :param df: Wide metrics frame with one row per object (id_column='objectID') or per track ('trackID')
+        :param columns: Columns to write, default is every numeric column which is not an ID or a time.
+                        Without a prefix, columns named like an existing Imaris statistic which this writer did
+                        not write are skipped with a warning.
+        :param id_column: objectID for object level statistics, trackID for track level statistics
+        :param units: Dictionary of column -> unit
+        :param time_column: Column written as the Time factor of object level statistics, None to leave it out
+        :param prefix: Prefix of the statistic names, marks the statistics written by cvbi
+        :param force: Write all columns even if unchanged
+        :return: List of the columns written
+        """
+
+        object_cells = GetSurpassObject(vImaris=vImaris, search=object_type, name=object_name)
+        object_key = (get_application(vImaris).GetCurrentFileName(), object_type.lower(), object_name, id_column)
+
+        existing = set(object_cells.GetStatisticsNames()) if hasattr(object_cells, 'GetStatisticsNames') else set()
+        written = set(name for (key, name) in self.digests if key == object_key)
+
+        if columns is None:
+            skip = set(['objectID', 'trackID', 'time', 'track_time', 'Time Index', 'Time Since Track Start',
+                        id_column, time_column])
+            columns = [column for column in df.columns
+                       if column not in skip and np.issubdtype(df[column].dtype, np.number)]
+            if not prefix:
+                # without a prefix the statistics of Imaris and of earlier runs cannot be told apart
+                skipped = [column for column in columns if str(column) in existing and str(column) not in written]
+                if skipped:
+                    warnings.warn('Skipped columns named like existing statistics of ' + str(object_name) + ': ' +
+                                  str(skipped) + ', use a prefix or pass columns to replace them')
+                columns = [column for column in columns if column not in skipped]
+
+        if id_column == 'trackID':
+            category, time_column = 'Track', None
+        else:
+            category = CATEGORIES.get(object_type.lower(), 'Spot')
+            if time_column is not None and time_column not in df.columns:
+                time_column = None
+
+        units = units or {}
+        digests = dict((column, self._get_digest(df, column, id_column, units.get(column, ''), time_column))
+                       for column in columns)
+        changed = [column for column in columns
+                   if force or self.digests.get((object_key, prefix + str(column))) != digests[column]]
+        if len(changed) == 0:
+            return([])
+
+        # replace earlier values of the changed statistics
+        if hasattr(object_cells, 'RemoveStatistics'):
+            for column in changed:
+                if prefix + str(column) in existing:
+                    object_cells.RemoveStatistics(prefix + str(column))
+
+        # as many columns per call as fit in max_values
+        rows = max(1, df.shape[0])
+        per_call = max(1, int(self.max_values / rows))
+        for start in range(0, len(changed), per_call):
+            payload = get_statistics_payload(df, changed[start:start + per_call], id_column=id_column, units=units,
+                                             category=category, time_column=time_column, prefix=prefix)
+            object_cells.AddStatistics(*payload)
+
+        for column in changed:
+            self.digests[(object_key, prefix + str(column))] = digests[column]
+
+        return(changed)
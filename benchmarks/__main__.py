@@ -0,0 +1,4 @@
+import sys
+from cvbi.benchmarks.runner import main
+
+sys.exit(main())
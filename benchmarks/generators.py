@@ -0,0 +1,166 @@
+# Seeded synthetic data for benchmarks: track tables, oriented fibre images and fake Imaris objects
+
+import numpy as np
+import pandas as pd
+from scipy import ndimage
+from cvbi.base_imaris.fake import FakeStatisticValues, FakeSurpassObject, FakeDataContainer, FakeApplication
+
+TRACK_ID_OFFSET = 1000000000
+
+
+def _get_track_table(steps, dt, seed):
+    """
+
+    :param steps: Array of size (n_tracks, track_length - 1, 3), displacement between consecutive time points
+    :param dt: Time (seconds) between time points
+    :param seed: Random seed for starting points and cluster labels
+    :return: Track table with the columns of base_imaris.stats.get_statistics_cell and cluster_label
+    """
+
+    rng = np.random.RandomState(seed + 1)
+    n_tracks, n_steps = steps.shape[:2]
+    track_length = n_steps + 1
+
+    start = rng.uniform(0, 500, size=(n_tracks, 1, 3))
+    positions = np.concatenate([start, start + np.cumsum(steps, axis=1)], axis=1)
+    step_length = np.concatenate([np.zeros((n_tracks, 1)), np.sqrt((steps ** 2).sum(axis=2))], axis=1)
+    time_index = np.tile(np.arange(1, track_length + 1), (n_tracks, 1))
+
+    data_cells = pd.DataFrame({'trackID': np.repeat(np.arange(n_tracks), track_length) + TRACK_ID_OFFSET,
+                               'objectID': np.arange(n_tracks * track_length),
+                               'Position X': positions[:, :, 0].ravel(),
+                               'Position Y': positions[:, :, 1].ravel(),
+                               'Position Z': positions[:, :, 2].ravel(),
+                               'Time Index': time_index.ravel().astype(np.float64),
+                               'Time Since Track Start': ((time_index - 1) * dt).ravel().astype(np.float64),
+                               'Speed': (step_length / dt).ravel(),
+                               'Displacement^2': ((positions - start) ** 2).sum(axis=2).ravel(),
+                               'Displacement Delta Length': step_length.ravel()})
+    data_cells['time'] = data_cells.loc[:, 'Time Index'].values
+    data_cells['track_time'] = data_cells.loc[:, 'Time Since Track Start'].values
+
+    # cells move in and out of clusters in runs
+    in_cluster = np.cumsum(rng.random_sample((n_tracks, track_length)) < 0.1, axis=1) % 2
+    data_cells['cluster_label'] = np.where(in_cluster.ravel() == 1, 0, -1)
+
+    return(data_cells)
+
+
+def get_random_walk_tracks(n_tracks=100, track_length=50, step_size=1.0, dt=30.0, seed=0):
+    """
+
+    :param n_tracks: Number of tracks
+    :param track_length: Number of time points per track
+    :param step_size: Standard deviation of every step along each axis
+    :param dt: Time (seconds) between time points
+    :param seed: Random seed
+    :return: Track table with the columns of base_imaris.stats.get_statistics_cell and cluster_label
+    """
+
+    rng = np.random.RandomState(seed)
+    steps = rng.normal(scale=step_size, size=(n_tracks, track_length - 1, 3))
+
+    return(_get_track_table(steps, dt=dt, seed=seed))
+
+
+def get_persistent_walk_tracks(n_tracks=100, track_length=50, speed=1.0, persistence=0.9, dt=30.0, seed=0):
+    """
+
+    :param n_tracks: Number of tracks
+    :param track_length: Number of time points per track
+    :param speed: Step length
+    :param persistence: Weight (0 to 1) of the previous direction in the next direction
+    :param dt: Time (seconds) between time points
+    :param seed: Random seed
+    :return: Track table with the columns of base_imaris.stats.get_statistics_cell and cluster_label
+    """
+
+    rng = np.random.RandomState(seed)
+    directions = np.zeros((n_tracks, track_length - 1, 3))
+
+    direction = rng.normal(size=(n_tracks, 3))
+    for t in range(track_length - 1):
+        direction = persistence * direction / np.linalg.norm(direction, axis=1, keepdims=True)
+        direction = direction + (1 - persistence) * rng.normal(size=(n_tracks, 3))
+        directions[:, t] = direction / np.linalg.norm(direction, axis=1, keepdims=True)
+
+    return(_get_track_table(directions * speed, dt=dt, seed=seed))
+
+
+def get_fibre_image(shape=(512, 512), period=8.0, correlation_length=64.0, noise=0.2, seed=0):
+    """
+
+    :param shape: Image size (rows, cols)
+    :param period: Distance (pixels) between neighbouring fibres
+    :param correlation_length: Length scale (pixels) over which the fibre orientation changes
+    :param noise: Standard deviation of the added gaussian noise
+    :param seed: Random seed
+    :return:
+    im = float64 image of oriented fibres
+    theta = fibre orientation (radians) at every pixel
+    """
+
+    rng = np.random.RandomState(seed)
+
+    # smooth orientation field
+    theta = ndimage.gaussian_filter(rng.normal(size=shape), sigma=correlation_length, mode='wrap')
+    theta = np.pi * (theta - theta.min()) / (theta.max() - theta.min() + 1e-15)
+
+    rows, cols = np.mgrid[0:shape[0], 0:shape[1]].astype(np.float64)
+    phase = 2 * np.pi / period * (cols * np.sin(theta) - rows * np.cos(theta))
+    im = 0.5 + 0.5 * np.cos(phase) + noise * rng.normal(size=shape)
+
+    return(im, theta)
+
+
+def get_fake_object(data_cells, name='Spots', kind='spots', statistics=None):
+    """
+
+    :param data_cells: Track table, e.g. output of get_random_walk_tracks
+    :param name: Object name
+    :param kind: Object type
+    :param statistics: Columns exposed as statistics, default is every column besides IDs and time copies
+    :return: base_imaris.fake.FakeSurpassObject exposing GetStatistics, GetIds, GetTrackIds and GetTrackEdges
+    """
+
+    if statistics is None:
+        statistics = [column for column in data_cells.columns
+                      if column not in ['trackID', 'objectID', 'time', 'track_time', 'cluster_label']]
+
+    df = data_cells.sort_values(['trackID', 'time'])
+    object_ids = df.objectID.values.astype(np.int64)
+    track_ids = df.trackID.values.astype(np.int64)
+
+    ids = np.sort(object_ids)
+    index = np.searchsorted(ids, object_ids)
+    same_track = track_ids[1:] == track_ids[:-1]
+    edges = np.stack([index[:-1][same_track], index[1:][same_track]], axis=1)
+
+    # long format, object level statistics followed by track level statistics
+    n = len(object_ids)
+    track_duration = df.groupby('trackID').track_time.max()
+    mIds = np.concatenate([np.tile(object_ids, len(statistics)), track_duration.index.values])
+    mNames = [name_ for name_ in statistics for _ in range(n)] + ['Track Duration'] * len(track_duration)
+    mValues = np.concatenate([df.loc[:, statistics].values.T.ravel(), track_duration.values])
+
+    return(FakeSurpassObject(name=name,
+                             kind=kind,
+                             ids=ids.tolist(),
+                             track_ids=track_ids[1:][same_track].tolist(),
+                             track_edges=edges.tolist(),
+                             statistics=FakeStatisticValues(mIds=mIds.tolist(), mNames=mNames,
+                                                            mValues=mValues.tolist())))
+
+
+def get_fake_application(data_cells, name='Spots', kind='spots', file_name='benchmark.ims'):
+    """
+
+    :param data_cells: Track table, e.g. output of get_random_walk_tracks
+    :param name: Object name
+    :param kind: Object type
+    :param file_name: File name reported by the application
+    :return: base_imaris.fake.FakeApplication with a single object in its Surpass scene
+    """
+
+    vObject = get_fake_object(data_cells, name=name, kind=kind)
+    return(FakeApplication(file_name=file_name, scene=FakeDataContainer(children=[vObject])))
@@ -0,0 +1,134 @@
+# Run the benchmarks and compare them with a stored baseline
+#
+# Timings depend on the machine, so the baseline is made on the machine the comparisons run on, e.g. from a
+# checkout of the reference version :
+#
+# python -m cvbi.benchmarks --save baseline.json
+#
+# and then after a change :
+#
+# python -m cvbi.benchmarks --compare baseline.json --tolerance 1.5
+
+import sys
+import json
+import platform
+import argparse
+import numpy as np
+import pandas as pd
+from cvbi.benchmarks.suite import run_benchmarks, BENCHMARKS
+
+
+def get_machine():
+    """
+
+    :return: Dictionary with the platform and software versions the timings depend on
+    """
+
+    return({'platform': platform.platform(),
+            'processor': platform.processor(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__})
+
+
+def save_baseline(results, path):
+    """
+
+    :param results: Output of run_benchmarks
+    :param path: JSON file written
+    :return: None
+    """
+
+    baseline = {'machine': get_machine(),
+                'results': results.to_dict(orient='records')}
+
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=1)
+
+
+def load_baseline(path, check_machine=True):
+    """
+
+    :param path: JSON file written by save_baseline
+    :param check_machine: Print a warning if the baseline was made on another machine or software versions
+    :return: pandas dataframe with the stored results
+    """
+
+    with open(path) as f:
+        baseline = json.load(f)
+
+    if check_machine:
+        machine = get_machine()
+        different = [key for key in sorted(machine) if baseline.get('machine', {}).get(key) != machine[key]]
+        if different:
+            print('Baseline ' + str(path) + ' was made with a different ' + ', '.join(different) +
+                  ', timings may not be comparable')
+
+    return(pd.DataFrame(baseline['results']))
+
+
+def compare_to_baseline(results, baseline, tolerance=1.5, min_time=5e-3):
+    """
+
+    :param results: Output of run_benchmarks
+    :param baseline: Stored results, output of load_baseline
+    :param tolerance: Largest allowed ratio of current to baseline median time
+    :param min_time: Baseline times below this (seconds) are too noisy to flag, and a benchmark only regresses
+                     if it also got slower by more than this
+    :return: pandas dataframe with benchmark, size, baseline, current, ratio and regression for every
+             benchmark and size found in both, times are the medians of the repeated runs
+    """
+
+    merged = pd.merge(baseline.loc[:, ['benchmark', 'size', 'median']],
+                      results.loc[:, ['benchmark', 'size', 'median']],
+                      on=['benchmark', 'size'],
+                      suffixes=('_baseline', '_current'))
+
+    comparison = pd.DataFrame({'benchmark': merged.benchmark.values,
+                               'size': merged['size'].values,
+                               'baseline': merged.median_baseline.values,
+                               'current': merged.median_current.values})
+    comparison['ratio'] = comparison.current.values / comparison.baseline.values
+    comparison['regression'] = ((comparison.ratio.values > tolerance) &
+                                (comparison.baseline.values >= min_time) &
+                                (comparison.current.values - comparison.baseline.values > min_time))
+
+    return(comparison)
+
+
+def main(argv=None):
+    """
+
+    :param argv: Command line arguments, default is sys.argv[1:]
+    :return: 1 if any benchmark regressed compared to the baseline, 0 otherwise
+    """
+
+    parser = argparse.ArgumentParser(description='cvbi performance benchmarks')
+    parser.add_argument('--names', nargs='*', choices=sorted(BENCHMARKS), help='benchmarks to run, default is all')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per size, medians are compared')
+    parser.add_argument('--quick', action='store_true', help='run only the small sizes')
+    parser.add_argument('--save', help='store the results as a baseline JSON file, made on the machine used for '
+                                       'the comparisons')
+    parser.add_argument('--compare', help='compare the results with a baseline JSON file written by --save')
+    parser.add_argument('--tolerance', type=float, default=1.5, help='allowed ratio of current to baseline time')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(names=args.names, repeat=args.repeat, quick=args.quick,
+                             progress=lambda name: print('Running ' + name))
+    print(results.to_string(index=False))
+
+    if args.save:
+        save_baseline(results, args.save)
+
+    if args.compare:
+        comparison = compare_to_baseline(results, load_baseline(args.compare), tolerance=args.tolerance)
+        print(comparison.to_string(index=False))
+        if comparison.regression.any():
+            print('Regressions : ' + ', '.join(comparison.benchmark[comparison.regression].unique()))
+            return(1)
+
+    return(0)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+# Cold start import time of the modules loaded by every XTension, checked against a time budget
+#
+# python -m cvbi.benchmarks.startup
+# python -m cvbi.benchmarks.startup --budget 0.2
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+# module -> cold import budget (seconds)
+BUDGETS = {'cvbi.base_imaris': 0.1,
+           'cvbi.base_imaris.connection_helpers': 0.1,
+           'cvbi.base_imaris.objects': 0.1,
+           'cvbi.gui': 0.1}
+
+# modules which should not be loaded by importing the modules above
+HEAVY_MODULES = ['numpy', 'pandas', 'scipy', 'skimage', 'sklearn', 'Tkinter', 'tkinter']
+
+_SCRIPT = '''
+import sys, time, json
+start = time.perf_counter()
+import %s
+elapsed = time.perf_counter() - start
+print(json.dumps({'time': elapsed, 'heavy': [m for m in %r if m in sys.modules]}))
+'''
+
+
+def get_import_time(module, repeat=5, python=None):
+    """
+
+    :param module: Module name
+    :param repeat: Number of fresh interpreters, the fastest one is kept
+    :param python: Python executable, default is the current one
+    :return: Best import time (seconds) and the heavy modules loaded by the import
+    """
+
+    cvbi_parent = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = cvbi_parent + os.pathsep + env.get('PYTHONPATH', '')
+
+    times = []
+    heavy = []
+    for _ in range(repeat):
+        output = subprocess.check_output([python or sys.executable, '-c', _SCRIPT % (module, HEAVY_MODULES)],
+                                         env=env)
+        result = json.loads(output.decode().strip().splitlines()[-1])
+        times.append(result['time'])
+        heavy = result['heavy']
+
+    return(min(times), heavy)
+
+
+def check_startup(budgets=None, repeat=5):
+    """
+
+    :param budgets: Dictionary of module -> budget (seconds), default is BUDGETS
+    :param repeat: Number of fresh interpreters per module
+    :return: list of dictionaries with module, time, budget, heavy modules loaded and passed
+    """
+
+    results = []
+    for module, budget in sorted((budgets or BUDGETS).items()):
+        elapsed, heavy = get_import_time(module, repeat=repeat)
+        results.append({'module': module,
+                        'time': elapsed,
+                        'budget': budget,
+                        'heavy': heavy,
+                        'passed': elapsed <= budget and len(heavy) == 0})
+
+    return(results)
+
+
+def main(argv=None):
+    """
+
+    :param argv: Command line arguments, default is sys.argv[1:]
+    :return: 1 if a module goes over its budget or loads a heavy module, 0 otherwise
+    """
+
+    parser = argparse.ArgumentParser(description='cvbi cold start import budget')
+    parser.add_argument('--budget', type=float, help='budget (seconds) used for every module')
+    parser.add_argument('--repeat', type=int, default=5, help='fresh interpreters per module')
+    args = parser.parse_args(argv)
+
+    budgets = BUDGETS
+    if args.budget is not None:
+        budgets = dict((module, args.budget) for module in BUDGETS)
+
+    results = check_startup(budgets=budgets, repeat=args.repeat)
+    for r in results:
+        print('%-40s %8.1f ms  budget %6.1f ms  %s%s' % (r['module'], r['time'] * 1e3, r['budget'] * 1e3,
+                                                         'ok' if r['passed'] else 'FAILED',
+                                                         '  loads ' + ', '.join(r['heavy']) if r['heavy'] else ''))
+
+    return(0 if all(r['passed'] for r in results) else 1)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,136 @@
+# Scaling benchmarks over size sweeps
+
+import time
+import numpy as np
+import pandas as pd
+from cvbi.benchmarks.generators import get_random_walk_tracks, get_persistent_walk_tracks, get_fibre_image, \
+    get_fake_application
+
+
+def _setup_tracks(size, seed):
+    return((get_persistent_walk_tracks(n_tracks=size, track_length=50, seed=seed),))
+
+
+def _setup_image(size, seed):
+    return((get_fibre_image(shape=(size, size), seed=seed)[0],))
+
+
+def _setup_application(size, seed):
+    return((get_fake_application(get_random_walk_tracks(n_tracks=size, track_length=50, seed=seed)),))
+
+
+def _run_image_angles(im):
+    from cvbi.image.orientation import get_image_angles
+    return(get_image_angles(im))
+
+
+def _run_metrics_per_track(data_cells):
+    from cvbi.stats.movement import get_metrics_cell, get_metrics_track, get_metrics_dataset
+    tracks = [get_metrics_track(get_metrics_cell(data_cell)) for _, data_cell in data_cells.groupby('trackID')]
+    return(get_metrics_dataset(pd.DataFrame(tracks)))
+
+
+def _run_metrics_cells(data_cells):
+    from cvbi.stats.movement import get_metrics_cells
+    return(get_metrics_cells(data_cells))
+
+
+def _run_motility_per_track(data_cells):
+    from cvbi.stats.track import get_motility
+    return([get_motility(data_cell) for _, data_cell in data_cells.groupby('trackID')])
+
+
+def _run_motility_tracks(data_cells):
+    from cvbi.stats.track import get_motility_tracks
+    return(get_motility_tracks(data_cells))
+
+
+def _run_track_angles_per_track(data_cells):
+    from cvbi.stats.track import get_track_angles
+    return([get_track_angles(data_cell) for _, data_cell in data_cells.groupby('trackID')])
+
+
+def _run_tracks_angles(data_cells):
+    from cvbi.stats.track import get_tracks_angles
+    return(get_tracks_angles(data_cells))
+
+
+def _run_msd(data_cells):
+    from cvbi.stats.msd import get_msd
+    return(get_msd(data_cells))
+
+
+def _run_statistics_cell(vImaris):
+    from cvbi.base_imaris.stats import get_statistics_cell
+    return(get_statistics_cell(vImaris, object_type='spots', object_name='Spots'))
+
+
+def _run_statistics_track(vImaris):
+    from cvbi.base_imaris.stats import get_statistics_track
+    return(get_statistics_track(vImaris, object_type='spots', object_name='Spots'))
+
+
+# name -> (setup(size, seed), run(*setup output), sizes, quick sizes)
+BENCHMARKS = {'image_angles': (_setup_image, _run_image_angles, [256, 512, 1024], [128]),
+              'metrics_per_track': (_setup_tracks, _run_metrics_per_track, [50, 200, 800], [20]),
+              'metrics_cells': (_setup_tracks, _run_metrics_cells, [200, 2000, 20000], [50]),
+              'motility_per_track': (_setup_tracks, _run_motility_per_track, [50, 200, 800], [20]),
+              'motility_tracks': (_setup_tracks, _run_motility_tracks, [200, 2000, 20000], [50]),
+              'track_angles_per_track': (_setup_tracks, _run_track_angles_per_track, [50, 200, 800], [20]),
+              'tracks_angles': (_setup_tracks, _run_tracks_angles, [200, 2000, 20000], [50]),
+              'msd': (_setup_tracks, _run_msd, [200, 2000, 20000], [50]),
+              'statistics_cell': (_setup_application, _run_statistics_cell, [100, 1000, 10000], [20]),
+              'statistics_track': (_setup_application, _run_statistics_track, [100, 1000, 10000], [20])}
+
+
+def run_benchmark(name, sizes=None, repeat=3, seed=0, quick=False):
+    """
+
+    :param name: Benchmark name, key of BENCHMARKS
+    :param sizes: Sizes to run, default is the sweep of the benchmark
+    :param repeat: Number of timed runs per size
+    :param seed: Random seed of the generated data
+    :param quick: Use the small sizes of the benchmark, e.g. for smoke tests
+    :return: list of dictionaries with benchmark, size, best, median and repeat (seconds), data setup is not timed
+    """
+
+    setup, run, default_sizes, quick_sizes = BENCHMARKS[name]
+    if sizes is None:
+        sizes = quick_sizes if quick else default_sizes
+
+    results = []
+    for size in sizes:
+        args = setup(size, seed)
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run(*args)
+            timings.append(time.perf_counter() - start)
+
+        results.append({'benchmark': name,
+                        'size': size,
+                        'best': min(timings),
+                        'median': float(np.median(timings)),
+                        'repeat': repeat})
+
+    return(results)
+
+
+def run_benchmarks(names=None, repeat=3, seed=0, quick=False, progress=None):
+    """
+
+    :param names: Benchmark names, default is all benchmarks
+    :param repeat: Number of timed runs per size
+    :param seed: Random seed of the generated data
+    :param quick: Use the small sizes of every benchmark
+    :param progress: Callable receiving every benchmark name before it runs, e.g. print
+    :return: pandas dataframe with benchmark, size, best, median and repeat
+    """
+
+    results = []
+    for name in (names if names is not None else sorted(BENCHMARKS)):
+        if progress is not None:
+            progress(name)
+        results += run_benchmark(name, repeat=repeat, seed=seed, quick=quick)
+
+    return(pd.DataFrame(results, columns=['benchmark', 'size', 'best', 'median', 'repeat']))
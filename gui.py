@@ -1,4 +1,8 @@
-import Tkinter as tk
+from cvbi.lazy import LazyModule
+
+# Tkinter is loaded when the first window is created
+tk = LazyModule('Tkinter', 'tkinter')
+filedialog = LazyModule('tkFileDialog', 'tkinter.filedialog')
 
 
 def create_window_from_list(object_list, window_title='Select one', w=500, h=800):
@@ -137,13 +141,11 @@ def get_dir(window_title= "Select Folder" , initial_dir= "~" , w=400 , h=200):
     :return: Creates a window to get string output directory
     """
 
-    import tkFileDialog
-
     window = tk.Tk()
     window.title(window_title)
     window.geometry(str(w)+"x"+str(h))
 
-    window.directory = tkFileDialog.askdirectory(initialdir=initial_dir, title=window_title)
+    window.directory = filedialog.askdirectory(initialdir=initial_dir, title=window_title)
     output_dir = window.directory
 
     closing_button = tk.Button(master=window, text='Directory Selection Complete', command=window.destroy)
@@ -153,7 +155,7 @@ def get_dir(window_title= "Select Folder" , initial_dir= "~" , w=400 , h=200):
     return(output_dir)
 
 
-def get_file(window_title= "Select File" , initial_dir= "~" , w=400 , h=200, filetypes = (("csv files","*.csv"),("all files","*.*"))):
+def get_file(window_title= "Select File" , initial_dir= "~" , w=400 , h=200, filetypes = (("csv files","*.csv"),("parquet files","*.parquet"),("feather files","*.feather"),("all files","*.*"))):
     """
     Get output directory for your file.
 
@@ -165,13 +167,11 @@ def get_file(window_title= "Select File" , initial_dir= "~" , w=400 , h=200, fil
     :return: Creates a window to get string output directory
     """
 
-    import tkFileDialog
-
     window = tk.Tk()
     window.title(window_title)
     window.geometry(str(w)+"x"+str(h))
 
-    window.filename = tkFileDialog.askopenfilename(initialdir=initial_dir, title=window_title, filetypes=filetypes)
+    window.filename = filedialog.askopenfilename(initialdir=initial_dir, title=window_title, filetypes=filetypes)
     output_file = window.filename
 
     closing_button = tk.Button(master=window, text='File Selection Complete', command=window.destroy)
@@ -1 +1,12 @@
-import numpy as np
\ No newline at end of file
+from cvbi.lazy import LazyModule, get_lazy_getattr
+
+np = LazyModule('numpy')
+
+# Submodules are imported when one of their functions is first used
+__getattr__ = get_lazy_getattr(__name__,
+                               {'get_image_angles': 'orientation',
+                                'get_order_parameter': 'orientation',
+                                'get_image_angles_tiled': 'tiled',
+                                'get_dataset_angles': 'dataset',
+                                'get_volume_angles': 'structure_tensor'},
+                               submodules=['orientation', 'tiled', 'dataset', 'structure_tensor'])
@@ -0,0 +1,247 @@
+import numpy as np
+from multiprocessing import shared_memory, get_context
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from cvbi.image.orientation import _get_angle_grid, get_order_parameter
+
+#
+# Orientation analysis over (time, channel, z) slices of an Imaris dataset
+#
+
+
+class NumpyDataSet(object):
+    """
+
+    Minimal stand-in for an Imaris IDataSet serving slices from a numpy array,
+    e.g. to run get_dataset_angles on image stacks loaded outside Imaris
+
+    :param data: numpy array of size (t, c, z, y, x)
+    """
+
+    def __init__(self, data):
+        self.data = np.asarray(data)
+
+    def GetSizeX(self):
+        return(self.data.shape[4])
+
+    def GetSizeY(self):
+        return(self.data.shape[3])
+
+    def GetSizeZ(self):
+        return(self.data.shape[2])
+
+    def GetSizeC(self):
+        return(self.data.shape[1])
+
+    def GetSizeT(self):
+        return(self.data.shape[0])
+
+    def GetDataSliceFloats(self, aIndexZ, aIndexC, aIndexT):
+        # Imaris returns slices indexed [x][y]
+        return(self.data[aIndexT, aIndexC, aIndexZ].T.astype(np.float32))
+
+    def GetDataVolumeFloats(self, aIndexC, aIndexT):
+        # Imaris returns volumes indexed [x][y][z]
+        return(self.data[aIndexT, aIndexC].transpose(2, 1, 0).astype(np.float32))
+
+
+def get_dataset_volume(vDataSet, c, t, z_indices=None):
+    """
+
+    Fetch all z slices for one channel and time point in bulk
+
+    :param vDataSet: Imaris dataset (vImaris.GetDataSet()) or NumpyDataSet
+    :param c: channel index
+    :param t: time index
+    :param z_indices: z slices to keep, default is all
+    :return: float32 array of size (z, y, x)
+    """
+
+    get_volume = getattr(vDataSet, 'GetDataVolumeFloats', None)
+    if get_volume is not None:
+        volume = np.asarray(get_volume(c, t), dtype=np.float32).transpose(2, 1, 0)
+        if z_indices is not None:
+            volume = volume[list(z_indices)]
+    else:
+        # Fall back to one call per slice if the dataset does not serve volumes
+        z_indices = range(vDataSet.GetSizeZ()) if z_indices is None else z_indices
+        volume = np.stack([np.asarray(vDataSet.GetDataSliceFloats(z, c, t), dtype=np.float32).T
+                           for z in z_indices])
+
+    return(volume)
+
+
+# shared memory views of a pool worker process, set by its initializer (the calling process does not use them,
+# so concurrent get_dataset_angles calls each have their own pool and buffers)
+_buffers = {}
+
+
+def _attach_buffers(specs):
+    """
+
+    Pool initializer
+
+    :param specs: Dictionary of name -> (shared memory name, shape, dtype)
+    :return: Stores numpy views on the shared memory blocks in the module level _buffers of the worker process
+    """
+
+    for name, (shm_name, shape, dtype) in specs.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        _buffers[name] = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+
+
+def _get_slice_angles(im, index, window_size, window_overlap, order_param_width):
+    """
+
+    :param im: Image slice of size (y, x)
+    :param index: (t, c, z) position within the outputs
+    :return: index, angle grid and order parameter grid (None without order_param_width)
+    """
+
+    angle_matrix, _, _ = _get_angle_grid(im=im, window_size=window_size, window_overlap=window_overlap, workers=1)
+
+    order_matrix = None
+    if order_param_width is not None:
+        order_matrix = get_order_parameter(angle_matrix, order_param_width=order_param_width)
+
+    return(index, angle_matrix, order_matrix)
+
+
+def _run_slice(slot, z, index, window_size, window_overlap, order_param_width):
+    """
+
+    Worker task, computes angles (and order parameter) for one slice of the shared input buffer
+
+    :param slot: Input buffer slot holding the volume
+    :param z: z position of the slice within the slot
+    :param index: (t, c, z) position within the outputs
+    :return: see _get_slice_angles
+    """
+
+    return(_get_slice_angles(_buffers['input'][1][slot, z], index, window_size, window_overlap, order_param_width))
+
+
+def get_dataset_angles(vDataSet, timepoints=None, channels=None, z_indices=None, window_size=13,
+                       window_overlap=0.05, order_param_width=2, processes=None, volumes_in_flight=2,
+                       progress=None):
+    """
+
+    Run the orientation analysis (see get_image_angles) on every (time, channel, z) slice of an Imaris dataset.
+    Volumes are fetched in bulk per (time, channel), placed in shared memory and their slices are spread over a
+    process pool; results are written into the output arrays as they complete.
+
+    :param vDataSet: Imaris dataset (vImaris.GetDataSet()) or NumpyDataSet
+    :param timepoints: time indices to process, default is all
+    :param channels: channel indices to process, default is all
+    :param z_indices: z slices to process, default is all
+    :param window_size: Window to calculate orientation for
+    :param window_overlap: Overlap fraction between adjacent windows
+    :param order_param_width: Neighbourhood half width for the order parameter, int or list of ints, None to skip it
+    :param processes: Number of worker processes, default is all cores, 1 runs in the current process
+    :param volumes_in_flight: Number of fetched volumes held in shared memory at the same time
+    :param progress: Callback progress(n_done, n_total) called as slices finish
+
+    :return: Dictionary with
+             'angle' : window angle grids of size (t, c, z, rows, cols)
+             'order' : order parameter grids of the same size, if order_param_width is given,
+                       of size (t, c, z, n_widths, rows, cols) for a list of widths
+             'grid_row', 'grid_col' : image coordinates of the window centres
+             'timepoints', 'channels', 'z_indices' : indices along the first three axes
+    """
+
+    timepoints = list(range(vDataSet.GetSizeT())) if timepoints is None else list(timepoints)
+    channels = list(range(vDataSet.GetSizeC())) if channels is None else list(channels)
+    z_indices = list(range(vDataSet.GetSizeZ())) if z_indices is None else list(z_indices)
+    size_y, size_x = vDataSet.GetSizeY(), vDataSet.GetSizeX()
+
+    window_radius = int(np.floor(window_size/2))
+    window_spacing = int(np.ceil(window_size*window_overlap))
+    grid_row = np.arange(window_radius+1, size_y-window_radius, window_spacing, dtype=int)
+    grid_col = np.arange(window_radius+1, size_x-window_radius, window_spacing, dtype=int)
+
+    output_shape = (len(timepoints), len(channels), len(z_indices), len(grid_row), len(grid_col))
+    angle = np.zeros(output_shape)
+    order = None
+    if order_param_width is not None:
+        if np.isscalar(order_param_width):
+            order = np.zeros(output_shape)
+        else:
+            order = np.zeros(output_shape[:3] + (len(order_param_width),) + output_shape[3:])
+
+    tasks = [(t_i, c_i) for t_i in range(len(timepoints)) for c_i in range(len(channels))]
+    n_total = len(tasks) * len(z_indices)
+    n_done = [0]
+
+    def store(result):
+        index, angle_matrix, order_matrix = result
+        angle[index] = angle_matrix
+        if order is not None:
+            order[index] = order_matrix
+
+    def finished(n):
+        n_done[0] += n
+        if progress is not None:
+            progress(n_done[0], n_total)
+
+    if processes == 1:
+        for t_i, c_i in tasks:
+            volume = get_dataset_volume(vDataSet, c=channels[c_i], t=timepoints[t_i], z_indices=z_indices)
+            for z_i in range(len(z_indices)):
+                store(_get_slice_angles(volume[z_i], (t_i, c_i, z_i), window_size, window_overlap,
+                                        order_param_width))
+                finished(1)
+
+    else:
+        # only the input volumes are shared, workers send back the grids of their slice
+        shape, dtype = (volumes_in_flight, len(z_indices), size_y, size_x), np.float32
+        block = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1))
+        volumes = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        try:
+            executor = ProcessPoolExecutor(max_workers=processes,
+                                           mp_context=get_context('spawn'),
+                                           initializer=_attach_buffers,
+                                           initargs=({'input': (block.name, shape, dtype)},))
+            with executor:
+                slot_futures = dict((slot, set()) for slot in range(volumes_in_flight))
+                pending = set()
+
+                for task_i, (t_i, c_i) in enumerate(tasks):
+
+                    # wait until the slices of the volume previously held in this slot are done
+                    slot = task_i % volumes_in_flight
+                    while slot_futures[slot]:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            store(future.result())
+                            for futures in slot_futures.values():
+                                futures.discard(future)
+                        finished(len(done))
+
+                    volumes[slot] = get_dataset_volume(vDataSet, c=channels[c_i], t=timepoints[t_i],
+                                                       z_indices=z_indices)
+                    for z_i in range(len(z_indices)):
+                        future = executor.submit(_run_slice, slot, z_i, (t_i, c_i, z_i),
+                                                 window_size, window_overlap, order_param_width)
+                        slot_futures[slot].add(future)
+                        pending.add(future)
+
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        store(future.result())
+                    finished(len(done))
+        finally:
+            # the view has to go before the block can be closed
+            del volumes
+            block.close()
+            block.unlink()
+
+    out = {'grid_row': grid_row,
+           'grid_col': grid_col,
+           'timepoints': timepoints,
+           'channels': channels,
+           'z_indices': z_indices,
+           'angle': angle}
+    if order is not None:
+        out['order'] = order
+
+    return(out)
@@ -1,22 +1,174 @@
 import scipy
 import numpy as np
 import scipy.ndimage
-from scipy.fftpack import fft2, fftshift
-from skimage.transform import resize
+from scipy.fft import fft2, fftshift
+from numpy.lib.stride_tricks import sliding_window_view
 
-def get_image_angles(im, window_size = 13, window_overlap = 0.05, order_param_width = 2):
+
+def _get_window_angles(windows, gauss_filter, mask, x, y, r, workers=-1):
     """
 
-    :param im: = image of size (x,y)
+    :param windows: Stack of image windows of size (n, window_size, window_size)
+    :param gauss_filter: Gaussian filter applied to every window before the FFT
+    :param mask: Circular mask applied to the FFT magnitude during moment calculation
+    :param x: Column coordinate grid for moment calculation
+    :param y: Row coordinate grid for moment calculation
+    :param r: Radius of the line scans
+    :param workers: Number of threads used by the FFT, -1 uses all cores
+    :return: theta for every window, array of size (n,)
+    """
+
+    # take the fourier transform of all windows at once and mask it
+    window_fft = fftshift(fft2(windows * gauss_filter, axes=(-2, -1), workers=workers), axes=(-2, -1))
+    window_fft = np.abs(window_fft)
+    window_fft_masked = window_fft * mask
+
+    # Calculate the various image moments
+    M00 = window_fft_masked.sum(axis=(1, 2))
+    M10 = (window_fft_masked * x).sum(axis=(1, 2))
+    M01 = (window_fft_masked * y).sum(axis=(1, 2))
+    M11 = (window_fft_masked * (x * y)).sum(axis=(1, 2))
+    M20 = (window_fft_masked * (x * x)).sum(axis=(1, 2))
+    M02 = (window_fft_masked * (y * y)).sum(axis=(1, 2))
+
+    # The Center of Mass
+    xave = M10 / M00
+    yave = M01 / M00
+
+    # Calculate the central moments
+    mu20 = M20 / M00 - xave**2
+    mu02 = M02 / M00 - yave**2
+    mu11 = M11 / M00 - xave * yave
+
+    # angle of axis of the least second moment
+    theta = 0.5 * np.arctan(2 * mu11 / (mu20 - mu02 + 1e-12))
+
+    # Convert angle to proper orientation for my frame of reference
+    theta = np.where((0 < theta) & (theta < (np.pi / 4)), np.pi / 2 - theta, theta)
+    theta = np.where(((-1 * np.pi / 4) < theta) & (theta < 0), -1 * theta, theta)
+
+    # find points to do line scans to determine the maximum and minimum orientations
+    x2 = xave - 1 + r * np.cos(theta)
+    y2 = yave - 1 - r * np.sin(theta)
+
+    x3 = xave - 1 - r * np.sin(theta)
+    y3 = yave - 1 - r * np.cos(theta)
+
+    # create points to interpolate along for linescans, one row of points per window
+    n_points = int(r)
+    steps = np.linspace(0, 1, n_points)
+    xline1 = (xave - 1)[:, None] + (x2 - xave + 1)[:, None] * steps
+    yline1 = (yave - 1)[:, None] + (y2 - yave + 1)[:, None] * steps
+    xline2 = (xave - 1)[:, None] + (x3 - xave + 1)[:, None] * steps
+    yline2 = (yave - 1)[:, None] + (y3 - yave + 1)[:, None] * steps
+
+    # Interpolate along those linescans (x is the column, y the row of a window). The window index is an exact
+    # integer coordinate, where the spline of finite values reproduces every window plane exactly, so windows
+    # are interpolated on their own. Blank windows would give log(0) = -inf and spread it to the other windows
+    # of the batch through the prefilter, the log is clamped.
+    window_log = np.log(np.maximum(window_fft, np.finfo(np.float64).tiny))
+    window_log = scipy.ndimage.spline_filter(window_log, order=3, mode='constant', output=np.float64)
+    index = np.repeat(np.arange(windows.shape[0])[:, None], n_points, axis=1)
+    line1 = scipy.ndimage.map_coordinates(window_log, np.stack((index, yline1, xline1)), order=3,
+                                          mode='constant', prefilter=False)
+    line2 = scipy.ndimage.map_coordinates(window_log, np.stack((index, yline2, xline2)), order=3,
+                                          mode='constant', prefilter=False)
+
+    # Determine which line is the maximum direction and correct theta
+    line1_max = line1.sum(axis=1) > line2.sum(axis=1)
+    rotate = np.where(line1_max, x2 < xave, x3 < xave)
+    theta = np.where(rotate, theta + np.pi / 2, theta)
+
+    return(theta)
+
+
+def _get_window_sums(integral, width):
+    """
+
+    :param integral: Integral image, zero padded on the first row and column
+    :param width: Half width of the square neighbourhood
+    :return: Sum over the neighbourhood [i-width, i+width] x [j-width, j+width] for every grid cell,
+             neighbourhoods are clipped at the far edges of the grid
+    """
+
+    rows = integral.shape[0] - 1
+    cols = integral.shape[1] - 1
+    i = np.arange(rows)
+    j = np.arange(cols)
+
+    top = np.clip(i - width, 0, rows)[:, None]
+    bottom = np.clip(i + width + 1, 0, rows)[:, None]
+    left = np.clip(j - width, 0, cols)[None, :]
+    right = np.clip(j + width + 1, 0, cols)[None, :]
+
+    sums = integral[bottom, right] - integral[top, right] - integral[bottom, left] + integral[top, left]
+    return(sums)
+
+
+def get_order_parameter(angle_matrix, order_param_width = 2):
+    """
+
+    :param angle_matrix: Matrix of window angles (radians), e.g. the window grid computed within get_image_angles
+    :param order_param_width: Neighbourhood half width (in windows), int or list of ints
+    :return:
+    order_matrix = mean of cos**2 of the angle between every window and its neighbourhood (NaN angles of
+                   neighbours are left out, cells with a NaN angle are NaN),
+                   cells closer than order_param_width to the first row/column are 0.
+                   Array of the same size as angle_matrix for a single width,
+                   stacked array of size (n_widths, rows, cols) for a list of widths
+
+    Uses cos**2(a-b) = (1 + cos(2a)cos(2b) + sin(2a)sin(2b)) / 2, so that neighbourhood means come from
+    integral images and the cost does not depend on the width.
+    """
+
+    single_width = np.isscalar(order_param_width)
+    widths = [order_param_width] if single_width else list(order_param_width)
+
+    cos_angle = np.cos(2 * angle_matrix)
+    sin_angle = np.sin(2 * angle_matrix)
+
+    # integral images are computed once and reused for all widths,
+    # undefined angles (NaN) are left out of the sums and counts instead of spreading through the cumsums
+    integral_cos = np.pad(np.nan_to_num(cos_angle).cumsum(axis=0).cumsum(axis=1), ((1, 0), (1, 0)))
+    integral_sin = np.pad(np.nan_to_num(sin_angle).cumsum(axis=0).cumsum(axis=1), ((1, 0), (1, 0)))
+    integral_count = np.pad((~np.isnan(angle_matrix)).cumsum(axis=0).cumsum(axis=1), ((1, 0), (1, 0)))
+
+    rows, cols = angle_matrix.shape
+    order_matrix = np.zeros((len(widths), rows, cols))
+
+    for k, width in enumerate(widths):
+        width = int(width)
+
+        count = _get_window_sums(integral_count, width)
+        mean_cos = _get_window_sums(integral_cos, width) / np.maximum(count, 1)
+        mean_sin = _get_window_sums(integral_sin, width) / np.maximum(count, 1)
+
+        order = 0.5 * (1 + cos_angle * mean_cos + sin_angle * mean_sin)
+
+        # Keep the neighbourhoods where the original grid is defined
+        valid = np.zeros((rows, cols), dtype=bool)
+        valid[width:rows - width + 1, width:cols - width + 1] = True
+        order_matrix[k] = np.where(valid, order, 0)
+
+    if single_width:
+        return(order_matrix[0])
+
+    return(order_matrix)
+
+
+def _get_angle_grid(im, window_size = 13, window_overlap = 0.05, batch_size = None, workers = -1):
+    """
+
+    :param im: = image of size (x,y), any array supporting 2D slicing (np.ndarray, np.memmap)
     :param window_size: Window to calculate orientation for
     :param window_overlap: Overlap fraction between adjacent windows
-    :param order_param_width:
+    :param batch_size: Number of windows transformed together, default keeps each batch around 4M pixels
+    :param workers: Number of threads used by the FFT, -1 uses all cores
     :return:
-    angle_out = angle magnitude array, same size as input
-    X,Y,U,V = To use quiver in matplotlib, if needed
+    angle_matrix = window angles on the grid of window centres
+    grid_row, grid_col = image coordinates of the window centres
     """
 
-
     # variables for analysis
     window_radius = int(np.floor(window_size/2))
     window_spacing = int(np.ceil(window_size*window_overlap))
@@ -53,95 +205,68 @@ def get_image_angles(im, window_size = 13, window_overlap = 0.05, order_param_wi
     number_rows = len(grid_row)
     number_cols = len(grid_col)
 
+    # view every window of the image through strides (no copy), one window per grid point
+    windows = sliding_window_view(im, (window_size, window_size))
+    windows = windows[::window_spacing, ::window_spacing][:number_rows, :number_cols]
+
+    # transform blocks of grid rows together, only one block of windows is copied at a time
+    if batch_size is None:
+        batch_size = int(2**22 / (window_size * window_size))
+    rows_per_batch = max(1, int(batch_size / max(number_cols, 1)))
+
     angle_matrix = np.zeros((number_rows, number_cols))
+    for row_start in range(0, number_rows, rows_per_batch):
+        row_stop = min(row_start + rows_per_batch, number_rows)
+        batch = windows[row_start:row_stop].reshape((-1, window_size, window_size)).astype(np.float64)
+        theta = _get_window_angles(windows=batch,
+                                   gauss_filter=gauss_filter,
+                                   mask=mask,
+                                   x=x,
+                                   y=y,
+                                   r=r,
+                                   workers=workers)
+
+        # Store the theta values in a matrix
+        angle_matrix[row_start:row_stop, :] = theta.reshape((row_stop - row_start, number_cols))
+
+    return(angle_matrix, grid_row, grid_col)
+
+
+def get_image_angles(im, window_size = 13, window_overlap = 0.05, order_param_width = 2, batch_size = None, workers = -1, return_order = False):
+    """
 
-    for i in grid_row:
-        for j in grid_col:
-
-            # store the local window of interest
-            window = im[i-window_radius-1:i+window_radius, j-window_radius-1:j+window_radius]
-
-            # take the fourier transform of the window and mask it
-            window_fft = fftshift(fft2(window*gauss_filter))
-            window_fft = np.real(np.sqrt(window_fft*np.conj(window_fft)))
-            window_fft_masked = window_fft*mask
-
-            # Calculate the various image moments
-            M00 = np.sum(window_fft_masked)
-            M10 = np.sum(window_fft_masked*x)
-            M01 = np.sum(window_fft_masked*y)
-            M11 = np.sum(window_fft_masked*x*y)
-            M20 = np.sum(window_fft_masked*x*x)
-            M02 = np.sum(window_fft_masked*y*y)
-
-            # The Center of Mass
-            xave = M10/M00
-            yave = M01/M00
-
-            # Calculate the central moments
-            mu20 = M20/M00 - xave**2
-            mu02 = M02/M00 - yave**2
-            mu11 = M11/M00 - xave*yave
-
-            # angle of axis of the least second moment
-            theta = 0.5 * np.arctan(2 * mu11 / (mu20-mu02+1e-12))
-
-            # Convert angle to proper orientation for my frame of reference
-            if 0 < theta < (np.pi / 4):
-                theta = np.pi/2 - theta
-            if (-1 * np.pi / 4) < theta < 0:
-                theta = -1 * theta
-
-            # find points to do line scans to determine the maximum and minimum orientations
-            x2 = xave - 1 + r * np.cos(theta)
-            y2 = yave - 1 - r * np.sin(theta)
-
-            x3 = xave - 1 - r * np.sin(theta)
-            y3 = yave - 1 - r * np.cos(theta)
-
-            # create points to interpolate along for linescans
-            xline1, yline1 = np.linspace(xave-1, x2, r), np.linspace(yave-1, y2, r)
-            xline2, yline2 = np.linspace(xave-1, x3, r), np.linspace(yave-1, y3, r)
-
-            # Interpolate along those linescans
-            line1 = scipy.ndimage.map_coordinates(np.transpose(np.log(window_fft)), np.vstack((xline1, yline1)))
-            line2 = scipy.ndimage.map_coordinates(np.transpose(np.log(window_fft)), np.vstack((xline2, yline2)))
-
-            # Determine which line is the maximum direction and correct theta
-            if np.sum(line1) > np.sum(line2):
-                maxline = line1
-                minline = line2
-                if x2 < xave:
-                    theta = theta + np.pi/2
-            else:
-                maxline = line2
-                minline = line1
-                if x3 < xave:
-                    theta = theta + np.pi/2
-
-            # Store the theta value in a matrix
-            angle_matrix[int(i/window_spacing - 1), int(j/window_spacing - 1)] = theta
-
-    # order parameter matrix calculations
-    order_matrix = np.zeros(angle_matrix.shape)
-    for i in np.arange(order_param_width, order_matrix.shape[0]-order_param_width+1):
-        for j in np.arange(order_param_width, order_matrix.shape[1]-order_param_width+1):
-            # Create a matrix of the points of interest
-            temp_matrix = angle_matrix[i-order_param_width:i+order_param_width+1, j-order_param_width:j+order_param_width+1]
-
-            # Create a matrix of the same size filled with the central vector
-            temp_angle_matrix = np.ones(temp_matrix.shape) * angle_matrix[i, j]
-
-            # Calculate the order parameter as the square of the cosine between vectors
-            compare_matrix = np.cos(temp_matrix-temp_angle_matrix) ** 2
-
-            # Store the order parameters as the mean value of cos**2
-            order_matrix[i, j] = np.mean(compare_matrix)
+    :param im: = image of size (x,y)
+    :param window_size: Window to calculate orientation for
+    :param window_overlap: Overlap fraction between adjacent windows
+    :param order_param_width: Neighbourhood half width (in windows) for the order parameter, int or list of ints
+    :param batch_size: Number of windows transformed together, default keeps each batch around 4M pixels
+    :param workers: Number of threads used by the FFT, -1 uses all cores
+    :param return_order: Whether the order parameter matrix should be returned as well
+    :return:
+    angle_out = angle magnitude array, same size as input
+    X,Y,U,V = To use quiver in matplotlib, if needed
+    order_matrix = order parameter on the window grid, only if return_order is True (see get_order_parameter)
+    """
+
+    window_radius = int(np.floor(window_size/2))
+    angle_matrix, grid_row, grid_col = _get_angle_grid(im=im,
+                                                       window_size=window_size,
+                                                       window_overlap=window_overlap,
+                                                       batch_size=batch_size,
+                                                       workers=workers)
 
     # For plotting the figure with the vector directions overlaid
     X, Y = np.meshgrid(grid_col, grid_row)
     U = np.floor(window_radius/2.) * np.sin(angle_matrix)
     V = -1 * np.floor(window_radius/2.) * np.cos(angle_matrix)
 
+    from skimage.transform import resize
+
     angle_out = resize(angle_matrix, im.shape)
+
+    if return_order:
+        # order parameter matrix calculations
+        order_matrix = get_order_parameter(angle_matrix, order_param_width=order_param_width)
+        return(angle_out,X,Y,U,V,order_matrix)
+
     return(angle_out,X,Y,U,V)
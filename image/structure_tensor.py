@@ -0,0 +1,290 @@
+import os
+import numpy as np
+import scipy.ndimage
+from concurrent.futures import ThreadPoolExecutor
+from cvbi.image.tiled import open_image, get_tiles
+
+#
+# Volumetric orientation from the structure tensor, 3D counterpart of get_image_angles
+#
+
+
+def _get_filter_radius(sigma, truncate=4.0):
+    # same radius scipy.ndimage.gaussian_filter uses
+    return(int(truncate * float(sigma) + 0.5))
+
+
+def _get_gradients(volume, sigma=1.0):
+    """
+
+    :param volume: Array of size (z, y, x)
+    :param sigma: Gaussian scale of the derivative filters (voxels)
+    :return: Gaussian derivatives (gx, gy, gz) along x (axis 2), y (axis 1) and z (axis 0), float32 arrays
+    """
+
+    volume = np.asarray(volume, dtype=np.float32)
+
+    def gaussian(g, axis, order=0, output=None):
+        return(scipy.ndimage.gaussian_filter1d(g, sigma, axis=axis, order=order,
+                                               output=np.float32 if output is None else output))
+
+    # separable filters, the smoothing along z is shared by gx and gy (8 passes instead of 9)
+    smooth_z = gaussian(volume, axis=0)
+    gx = gaussian(gaussian(smooth_z, axis=1), axis=2, order=1)
+    gy = gaussian(smooth_z, axis=1, order=1, output=smooth_z)
+    gy = gaussian(gy, axis=2, output=gy)
+    gz = gaussian(volume, axis=0, order=1)
+    gz = gaussian(gaussian(gz, axis=1, output=gz), axis=2, output=gz)
+
+    return(gx, gy, gz)
+
+
+def _get_smoothed_products(gx, gy, gz, rho=2.0):
+    """
+
+    :param gx, gy, gz: Gaussian derivatives, see _get_gradients
+    :param rho: Gaussian scale of the tensor smoothing (voxels)
+    :return: Tensor components (Jxx, Jyy, Jzz, Jxy, Jxz, Jyz), float32 arrays
+    """
+
+    # every product is smoothed in place
+    tensor = []
+    for g1, g2 in [(gx, gx), (gy, gy), (gz, gz), (gx, gy), (gx, gz), (gy, gz)]:
+        product = np.multiply(g1, g2, dtype=np.float32)
+        tensor.append(scipy.ndimage.gaussian_filter(product, sigma=rho, output=product))
+
+    return(tuple(tensor))
+
+
+def get_structure_tensor(volume, sigma=1.0, rho=2.0):
+    """
+
+    :param volume: Array of size (z, y, x)
+    :param sigma: Gaussian scale of the derivative filters (voxels)
+    :param rho: Gaussian scale of the tensor smoothing (voxels)
+    :return: Tensor components (Jxx, Jyy, Jzz, Jxy, Jxz, Jyz), float32 arrays of the size of volume
+    """
+
+    gx, gy, gz = _get_gradients(volume, sigma=sigma)
+
+    return(_get_smoothed_products(gx, gy, gz, rho=rho))
+
+
+def get_tensor_orientation(Jxx, Jyy, Jzz, Jxy, Jxz, Jyz):
+    """
+
+    Closed form eigen-decomposition of symmetric 3x3 tensors, vectorized over all voxels
+
+    :param Jxx, Jyy, Jzz, Jxy, Jxz, Jyz: Tensor components, arrays of equal size
+    :return:
+    azimuth = angle of the fibre direction within the xy plane (radians, -pi to pi)
+    elevation = angle of the fibre direction out of the xy plane (radians, 0 to pi/2)
+    coherence = (l3 - l1) / (l3 + l1) with l1 <= l2 <= l3 the eigenvalues, 0 for isotropic voxels
+    direction = unit fibre vectors (x, y, z) along the last axis, eigenvector of the smallest eigenvalue
+    """
+
+    a11, a22, a33 = [np.asarray(a, dtype=np.float64) for a in (Jxx, Jyy, Jzz)]
+    a12, a13, a23 = [np.asarray(a, dtype=np.float64) for a in (Jxy, Jxz, Jyz)]
+
+    # Eigenvalues of symmetric 3x3 matrices (trigonometric solution)
+    q = (a11 + a22 + a33) / 3.0
+    p1 = a12**2 + a13**2 + a23**2
+    p2 = (a11 - q)**2 + (a22 - q)**2 + (a33 - q)**2 + 2 * p1
+    p = np.sqrt(p2 / 6.0)
+    p_safe = np.where(p > 0, p, 1)
+
+    b11, b22, b33 = (a11 - q) / p_safe, (a22 - q) / p_safe, (a33 - q) / p_safe
+    b12, b13, b23 = a12 / p_safe, a13 / p_safe, a23 / p_safe
+    det_b = b11 * (b22 * b33 - b23**2) - b12 * (b12 * b33 - b23 * b13) + b13 * (b12 * b23 - b22 * b13)
+    phi = np.arccos(np.clip(det_b / 2.0, -1, 1)) / 3.0
+
+    l3 = q + 2 * p * np.cos(phi)
+    l1 = q + 2 * p * np.cos(phi + 2 * np.pi / 3)
+
+    # Eigenvector of the smallest eigenvalue, cross product of the two most independent rows of (A - l1 I)
+    d11, d22, d33 = a11 - l1, a22 - l1, a33 - l1
+    crosses = [(a12 * a23 - a13 * d22, a13 * a12 - d11 * a23, d11 * d22 - a12 * a12),
+               (a12 * d33 - a13 * a23, a13 * a13 - d11 * d33, d11 * a23 - a12 * a13),
+               (d22 * d33 - a23 * a23, a23 * a13 - a12 * d33, a12 * a23 - d22 * a13)]
+    norms = [cx * cx + cy * cy + cz * cz for cx, cy, cz in crosses]
+
+    cx, cy, cz = crosses[0]
+    norm = norms[0]
+    for cross, cross_norm in zip(crosses[1:], norms[1:]):
+        better = cross_norm > norm
+        cx, cy, cz = [np.where(better, c, c_best) for c, c_best in zip(cross, (cx, cy, cz))]
+        norm = np.where(better, cross_norm, norm)
+    norm = np.sqrt(norm)
+
+    # Orientations are axial, keep the vectors pointing up in z
+    scale = np.where(cz < 0, -1.0, 1.0) / np.where(norm > 0, norm, 1)
+    direction = np.stack((cx * scale, cy * scale, cz * scale), axis=-1)
+
+    azimuth = np.arctan2(direction[..., 1], direction[..., 0])
+    elevation = np.arcsin(np.clip(direction[..., 2], -1, 1))
+    coherence = np.where((l3 + l1) > 0, (l3 - l1) / np.where((l3 + l1) > 0, l3 + l1, 1), 0)
+
+    return(azimuth, elevation, coherence, direction)
+
+
+def get_volume_order_parameter(direction, order_param_width=2):
+    """
+
+    3D order parameter, mean of cos**2 of the angle between every fibre direction and its neighbourhood
+
+    :param direction: Unit fibre vectors of size (z, y, x, 3)
+    :param order_param_width: Neighbourhood half width (voxels), int or list of ints
+    :return: Array of size (z, y, x) for a single width, (n_widths, z, y, x) for a list of widths.
+             Neighbourhoods are clipped at the edges of the volume.
+
+    Uses (u.v)**2 = sum_ij u_i u_j v_i v_j, so the neighbourhood means of the 6 unique outer product
+    components come from box filters and the cost does not depend on the width.
+    """
+
+    single_width = np.isscalar(order_param_width)
+    widths = [order_param_width] if single_width else list(order_param_width)
+
+    direction = np.asarray(direction, dtype=np.float64)
+    pairs = [(0, 0), (1, 1), (2, 2), (0, 1), (0, 2), (1, 2)]
+    weights = [1, 1, 1, 2, 2, 2]
+    products = [direction[..., i] * direction[..., j] for i, j in pairs]
+    ones = np.ones(direction.shape[:-1])
+
+    order_matrix = np.zeros((len(widths),) + direction.shape[:-1])
+    for k, width in enumerate(widths):
+        size = 2 * int(width) + 1
+        count = scipy.ndimage.uniform_filter(ones, size=size, mode='constant')
+        for (i, j), weight, product in zip(pairs, weights, products):
+            mean_product = scipy.ndimage.uniform_filter(product, size=size, mode='constant') / count
+            order_matrix[k] += weight * direction[..., i] * direction[..., j] * mean_product
+
+    if single_width:
+        return(order_matrix[0])
+
+    return(order_matrix)
+
+
+def get_volume_angles(volume, sigma=1.0, rho=2.0, spacing=1, order_param_width=None, chunk_size=(64, None, None),
+                      output_dir=None, workers=None):
+    """
+
+    Structure tensor orientation for every voxel (or every spacing-th voxel) of a volume. The volume is
+    processed in chunks with halos covering both gaussian filters, so chunked and whole-volume results agree
+    and peak memory depends on chunk_size.
+
+    :param volume: Volume of size (z, y, x) as np.ndarray, np.memmap or path to a .npy / .tif file
+    :param sigma: Gaussian scale of the derivative filters (voxels)
+    :param rho: Gaussian scale of the tensor smoothing (voxels), sets the size of the local neighbourhood
+    :param spacing: Keep every spacing-th voxel along each axis in the outputs (grid of voxels)
+    :param order_param_width: Neighbourhood half width (grid units) for the 3D order parameter, None to skip it
+    :param chunk_size: Chunk size (z, y, x) in voxels, rounded up to a multiple of spacing, None for the whole axis.
+                       The default processes slabs of whole planes, so only z has halos. Every worker holds
+                       about 10 float32 copies of its chunk and halos.
+    :param output_dir: Directory for memory mapped .npy outputs, default keeps the outputs in memory
+    :param workers: Number of threads processing chunks, default is all cores
+
+    :return: Dictionary with
+             'azimuth', 'elevation', 'coherence' : arrays on the voxel grid (radians / 0 to 1)
+             'order' : 3D order parameter on the voxel grid, if order_param_width is given
+             'grid_z', 'grid_row', 'grid_col' : volume coordinates of the grid voxels
+             'output_dir' : directory containing the .npy files, if output_dir is given
+    """
+
+    volume = open_image(volume)
+    sz = volume.shape
+    spacing = int(spacing)
+    rho_halo = _get_filter_radius(rho)
+    halo = _get_filter_radius(sigma) + rho_halo
+
+    grids = [np.arange(0, n, spacing, dtype=int) for n in sz]
+    grid_shape = tuple(len(g) for g in grids)
+
+    def open_output(name, shape):
+        if output_dir is None:
+            return(np.zeros(shape, dtype=np.float32))
+        path = os.path.join(output_dir, name + '.npy')
+        return(np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=shape))
+
+    if output_dir is not None and not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    out = {'grid_z': grids[0], 'grid_row': grids[1], 'grid_col': grids[2]}
+    for name in ['azimuth', 'elevation', 'coherence']:
+        out[name] = open_output(name, grid_shape)
+
+    # Directions are kept on the grid for the order parameter pass
+    direction = open_output('direction', grid_shape + (3,)) if order_param_width is not None else None
+
+    chunks = [int(np.ceil((n if c is None else c) * 1.0 / spacing)) * spacing for c, n in zip(chunk_size, sz)]
+    tiles = [(tz, ty, tx)
+             for tz in get_tiles(sz[0], chunks[0], halo)
+             for ty in get_tiles(sz[1], chunks[1], halo)
+             for tx in get_tiles(sz[2], chunks[2], halo)]
+
+    def run_chunk(tile):
+        block = np.asarray(volume[tile[0][2]:tile[0][3], tile[1][2]:tile[1][3], tile[2][2]:tile[2][3]],
+                           dtype=np.float32)
+        gradients = _get_gradients(block, sigma=sigma)
+        del block
+
+        # the tensor smoothing only needs the gradients within rho_halo of the chunk
+        crop_starts = [max(start - rho_halo, halo_start) for start, _, halo_start, _ in tile]
+        crop = tuple(slice(crop_start - halo_start, min(stop + rho_halo, halo_stop) - halo_start)
+                     for crop_start, (_, stop, halo_start, halo_stop) in zip(crop_starts, tile))
+        tensor = _get_smoothed_products(*[g[crop] for g in gradients], rho=rho)
+        del gradients
+
+        # keep the chunk interior, on the grid
+        interior = tuple(slice(start - crop_start, stop - crop_start, spacing)
+                         for crop_start, (start, stop, _, _) in zip(crop_starts, tile))
+        tensor = [t[interior] for t in tensor]
+        target = tuple(slice(start // spacing, start // spacing + tensor[0].shape[i])
+                       for i, (start, _, _, _) in enumerate(tile))
+
+        # orientation of a few grid rows at a time, its float64 temporaries stay in cache
+        rows = max(1, int(2**16 / max(1, tensor[0].shape[2])))
+        for z in range(tensor[0].shape[0]):
+            for row in range(0, tensor[0].shape[1], rows):
+                azimuth, elevation, coherence, vectors = get_tensor_orientation(*[t[z, row:row + rows]
+                                                                                  for t in tensor])
+                row_target = (target[0].start + z, slice(target[1].start + row, target[1].start + row +
+                                                         azimuth.shape[0]), target[2])
+                out['azimuth'][row_target] = azimuth
+                out['elevation'][row_target] = elevation
+                out['coherence'][row_target] = coherence
+                if direction is not None:
+                    direction[row_target] = vectors
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(run_chunk, tiles))
+
+    if order_param_width is not None:
+        widths = order_param_width if np.isscalar(order_param_width) else list(order_param_width)
+        order_halo = int(np.max(widths))
+        order_shape = grid_shape if np.isscalar(widths) else (len(widths),) + grid_shape
+        out['order'] = open_output('order', order_shape)
+        grid_chunks = [max(1, c // spacing) for c in chunks]
+
+        def run_order_chunk(tile):
+            block = np.asarray(direction[tile[0][2]:tile[0][3], tile[1][2]:tile[1][3], tile[2][2]:tile[2][3]],
+                               dtype=np.float64)
+            order = get_volume_order_parameter(block, order_param_width=widths)
+            interior = tuple(slice(start - halo_start, stop - halo_start) for start, stop, halo_start, _ in tile)
+            target = tuple(slice(start, stop) for start, stop, _, _ in tile)
+            out['order'][(Ellipsis,) + target] = order[(Ellipsis,) + interior]
+
+        order_tiles = [(tz, ty, tx)
+                       for tz in get_tiles(grid_shape[0], grid_chunks[0], order_halo)
+                       for ty in get_tiles(grid_shape[1], grid_chunks[1], order_halo)
+                       for tx in get_tiles(grid_shape[2], grid_chunks[2], order_halo)]
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(run_order_chunk, order_tiles))
+
+    if output_dir is not None:
+        out['output_dir'] = output_dir
+        for name in ['azimuth', 'elevation', 'coherence', 'order']:
+            if name in out:
+                out[name].flush()
+
+    return(out)
@@ -0,0 +1,204 @@
+import os
+import tempfile
+import numpy as np
+import scipy.ndimage
+from cvbi.image.orientation import _get_angle_grid, get_order_parameter
+
+#
+# Out-of-core orientation analysis for images that do not fit in memory
+#
+
+
+def open_image(im, mode='r'):
+    """
+
+    Open an image without reading it into memory
+
+    :param im: np.ndarray / np.memmap (returned unchanged) or path to a .npy or .tif/.tiff file
+    :param mode: Memory map mode, default is read only
+    :return: Memory mapped array of the image
+    """
+
+    if not isinstance(im, str):
+        return(im)
+
+    extension = os.path.splitext(im)[1].lower()
+
+    if extension == '.npy':
+        return(np.load(im, mmap_mode=mode))
+
+    elif extension in ['.tif', '.tiff']:
+        import tifffile
+        return(tifffile.memmap(im, mode=mode))
+
+    raise ValueError('Unsupported image file : ' + im)
+
+
+def get_tiles(size, tile_size, halo=0):
+    """
+
+    Split a range into consecutive tiles with halos on both sides
+
+    :param size: Length of the range to split
+    :param tile_size: Length of each tile (the last one may be shorter)
+    :param halo: Number of extra elements read on both sides of a tile, clipped at the edges
+    :return: List of (start, stop, halo_start, halo_stop)
+    """
+
+    tile_size = max(1, int(tile_size))
+    tiles = []
+    for start in range(0, size, tile_size):
+        stop = min(start + tile_size, size)
+        tiles.append((start, stop, max(start - halo, 0), min(stop + halo, size)))
+
+    return(tiles)
+
+
+def get_upsampled_angles(angle_matrix, shape, rows=None, cols=None):
+    """
+
+    Compute a region of the full resolution angle image on demand,
+    same values as skimage.transform.resize(angle_matrix, shape) used by get_image_angles
+
+    :param angle_matrix: Window angle grid, np.ndarray or np.memmap
+    :param shape: Full resolution image shape
+    :param rows: slice of image rows to compute, default is all rows
+    :param cols: slice of image columns to compute, default is all columns
+    :return: Array with the requested region of the upsampled angles
+    """
+
+    rows = rows if rows is not None else slice(0, shape[0])
+    cols = cols if cols is not None else slice(0, shape[1])
+
+    # output pixel centres in grid coordinates (bilinear, as in skimage resize)
+    row_scale = angle_matrix.shape[0] * 1.0 / shape[0]
+    col_scale = angle_matrix.shape[1] * 1.0 / shape[1]
+    row_coords = (np.arange(shape[0])[rows] + 0.5) * row_scale - 0.5
+    col_coords = (np.arange(shape[1])[cols] + 0.5) * col_scale - 0.5
+
+    if len(row_coords) == 0 or len(col_coords) == 0:
+        return(np.zeros((len(row_coords), len(col_coords))))
+
+    # read only the part of the grid needed for this region
+    row_start = max(int(np.floor(row_coords.min())) - 1, 0)
+    row_stop = min(int(np.ceil(row_coords.max())) + 2, angle_matrix.shape[0])
+    col_start = max(int(np.floor(col_coords.min())) - 1, 0)
+    col_stop = min(int(np.ceil(col_coords.max())) + 2, angle_matrix.shape[1])
+    grid = np.asarray(angle_matrix[row_start:row_stop, col_start:col_stop], dtype=np.float64)
+
+    # coordinates outside the grid only occur at the true grid edges, where mirroring matches resize
+    coords = np.meshgrid(row_coords - row_start, col_coords - col_start, indexing='ij')
+    region = scipy.ndimage.map_coordinates(grid, coords, order=1, mode='mirror')
+
+    return(region)
+
+
+def get_image_angles_tiled(im, output_dir=None, window_size=13, window_overlap=0.05, order_param_width=None,
+                           tile_size=2048, upsample=False, dtype=np.float64, batch_size=None, workers=-1):
+    """
+
+    Tiled version of get_image_angles for images larger than memory. The image is read in overlapping tiles
+    (halo of window_radius around every tile) and the results are written to memory mapped .npy files, so
+    peak memory depends on tile_size and not on the image size.
+
+    :param im: Image of size (x,y) as np.ndarray, np.memmap or path to a .npy / .tif file
+    :param output_dir: Directory for the memory mapped outputs, default is a new temporary directory
+    :param window_size: Window to calculate orientation for
+    :param window_overlap: Overlap fraction between adjacent windows
+    :param order_param_width: Neighbourhood half width(s) for the order parameter, None to skip it
+    :param tile_size: Approximate tile side in image pixels
+    :param upsample: Whether the full resolution angle image (angle_out of get_image_angles) should be written,
+                     use get_upsampled_angles to compute regions of it lazily instead
+    :param dtype: dtype of the outputs
+    :param batch_size: Number of windows transformed together
+    :param workers: Number of threads used by the FFT, -1 uses all cores
+
+    :return: Dictionary with
+             'angle' : window angle grid (memmap)
+             'U', 'V' : quiver components on the window grid (memmap)
+             'order' : order parameter grid (memmap), if order_param_width is given
+             'angle_out' : full resolution angle image (memmap), if upsample is True
+             'grid_row', 'grid_col' : image coordinates of the window centres
+             'output_dir' : directory containing the .npy files
+    """
+
+    im = open_image(im)
+
+    if output_dir is None:
+        output_dir = tempfile.mkdtemp(prefix='cvbi_angles_')
+    elif not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    window_radius = int(np.floor(window_size/2))
+    window_spacing = int(np.ceil(window_size*window_overlap))
+
+    sz = im.shape
+    grid_row = np.arange(window_radius+1, sz[0]-window_radius, window_spacing, dtype=int)
+    grid_col = np.arange(window_radius+1, sz[1]-window_radius, window_spacing, dtype=int)
+    number_rows = len(grid_row)
+    number_cols = len(grid_col)
+    grid_shape = (number_rows, number_cols)
+
+    def open_output(name, shape):
+        path = os.path.join(output_dir, name + '.npy')
+        return(np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape))
+
+    out = {'grid_row': grid_row, 'grid_col': grid_col, 'output_dir': output_dir}
+    out['angle'] = open_output('angle', grid_shape)
+    out['U'] = open_output('U', grid_shape)
+    out['V'] = open_output('V', grid_shape)
+
+    # Window k starts at image pixel k*window_spacing, so a tile of grid points [start, stop) needs the image
+    # from start*window_spacing up to the end of its last window (+1 to keep the grid of the tile identical)
+    grid_tile = max(1, int(tile_size / window_spacing))
+
+    for row_start, row_stop, _, _ in get_tiles(number_rows, grid_tile):
+        for col_start, col_stop, _, _ in get_tiles(number_cols, grid_tile):
+
+            im_tile = np.asarray(im[row_start*window_spacing:(row_stop-1)*window_spacing + window_size + 1,
+                                    col_start*window_spacing:(col_stop-1)*window_spacing + window_size + 1],
+                                 dtype=np.float64)
+
+            angle_tile, _, _ = _get_angle_grid(im=im_tile,
+                                               window_size=window_size,
+                                               window_overlap=window_overlap,
+                                               batch_size=batch_size,
+                                               workers=workers)
+
+            out['angle'][row_start:row_stop, col_start:col_stop] = angle_tile
+            out['U'][row_start:row_stop, col_start:col_stop] = np.floor(window_radius/2.) * np.sin(angle_tile)
+            out['V'][row_start:row_stop, col_start:col_stop] = -1 * np.floor(window_radius/2.) * np.cos(angle_tile)
+
+    # Order parameter needs a halo of the (largest) width in grid units
+    if order_param_width is not None:
+        widths = order_param_width if np.isscalar(order_param_width) else list(order_param_width)
+        halo = int(np.max(widths))
+        order_shape = grid_shape if np.isscalar(widths) else (len(widths),) + grid_shape
+        out['order'] = open_output('order', order_shape)
+
+        for row_start, row_stop, halo_row_start, halo_row_stop in get_tiles(number_rows, grid_tile, halo):
+            for col_start, col_stop, halo_col_start, halo_col_stop in get_tiles(number_cols, grid_tile, halo):
+
+                angle_tile = np.asarray(out['angle'][halo_row_start:halo_row_stop, halo_col_start:halo_col_stop],
+                                        dtype=np.float64)
+                order_tile = get_order_parameter(angle_tile, order_param_width=widths)
+
+                out['order'][..., row_start:row_stop, col_start:col_stop] = \
+                    order_tile[..., row_start-halo_row_start:row_stop-halo_row_start,
+                               col_start-halo_col_start:col_stop-halo_col_start]
+
+    if upsample:
+        out['angle_out'] = open_output('angle_out', sz[:2])
+        for row_start, row_stop, _, _ in get_tiles(sz[0], tile_size):
+            for col_start, col_stop, _, _ in get_tiles(sz[1], tile_size):
+                out['angle_out'][row_start:row_stop, col_start:col_stop] = \
+                    get_upsampled_angles(out['angle'],
+                                         shape=sz[:2],
+                                         rows=slice(row_start, row_stop),
+                                         cols=slice(col_start, col_stop))
+
+    for name in ['angle', 'U', 'V', 'order', 'angle_out']:
+        if name in out:
+            out[name].flush()
+
+    return(out)
@@ -0,0 +1,354 @@
+# Opt-in timing and memory instrumentation of the cvbi entry points
+#
+# import cvbi.instrument as instrument
+# instrument.enable(memory=True)
+# vImaris = instrument.wrap_imaris(vImaris)     # also time ICE calls and count transferred bytes
+# ... run the extension ...
+# instrument.save_chrome_trace('trace.json')   # open in chrome://tracing or https://ui.perfetto.dev
+# print(instrument.get_summary())
+#
+# While disabled nothing is wrapped, the entry points run unchanged.
+
+import os
+import time
+import json
+import functools
+import importlib
+import threading
+import tracemalloc
+
+# module -> functions wrapped by enable()
+ENTRY_POINTS = {'cvbi.base_imaris.objects': ['GetSurpassObjects', 'GetSurpassObject', 'get_scene_catalog'],
+                'cvbi.base_imaris.stats': ['get_statistics', 'get_statistics_cell', 'get_statistics_track',
+                                           'get_wide_statistics', '_fetch_statistics', '_get_track_mapping'],
+                'cvbi.base_imaris.tracks': ['get_tracks_assembly', 'get_track_hashes'],
+                'cvbi.base_imaris.batch': ['get_statistics_instances'],
+                'cvbi.stats.movement': ['get_metrics_cell', 'get_metrics_cells', 'get_metrics_track',
+                                        'get_metrics_tracks', 'get_metrics_dataset', 'get_metrics_dataset_counts'],
+                'cvbi.stats.track': ['get_motility', 'get_motility_tracks', 'get_track_angles', 'get_tracks_angles'],
+                'cvbi.stats.msd': ['get_msd'],
+                'cvbi.image.orientation': ['get_image_angles', '_get_angle_grid', 'get_order_parameter'],
+                'cvbi.image.tiled': ['get_image_angles_tiled'],
+                'cvbi.image.dataset': ['get_dataset_volume', 'get_dataset_angles'],
+                'cvbi.image.structure_tensor': ['get_structure_tensor', 'get_volume_angles']}
+
+# ICE calls which move data, timed with the bytes they return
+ICE_CALLS = ['GetStatistics', 'GetStatisticsByName', 'GetStatisticsNames', 'GetIds', 'GetTrackIds',
+             'GetTrackEdges', 'GetDataSliceFloats', 'GetDataSliceBytes', 'GetDataSliceShorts', 'GetDataVolumeFloats',
+             'GetDataVolumeBytes', 'GetDataVolumeShorts', 'GetDataSubVolumeFloats', 'AddStatistics']
+
+_enabled = False
+_memory = False
+_events = []
+_patched = []
+_local = threading.local()
+_t0 = time.perf_counter()
+
+
+class _Stage(object):
+
+    def __init__(self, name, category, nbytes=0):
+        self.name = name
+        self.category = category
+        self.nbytes = nbytes
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+
+        if _memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+            self.memory_start = self.peak = current
+
+        stack.append(self)
+        self.start = time.perf_counter()
+        return(self)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.perf_counter()
+        stack = _local.stack
+        stack.pop()
+
+        memory_peak = None
+        if _memory and tracemalloc.is_tracing():
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, self.peak)
+            memory_peak = self.peak - self.memory_start
+
+        _events.append({'name': self.name,
+                        'cat': self.category,
+                        'start': self.start - _t0,
+                        'duration': end - self.start,
+                        'bytes': self.nbytes,
+                        'memory_peak': memory_peak,
+                        'tid': threading.current_thread().ident,
+                        'depth': len(stack)})
+        return(False)
+
+
+class _NoStage(object):
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return(False)
+
+
+_no_stage = _NoStage()
+
+
+def stage(name, category='user'):
+    """
+
+    Time a block of code as its own stage, e.g. with stage('pivot', 'pandas'): ...
+
+    :param name: Stage name
+    :param category: Stage category
+    :return: Context manager, does nothing while instrumentation is disabled
+    """
+
+    if not _enabled:
+        return(_no_stage)
+
+    return(_Stage(name, category))
+
+
+def _get_nbytes(value):
+    """
+
+    :param value: Value returned by an ICE call
+    :return: Approximate number of bytes transferred
+    """
+
+    if value is None or isinstance(value, bool):
+        return(0)
+    if hasattr(value, 'nbytes'):
+        return(int(value.nbytes))
+    if isinstance(value, (str, bytes)):
+        return(len(value))
+    if isinstance(value, (int, float)):
+        return(8)
+    if isinstance(value, (list, tuple)):
+        if len(value) == 0:
+            return(0)
+        if isinstance(value[0], str):
+            return(sum(len(v) for v in value))
+        # nested lists (slices, volumes, edges) are regular, extrapolate from the first element
+        return(len(value) * _get_nbytes(value[0]))
+    if hasattr(value, 'mIds'):
+        return(sum(_get_nbytes(v) for v in vars(value).values()))
+
+    return(0)
+
+
+def _wrap(func, name, category):
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with _Stage(name, category):
+            return(func(*args, **kwargs))
+
+    wrapper._instrumented = func
+    return(wrapper)
+
+
+def enable(memory=False):
+    """
+
+    Wrap the entry points listed in ENTRY_POINTS (and every module level reference to them)
+
+    :param memory: Record the tracemalloc peak of every stage, slows allocations down
+    :return: None
+    """
+
+    global _enabled, _memory
+
+    if _enabled:
+        return
+
+    replacements = {}
+    for module_name, function_names in ENTRY_POINTS.items():
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError:
+            continue
+        category = module_name.split('.')[1]
+        for function_name in function_names:
+            func = getattr(module, function_name, None)
+            if func is not None:
+                replacements[id(func)] = (func, _wrap(func, module_name.split('.')[-1] + '.' + function_name,
+                                                      category))
+
+    # modules importing a function by name hold their own reference to it
+    import sys
+    for module_name, module in list(sys.modules.items()):
+        if not module_name.startswith('cvbi.') or module is None:
+            continue
+        for attribute, value in list(vars(module).items()):
+            if id(value) in replacements and replacements[id(value)][0] is value:
+                setattr(module, attribute, replacements[id(value)][1])
+                _patched.append((module, attribute, value))
+
+    _memory = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _enabled = True
+
+
+def disable():
+    """
+
+    :return: Restores the original entry points, recorded events are kept
+    """
+
+    global _enabled, _memory
+
+    while _patched:
+        module, attribute, value = _patched.pop()
+        setattr(module, attribute, value)
+
+    if _memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+    _enabled = False
+    _memory = False
+
+
+def is_enabled():
+    return(_enabled)
+
+
+def reset():
+    """
+
+    :return: Removes all recorded events
+    """
+
+    del _events[:]
+
+
+class _ImarisProxy(object):
+    """
+
+    Forwards every attribute to an Imaris object, ICE calls listed in ICE_CALLS are timed as 'ice' stages
+    and objects returned by other calls are wrapped as well
+
+    """
+
+    def __init__(self, target):
+        object.__setattr__(self, '_target', target)
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if not callable(value):
+            return(value)
+
+        def call(*args, **kwargs):
+            args = [_unwrap(a) for a in args]
+            kwargs = dict((k, _unwrap(v)) for k, v in kwargs.items())
+
+            if name in ICE_CALLS:
+                with _Stage('ice.' + name, 'ice') as s:
+                    result = value(*args, **kwargs)
+                    s.nbytes = _get_nbytes(result) if name != 'AddStatistics' else sum(_get_nbytes(a) for a in args)
+                return(result)
+
+            result = value(*args, **kwargs)
+            if result is None or isinstance(result, (bool, int, float, str, bytes, list, tuple, dict)):
+                return(result)
+            return(_ImarisProxy(result))
+
+        return(call)
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+
+
+def _unwrap(value):
+    if isinstance(value, _ImarisProxy):
+        return(object.__getattribute__(value, '_target'))
+    return(value)
+
+
+def wrap_imaris(vImaris):
+    """
+
+    :param vImaris: Imaris application (or any Imaris object)
+    :return: Proxy timing the ICE calls of the object and of every object obtained from it,
+             vImaris unchanged while instrumentation is disabled
+    """
+
+    if not _enabled:
+        return(vImaris)
+
+    return(_ImarisProxy(vImaris))
+
+
+def get_events():
+    """
+
+    :return: List of recorded stages, each a dictionary with name, cat, start, duration (seconds), bytes,
+             memory_peak (bytes above the memory at stage start, None without memory tracing), tid and depth
+    """
+
+    return(list(_events))
+
+
+def save_chrome_trace(path):
+    """
+
+    :param path: JSON file written, loads in chrome://tracing and Perfetto
+    :return: None
+    """
+
+    pid = os.getpid()
+    trace = []
+    for event in _events:
+        args = {'bytes': event['bytes']}
+        if event['memory_peak'] is not None:
+            args['memory_peak'] = event['memory_peak']
+        trace.append({'name': event['name'],
+                      'cat': event['cat'],
+                      'ph': 'X',
+                      'ts': event['start'] * 1e6,
+                      'dur': event['duration'] * 1e6,
+                      'pid': pid,
+                      'tid': event['tid'],
+                      'args': args})
+
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+
+
+def get_summary():
+    """
+
+    :return: Text table with calls, total / mean wall time, bytes transferred and largest memory peak per stage,
+             sorted by total time
+    """
+
+    stages = {}
+    for event in _events:
+        s = stages.setdefault(event['name'], {'cat': event['cat'], 'calls': 0, 'total': 0.0, 'bytes': 0,
+                                              'memory_peak': None})
+        s['calls'] += 1
+        s['total'] += event['duration']
+        s['bytes'] += event['bytes']
+        if event['memory_peak'] is not None:
+            s['memory_peak'] = max(s['memory_peak'] or 0, event['memory_peak'])
+
+    lines = ['%-45s %-12s %8s %12s %12s %12s %14s' % ('stage', 'category', 'calls', 'total (s)', 'mean (ms)',
+                                                       'MB moved', 'peak MB')]
+    for name, s in sorted(stages.items(), key=lambda item: -item[1]['total']):
+        lines.append('%-45s %-12s %8d %12.4f %12.3f %12.2f %14s' % (
+            name, s['cat'], s['calls'], s['total'], s['total'] / s['calls'] * 1e3, s['bytes'] / 1e6,
+            '%.2f' % (s['memory_peak'] / 1e6) if s['memory_peak'] is not None else '-'))
+
+    return('\n'.join(lines))
@@ -0,0 +1,65 @@
+# Deferred imports, heavy modules are loaded when first used instead of when an XTension starts
+
+import importlib
+
+
+class LazyModule(object):
+    """
+
+    Stand-in for a module which is imported on first attribute access
+
+    e.g. :
+
+    tk = LazyModule('Tkinter', 'tkinter')
+    tk.Tk()   # imports Tkinter (python 2) or tkinter (python 3) here
+
+    :param names: Module names tried in order
+    """
+
+    def __init__(self, *names):
+        self._names = names
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            error = None
+            for name in self._names:
+                try:
+                    self._module = importlib.import_module(name)
+                    break
+                except ImportError as e:
+                    error = e
+            else:
+                raise error
+        return(self._module)
+
+    def __getattr__(self, name):
+        return(getattr(self._load(), name))
+
+    def __repr__(self):
+        return('<lazy module ' + ' / '.join(self._names) + '>')
+
+
+def get_lazy_getattr(package, attributes, submodules=()):
+    """
+
+    Module level __getattr__ for a package, importing the module defining an attribute on first access
+
+    e.g. in a package __init__ :
+
+    __getattr__ = get_lazy_getattr(__name__, {'get_statistics_cell': 'stats'}, submodules=['stats'])
+
+    :param package: Package name
+    :param attributes: Dictionary of attribute name -> submodule defining it
+    :param submodules: Submodules importable as attributes of the package
+    :return: __getattr__ function
+    """
+
+    def __getattr__(name):
+        if name in attributes:
+            return(getattr(importlib.import_module(package + '.' + attributes[name]), name))
+        if name in submodules:
+            return(importlib.import_module(package + '.' + name))
+        raise AttributeError('module ' + package + ' has no attribute ' + name)
+
+    return(__getattr__)
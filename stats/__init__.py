@@ -0,0 +1,19 @@
+from cvbi.lazy import get_lazy_getattr
+
+# Submodules are imported when one of their functions is first used
+__getattr__ = get_lazy_getattr(__name__,
+                               {'Tracks': 'tracks',
+                                'get_metrics_cell': 'movement',
+                                'get_metrics_cells': 'movement',
+                                'get_metrics_track': 'movement',
+                                'get_metrics_tracks': 'movement',
+                                'get_metrics_dataset': 'movement',
+                                'get_metrics_dataset_counts': 'movement',
+                                'get_motility': 'track',
+                                'get_motility_tracks': 'track',
+                                'get_track_angles': 'track',
+                                'get_tracks_angles': 'track',
+                                'get_msd': 'msd',
+                                'write_metrics': 'export',
+                                'read_metrics': 'export'},
+                               submodules=['movement', 'track', 'tracks', 'msd', 'export'])
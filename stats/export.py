@@ -0,0 +1,207 @@
+# Partitioned columnar store for cell, track and dataset level metrics
+#
+# store/
+#   cells/source=exp1.ims/object=Th1/cell_type=Th1/part-....parquet
+#   tracks/...
+#   dataset/...
+
+import os
+import uuid
+import shutil
+import numpy as np
+import pandas as pd
+
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
+
+LEVELS = ['cells', 'tracks', 'dataset']
+PARTITIONS = ['source', 'object', 'cell_type']
+
+# IDs keep 64 bit integers, other integers are stored as int32 and floats as float32
+ID_COLUMNS = ['objectID', 'trackID']
+
+
+def get_compact_frame(df):
+    """
+
+    :param df: Metrics frame
+    :return: Copy with float32 floats, int32 integers (int64 for IDs), int8 booleans and strings.
+             The same columns always get the same dtypes, so partitions written separately share a schema.
+    """
+
+    out = {}
+    for column in df.columns:
+        values = df[column]
+        if column in ID_COLUMNS:
+            out[column] = pd.to_numeric(values).astype(np.int64)
+        elif values.dtype == bool:
+            out[column] = values.astype(np.int8)
+        elif np.issubdtype(values.dtype, np.integer):
+            out[column] = values.astype(np.int32)
+        elif np.issubdtype(values.dtype, np.floating):
+            out[column] = values.astype(np.float32)
+        else:
+            out[column] = values.astype(str)
+
+    return(pd.DataFrame(out, columns=df.columns))
+
+
+def write_metrics(df, store, level, source_file, object_name, cell_type=None, mode='overwrite', file_format='parquet',
+                  compact=True):
+    """
+
+    Write a metrics frame into its partition of a store, other partitions are left untouched
+
+    e.g. :
+
+    write_metrics(get_metrics_cells(data_cells), 'study_store', 'cells', 'exp1.ims', 'Th1', cell_type='Th1')
+    write_metrics(track_metrics, 'study_store', 'tracks', 'exp1.ims', 'Th1', cell_type='Th1')
+
+    :param df: Metrics frame (a get_metrics_track / get_metrics_dataset Series is written as one row)
+    :param store: Store directory
+    :param level: One of cells, tracks, dataset
+    :param source_file: Imaris file the metrics come from (the file name is used)
+    :param object_name: Imaris object name
+    :param cell_type: Cell type, default is the value of the cell_type column if present,
+                      a frame with several cell types is written as one partition per cell type
+    :param mode: 'overwrite' replaces the partition, 'append' adds a file to it
+    :param file_format: 'parquet' or 'feather'
+    :param compact: Store compact dtypes, see get_compact_frame
+    :return: List of the paths of the files written
+    """
+
+    import pyarrow as pa
+
+    if level not in LEVELS:
+        raise ValueError('level should be one of ' + str(LEVELS) + ', got ' + str(level))
+
+    if isinstance(df, pd.Series):
+        df = df.to_frame().T.infer_objects()
+
+    if 'cell_type' in df.columns:
+        cell_types = pd.unique(df.cell_type.values)
+        if cell_type is None and len(cell_types) > 1:
+            # one partition per cell type
+            paths = []
+            for value in cell_types:
+                rows = df.cell_type.isna().values if pd.isna(value) else (df.cell_type.values == value)
+                paths += write_metrics(df.loc[rows], store, level, source_file, object_name, cell_type=value,
+                                       mode=mode, file_format=file_format, compact=compact)
+            return(paths)
+        if cell_type is None and len(cell_types) == 1:
+            cell_type = cell_types[0]
+        elif cell_type is not None and len(cell_types) and any(str(value) != str(cell_type) for value in cell_types):
+            raise ValueError('cell_type column holds ' + str(list(cell_types)) + ', not only ' + str(cell_type))
+
+    # partition values live in the path only
+    df = df.drop(columns=[column for column in PARTITIONS if column in df.columns])
+    if compact:
+        df = get_compact_frame(df)
+
+    values = [os.path.basename(str(source_file)), str(object_name), str(cell_type)]
+    partition = os.path.join(store, level, *[name + '=' + quote(value, safe='') for name, value in
+                                             zip(PARTITIONS, values)])
+
+    if mode == 'overwrite' and os.path.isdir(partition):
+        shutil.rmtree(partition)
+    if not os.path.isdir(partition):
+        os.makedirs(partition)
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    path = os.path.join(partition, 'part-' + uuid.uuid4().hex)
+
+    if file_format == 'parquet':
+        import pyarrow.parquet as pq
+        path += '.parquet'
+        pq.write_table(table, path, compression='zstd')
+    elif file_format == 'feather':
+        import pyarrow.feather as feather
+        path += '.feather'
+        feather.write_feather(table, path, compression='zstd')
+    else:
+        raise ValueError('file_format should be one of [parquet, feather], got ' + str(file_format))
+
+    return([path])
+
+
+def _get_filter(ds, name, value):
+    if value is None:
+        return(None)
+    if isinstance(value, (list, tuple, set, np.ndarray)):
+        return(ds.field(name).isin([str(v) for v in value]))
+    return(ds.field(name) == str(value))
+
+
+def read_metrics(store, level, columns=None, source_file=None, object_name=None, cell_type=None, filters=None,
+                 file_format='parquet'):
+    """
+
+    Read metrics from a store, only the matching partitions and the requested columns are read
+
+    e.g. :
+
+    tracks = read_metrics('study_store', 'tracks', columns=['trackID', 'track_speed'], cell_type='Th1')
+
+    :param store: Store directory
+    :param level: One of cells, tracks, dataset
+    :param columns: Columns to read, default is all columns
+    :param source_file: File name or list of file names to keep
+    :param object_name: Object name or list of object names to keep
+    :param cell_type: Cell type or list of cell types to keep
+    :param filters: Additional pyarrow.dataset expression, e.g. pyarrow.dataset.field('n_track') > 10
+    :param file_format: 'parquet' or 'feather'
+    :return: pandas dataframe with the metrics and the source, object and cell_type partition columns
+    """
+
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    path = os.path.join(store, level)
+    if not os.path.isdir(path):
+        return(pd.DataFrame(columns=list(columns or []) + PARTITIONS))
+
+    if isinstance(source_file, str):
+        source_file = os.path.basename(source_file)
+    elif source_file is not None:
+        source_file = [os.path.basename(str(f)) for f in source_file]
+
+    # partition values are always strings, e.g. a cell type '1' is not read as a number
+    partitioning = ds.partitioning(pa.schema([(name, pa.string()) for name in PARTITIONS]), flavor='hive')
+    dataset = ds.dataset(path, format='ipc' if file_format == 'feather' else 'parquet', partitioning=partitioning)
+
+    expression = None
+    for e in [_get_filter(ds, 'source', source_file), _get_filter(ds, 'object', object_name),
+              _get_filter(ds, 'cell_type', cell_type), filters]:
+        if e is not None:
+            expression = e if expression is None else expression & e
+
+    if columns is not None:
+        columns = list(columns) + [name for name in PARTITIONS if name not in columns]
+
+    table = dataset.to_table(columns=columns, filter=expression)
+
+    return(table.to_pandas())
+
+
+def list_partitions(store, level):
+    """
+
+    :param store: Store directory
+    :param level: One of cells, tracks, dataset
+    :return: pandas dataframe with source, object and cell_type of every partition
+    """
+
+    try:
+        from urllib.parse import unquote
+    except ImportError:
+        from urllib import unquote
+
+    rows = []
+    for root, dirs, files in os.walk(os.path.join(store, level)):
+        parts = os.path.relpath(root, os.path.join(store, level)).split(os.sep)
+        if len(parts) == len(PARTITIONS) and files:
+            rows.append(dict((name, unquote(part.split('=', 1)[1])) for name, part in zip(PARTITIONS, parts)))
+
+    return(pd.DataFrame(rows, columns=PARTITIONS))
@@ -1,6 +1,7 @@
 import numpy as np
 import pandas as pd
 from cvbi.stats.track import get_motility
+from cvbi.stats.tracks import Tracks
 
 def get_metrics_cell(data_cell):
     """
@@ -48,13 +49,104 @@ def get_metrics_cell(data_cell):
 
     # Get Arrest Coefficient
 
-    df['arrest_speed_cutoff'] = df.Speed.lt(2.0 / 60).values.astype(np.int)
+    df['arrest_speed_cutoff'] = df.Speed.lt(2.0 / 60).values.astype(int)
     df['arrest_cumulative'] = df.arrest_speed_cutoff.cumsum().values
     df['arrest_coefficient'] = df.arrest_cumulative.values * 1.0 / df.t_track.values
 
     return(df)
 
 
+def _segmented_cumsum(values, segment_codes):
+    """
+
+    :param values: 1D array, sorted so that every segment is a contiguous block
+    :param segment_codes: Segment label for every value
+    :return: Cumulative sum restarting at every segment, NaN propagates until the end of its segment only
+             (same as numpy cumsum applied to every segment separately)
+    """
+
+    values = np.asarray(values, dtype=np.float64)
+    missing = np.isnan(values)
+    filled = pd.Series(np.where(missing, 0, values))
+
+    cumulative = np.array(filled.groupby(segment_codes, sort=False).cumsum().values)
+    missing_seen = pd.Series(missing.astype(np.int64)).groupby(segment_codes, sort=False).cumsum().values > 0
+    cumulative[missing_seen] = np.nan
+
+    return(cumulative)
+
+
+def get_metrics_cells(data_cells):
+    """
+
+    :param data_cells: A pandas dataframe containing Imaris statistics for all cells,
+                       e.g. output of base_imaris.stats.get_statistics_cell (with cluster_label),
+                       or Tracks holding cluster_label, Speed and Displacement^2
+
+    :return: Dataframe containing original columns along with additional calculations,
+             same columns as get_metrics_cell applied to every track, sorted by trackID and time
+
+    """
+
+    if isinstance(data_cells, Tracks):
+        # Already sorted, track boundaries are the offsets
+        df = data_cells.to_dataframe()
+        track_starts, track_sizes = data_cells.offsets[:-1], data_cells.lengths
+    else:
+        # Sort once, every track becomes a contiguous block
+        order = np.lexsort((data_cells.time.values, data_cells.trackID.values))
+        df = data_cells.iloc[order].reset_index(drop=True)
+
+        track_starts, track_sizes = np.unique(df.trackID.values, return_index=True, return_counts=True)[1:]
+    track_codes = np.repeat(np.arange(len(track_starts)), track_sizes)
+    position_in_track = np.arange(df.shape[0]) - np.repeat(track_starts, track_sizes)
+
+    df['n_track'] = np.repeat(track_sizes, track_sizes)
+    df['t_track'] = position_in_track + 1
+    df['track_time'] = df.loc[:, 'Time Since Track Start'].values
+
+    # Cluster membership
+
+    df['cluster_id'] = df.cluster_label.values
+    df['cluster_in'] = (df.cluster_id != -1).astype(np.int16).values
+    df['cluster_dwell'] = _segmented_cumsum(df.cluster_in.values, track_codes).astype(np.int64)
+    df['cluster_dwell_time'] = (df.cluster_dwell * 1.0 / df.t_track) * 100
+
+    # Track length, Displacement, mean squared displacement & Meandering index
+    if 'Displacement Delta Length' not in df.columns:
+        steps = np.diff(df.loc[:, ['Position X', 'Position Y', 'Position Z']].values, axis=0)
+        steps = np.vstack([np.zeros((1, 3)), steps])
+        steps[position_in_track == 0] = 0
+        df['Displacement Delta Length'] = np.nansum(steps ** 2, axis=1) ** 0.5
+
+    df['track_length'] = _segmented_cumsum(df.loc[:, 'Displacement Delta Length'].values, track_codes)
+
+    df['track_displacement'] = df.loc[:, 'Displacement^2'].pow(0.5).values
+    df['velocity'] = (df.track_displacement.values * 1.0 / df.track_time.values)
+    df['msd'] = df.loc[:, 'Displacement^2'].values
+    df['meandering_index'] = df.track_displacement.divide(df.track_length.values + 1e-15).values
+
+    # Get Arrest Coefficient
+
+    df['arrest_speed_cutoff'] = df.Speed.lt(2.0 / 60).values.astype(int)
+    df['arrest_cumulative'] = _segmented_cumsum(df.arrest_speed_cutoff.values, track_codes).astype(int)
+    df['arrest_coefficient'] = df.arrest_cumulative.values * 1.0 / df.t_track.values
+
+    return(df)
+
+
+def get_metrics_cells_chunked(chunks):
+    """
+
+    :param chunks: iterable of dataframes holding whole tracks,
+                   e.g. base_imaris.stats.iter_statistics_cell(..., by='track')
+    :return: generator of get_metrics_cells for every chunk
+    """
+
+    for data_cells in chunks:
+        yield(get_metrics_cells(data_cells))
+
+
 def get_metrics_track(df, unit='s'):
     """
 
@@ -111,39 +203,122 @@ def get_metrics_track(df, unit='s'):
     return(row)
 
 
-def get_metrics_dataset(df, cell_moving = None, t_limit = 60):
+def get_metrics_tracks(df, unit='s'):
+    """
+
+    :param df: Dataframe containing cell level metrics of all tracks, output from `get_metrics_cells`
+               (sorted by trackID and time)
+
+    :return: Track level aggregates with their trackID, same values as get_metrics_track applied to every track
+
+    """
+
+    from cvbi.stats.track import get_motility_tracks
+
+    if unit=='s':
+        m = 60.0
+    else:
+        m = 1.0
+
+    track_ids, track_starts, track_sizes = np.unique(df.trackID.values, return_index=True, return_counts=True)
+    track_ends = track_starts + track_sizes - 1
+    codes = np.repeat(np.arange(len(track_ids)), track_sizes)
+
+    def last(column):
+        return(df.loc[:, column].values[track_ends].astype(np.float64))
+
+    speed = df.Speed.groupby(codes, sort=True)
+    dwell = np.bincount(codes, weights=df.cluster_in.values, minlength=len(track_ids))
+
+    data_out = pd.DataFrame({'trackID': track_ids,
+                             'track_nT': track_sizes.astype(np.float64),
+                             'track_T_delta': last('track_time'),
+                             'track_distance': last('track_length'),
+                             'track_displacement': last('track_displacement'),
+                             'track_velocity': last('velocity') * m,
+                             'track_speed': last('track_length') * m / last('track_time'),
+                             'track_speed_mu': speed.mean().values * m,
+                             'track_speed_std': speed.std().values * m,
+                             'track_meandering_index': last('meandering_index'),
+                             'track_arrest_coeff': last('arrest_coefficient'),
+                             'track_motility': get_motility_tracks(df).motility.reindex(track_ids).values,
+                             'track_dwell_time': dwell,
+                             'track_dwell_percent': dwell * 100.0 / track_sizes,
+                             'track_always_in': (dwell == track_sizes).astype(np.float64),
+                             'track_always_out': (dwell == 0).astype(np.float64),
+                             'start': df.cluster_in.values[track_starts].astype(np.float64),
+                             'end': last('cluster_in')})
+
+    return(data_out)
+
+
+def get_metrics_dataset_counts(df):
+    """
+
+    :param df: Track level aggregate dataset
+    :return: Track counts behind get_metrics_dataset, sums over tracks so they can be patched by adding the counts
+             of new tracks and subtracting the counts of removed ones
+    """
+
+    counts = {}
+
+    counts['n_total'] = df.shape[0]
+
+    counts['n_start_in'] = (df.start.values == 1).sum()
+    counts['n_end_in'] = (df.end.values == 1).sum()
+
+    counts['n_start_out'] = (df.start.values == 0).sum()
+    counts['n_end_out'] = (df.end.values == 0).sum()
+
+    counts['n_always_in'] = df.track_always_in.values.sum()
+    counts['n_always_out'] = df.track_always_out.values.sum()
+
+    counts['n_start_in_end_in'] = ((df.start.values == 1) & (df.end.values == 1)).sum()
+    counts['n_in_to_out'] = ((df.start.values == 1) & (df.end.values == 0)).sum()
+
+    counts['n_start_out_end_out'] = ((df.start.values == 0) & (df.end.values == 0)).sum()
+    counts['n_out_to_in'] = ((df.start.values == 0) & (df.end.values == 1)).sum()
+
+    return(pd.Series(counts, dtype=object))
+
+
+def get_metrics_dataset(df, cell_moving = None, t_limit = 60, counts = None):
     """
 
     :param df: Track level aggregate dataset
     :param cell_moving: Cell type
     :param t_limit: Total time that calculations were run on
+    :param counts: Output of get_metrics_dataset_counts, used instead of df if given
 
     :return: Data frame collapsed to a dataset, cell type level.
 
     """
+    if counts is None:
+        counts = get_metrics_dataset_counts(df)
+
     data_dict = {}
 
     data_dict['cell_type'] = cell_moving
     data_dict['t_limit'] = t_limit
-    data_dict['n_total'] = df.shape[0]
+    data_dict['n_total'] = counts['n_total']
 
-    data_dict['n_start_in'] = (df.start.values == 1).sum()
-    data_dict['n_end_in'] = (df.end.values == 1).sum()
+    data_dict['n_start_in'] = counts['n_start_in']
+    data_dict['n_end_in'] = counts['n_end_in']
 
-    data_dict['n_start_out'] = (df.start.values == 0).sum()
-    data_dict['n_end_out'] = (df.end.values == 0).sum()
+    data_dict['n_start_out'] = counts['n_start_out']
+    data_dict['n_end_out'] = counts['n_end_out']
 
-    data_dict['n_always_in'] = df.track_always_in.values.sum()
-    data_dict['n_always_out'] = df.track_always_out.values.sum()
+    data_dict['n_always_in'] = counts['n_always_in']
+    data_dict['n_always_out'] = counts['n_always_out']
 
     data_dict['n_out_to_change_state'] = data_dict['n_start_out'] - data_dict['n_always_out']
     data_dict['n_in_to_change_state'] = data_dict['n_start_in'] - data_dict['n_always_in']
 
-    data_dict['n_in_to_in'] = ((df.start.values == 1) & (df.end.values == 1)).sum() - data_dict['n_always_in']
-    data_dict['n_in_to_out'] = ((df.start.values == 1) & (df.end.values == 0)).sum()
+    data_dict['n_in_to_in'] = counts['n_start_in_end_in'] - data_dict['n_always_in']
+    data_dict['n_in_to_out'] = counts['n_in_to_out']
 
-    data_dict['n_out_to_out'] = ((df.start.values == 0) & (df.end.values == 0)).sum() - data_dict['n_always_out']
-    data_dict['n_out_to_in'] = ((df.start.values == 0) & (df.end.values == 1)).sum()
+    data_dict['n_out_to_out'] = counts['n_start_out_end_out'] - data_dict['n_always_out']
+    data_dict['n_out_to_in'] = counts['n_out_to_in']
 
     data_dict['per_out_to_in'] = (data_dict['n_out_to_in'] * 100.0 / data_dict['n_out_to_change_state']).round(2)
     data_dict['per_out_to_out'] = (data_dict['n_out_to_out'] * 100.0 / data_dict['n_out_to_change_state']).round(2)
@@ -0,0 +1,227 @@
+# Time averaged mean squared displacement and velocity autocorrelation for all tracks
+
+import numpy as np
+import pandas as pd
+from cvbi.stats.track import _get_linear_fits
+from cvbi.stats.tracks import Tracks
+
+
+def _get_correlations(a, b, nfft):
+    """
+
+    :param a: Array of size (n, L), zero padded sequences
+    :param b: Array of size (n, L), zero padded sequences
+    :param nfft: FFT length, at least 2 * L to avoid wrap around
+    :return: sum_k a[k] * b[k + m] for every lag m = 0 .. L-1, array of size (n, L)
+    """
+
+    A = np.fft.rfft(a, n=nfft, axis=-1)
+    B = np.fft.rfft(b, n=nfft, axis=-1)
+    correlations = np.fft.irfft(np.conj(A) * B, n=nfft, axis=-1)[:, :a.shape[1]]
+
+    return(correlations)
+
+
+def _get_bucket_msd(positions, mask):
+    """
+
+    :param positions: Array of size (n, L, dims), positions on the time index grid, 0 where missing
+    :param mask: Array of size (n, L), 1 where a position exists
+    :return: msd sums, msd pair counts, vacf sums and vacf pair counts, each of size (n, L)
+    """
+
+    n, L = mask.shape
+    nfft = int(2 ** np.ceil(np.log2(2 * L)))
+
+    # |r(k+m) - r(k)|^2 = D(k+m) + D(k) - 2 r(k).r(k+m), summed over valid pairs only
+    squared = (positions ** 2).sum(axis=2) * mask
+    msd_sums = _get_correlations(squared, mask, nfft) + _get_correlations(mask, squared, nfft)
+    for d in range(positions.shape[2]):
+        msd_sums -= 2 * _get_correlations(positions[:, :, d], positions[:, :, d], nfft)
+    msd_counts = np.rint(_get_correlations(mask, mask, nfft))
+    msd_sums[:, 0] = 0
+
+    # velocities exist where two consecutive time points exist
+    velocity_mask = np.zeros((n, L))
+    velocity_mask[:, :-1] = mask[:, :-1] * mask[:, 1:]
+    velocities = np.zeros(positions.shape)
+    velocities[:, :-1] = (positions[:, 1:] - positions[:, :-1]) * velocity_mask[:, :-1, None]
+
+    vacf_sums = np.zeros((n, L))
+    for d in range(positions.shape[2]):
+        vacf_sums += _get_correlations(velocities[:, :, d], velocities[:, :, d], nfft)
+    vacf_counts = np.rint(_get_correlations(velocity_mask, velocity_mask, nfft))
+
+    return(np.maximum(msd_sums, 0), msd_counts, vacf_sums, vacf_counts)
+
+
+def get_msd(data_cells, dt=None, max_lag=None, fit_max_lag=10, n_dims=3, bucket_size=2**22):
+    """
+
+    :param data_cells: pandas dataframe containing trackID, time and position coordinates for all tracks,
+                       e.g. output of base_imaris.stats.get_statistics_cell, or Tracks
+    :param dt: Time (seconds) between consecutive time indices, default estimates it from track_time
+    :param max_lag: Largest lag (in time indices) returned, default is all lags
+    :param fit_max_lag: Largest lag used to fit the diffusion exponent
+    :param n_dims: Number of dimensions in MSD = 2 * n_dims * D * tau ** alpha
+    :param bucket_size: Maximum number of padded time points transformed together
+
+    :return:
+    msd_tracks = long dataframe with trackID, lag, tau, msd, msd_n, vacf, vacf_n for every track and lag,
+                 vacf is NaN at lags without velocity pairs (vacf_n = 0)
+    msd_ensemble = dataframe with lag, tau, msd, msd_n, vacf, vacf_norm, vacf_n averaged over all pairs of all tracks
+    msd_fit = dataframe indexed by trackID with alpha, D, r2, n from a log-log fit over lags 1 .. fit_max_lag,
+              the ensemble fit is stored under trackID -1
+
+    Uses the FFT algorithm, sum_k r(k).r(k+m) for all lags from one FFT, so every track costs O(N log N).
+    Tracks of similar length are zero padded and transformed together, missing time points are masked.
+    """
+
+    position_columns = ['Position X', 'Position Y', 'Position Z'][:n_dims]
+
+    if isinstance(data_cells, Tracks):
+        # already sorted by track and time
+        track_ids, codes = data_cells.track_ids, data_cells.codes
+        times = data_cells.time.astype(np.int64)
+        positions = data_cells.positions[:, :n_dims].astype(np.float64)
+        track_times = data_cells.track_time.astype(np.float64)
+    else:
+        order = np.lexsort((data_cells.time.values, data_cells.trackID.values))
+        track_ids, codes = np.unique(data_cells.trackID.values[order], return_inverse=True)
+        codes = codes.ravel()
+        times = data_cells.time.values[order].astype(np.int64)
+        positions = data_cells.loc[:, position_columns].values[order].astype(np.float64)
+        track_times = None
+        if 'track_time' in data_cells.columns:
+            track_times = data_cells.track_time.values[order].astype(np.float64)
+
+    if dt is None:
+        dt = 1.0
+        if track_times is not None:
+            same_track = (codes[1:] == codes[:-1]) & (np.diff(times) > 0)
+            if same_track.any():
+                dt = np.median(np.diff(track_times)[same_track] / np.diff(times)[same_track])
+
+    # place every track on its own time index grid, centred to keep the FFT sums small
+    n_tracks = len(track_ids)
+    starts = np.full(n_tracks, np.iinfo(np.int64).max)
+    np.minimum.at(starts, codes, times)
+    stops = np.zeros(n_tracks, dtype=np.int64)
+    np.maximum.at(stops, codes, times)
+    lengths = stops - starts + 1
+    steps = times - starts[codes]
+
+    counts = np.bincount(codes, minlength=n_tracks).astype(np.float64)
+    means = np.stack([np.bincount(codes, weights=positions[:, d], minlength=n_tracks) for d in range(n_dims)], axis=1)
+    positions = positions - (means / counts[:, None])[codes]
+
+    # buckets of tracks sharing the same padded length
+    padded = (2 ** np.ceil(np.log2(np.maximum(lengths, 1)))).astype(np.int64)
+
+    max_length = int(lengths.max()) if n_tracks else 0
+    n_lags = max_length if max_lag is None else min(int(max_lag) + 1, max_length)
+
+    # lags of every track are stored as one segment, a track has no pairs beyond its own length
+    track_lags = np.minimum(lengths, n_lags)
+    lag_offsets = np.concatenate([[0], np.cumsum(track_lags)])
+    msd_sums = np.zeros(lag_offsets[-1])
+    msd_counts = np.zeros(lag_offsets[-1])
+    vacf_sums = np.zeros(lag_offsets[-1])
+    vacf_counts = np.zeros(lag_offsets[-1])
+
+    for L in np.unique(padded):
+        bucket_tracks = np.where(padded == L)[0]
+        tracks_per_chunk = max(1, int(bucket_size / L))
+
+        for chunk_start in range(0, len(bucket_tracks), tracks_per_chunk):
+            chunk = bucket_tracks[chunk_start:chunk_start + tracks_per_chunk]
+            row = np.full(n_tracks, -1)
+            row[chunk] = np.arange(len(chunk))
+
+            rows = row[codes]
+            keep = rows >= 0
+
+            chunk_positions = np.zeros((len(chunk), L, n_dims))
+            chunk_mask = np.zeros((len(chunk), L))
+            chunk_positions[rows[keep], steps[keep]] = positions[keep]
+            chunk_mask[rows[keep], steps[keep]] = 1
+
+            sums, pairs, v_sums, v_pairs = _get_bucket_msd(chunk_positions, chunk_mask)
+            width = min(L, n_lags)
+            lag = np.arange(width)
+            in_track = lag[None, :] < track_lags[chunk][:, None]
+            target = (lag_offsets[chunk][:, None] + lag[None, :])[in_track]
+            msd_sums[target] = sums[:, :width][in_track]
+            msd_counts[target] = pairs[:, :width][in_track]
+            vacf_sums[target] = v_sums[:, :width][in_track]
+            vacf_counts[target] = v_pairs[:, :width][in_track]
+
+    track_index = np.repeat(np.arange(n_tracks), track_lags)
+    lag_index = np.arange(lag_offsets[-1]) - lag_offsets[track_index]
+
+    # per track curves, in long format
+    with np.errstate(invalid='ignore', divide='ignore'):
+        msd = msd_sums / msd_counts
+        # lags without velocity pairs (e.g. the last lag of every track) hold FFT round-off only
+        vacf = np.where(vacf_counts > 0, vacf_sums / (vacf_counts * dt ** 2), np.nan)
+
+    paired = msd_counts > 0
+    msd_tracks = pd.DataFrame({'trackID': track_ids[track_index[paired]],
+                               'lag': lag_index[paired],
+                               'tau': lag_index[paired] * dt,
+                               'msd': msd[paired],
+                               'msd_n': msd_counts[paired].astype(np.int64),
+                               'vacf': vacf[paired],
+                               'vacf_n': vacf_counts[paired].astype(np.int64)})
+
+    # ensemble curves, weighted by the number of pairs of every track, summed per lag over the segments
+    ensemble_msd_sums = np.bincount(lag_index, weights=msd_sums, minlength=n_lags)
+    ensemble_msd_counts = np.bincount(lag_index, weights=msd_counts, minlength=n_lags)
+    ensemble_vacf_sums = np.bincount(lag_index, weights=vacf_sums, minlength=n_lags)
+    ensemble_vacf_counts = np.bincount(lag_index, weights=vacf_counts, minlength=n_lags)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ensemble_msd = ensemble_msd_sums / ensemble_msd_counts
+        ensemble_vacf = np.where(ensemble_vacf_counts > 0, ensemble_vacf_sums / (ensemble_vacf_counts * dt ** 2),
+                                 np.nan)
+        vacf_norm = ensemble_vacf / ensemble_vacf[0] if n_lags and ensemble_vacf[0] > 0 else \
+            np.full(n_lags, np.nan)
+
+    msd_ensemble = pd.DataFrame({'lag': np.arange(n_lags),
+                                 'tau': np.arange(n_lags) * dt,
+                                 'msd': ensemble_msd,
+                                 'msd_n': ensemble_msd_counts.astype(np.int64),
+                                 'vacf': ensemble_vacf,
+                                 'vacf_norm': vacf_norm,
+                                 'vacf_n': ensemble_vacf_counts.astype(np.int64)})
+
+    # diffusion exponents, log(msd) = alpha * log(tau) + log(2 * n_dims * D)
+    fit = msd_tracks.loc[(msd_tracks.lag.values >= 1) &
+                         (msd_tracks.lag.values <= fit_max_lag) &
+                         (msd_tracks.msd.values > 0), :]
+    fit_codes = np.searchsorted(track_ids, fit.trackID.values)
+    alpha, c, r2, m = _get_linear_fits(x=np.log(fit.tau.values),
+                                       y=np.log(fit.msd.values),
+                                       codes=fit_codes,
+                                       n_groups=n_tracks)
+
+    fit_ensemble = msd_ensemble.loc[(msd_ensemble.lag.values >= 1) &
+                                    (msd_ensemble.lag.values <= fit_max_lag) &
+                                    (msd_ensemble.msd.values > 0), :]
+    alpha_e, c_e, r2_e, m_e = _get_linear_fits(x=np.log(fit_ensemble.tau.values),
+                                               y=np.log(fit_ensemble.msd.values),
+                                               codes=np.zeros(fit_ensemble.shape[0], dtype=np.int64),
+                                               n_groups=1)
+
+    alpha = np.append(alpha, alpha_e)
+    c = np.append(c, c_e)
+    r2 = np.append(r2, r2_e)
+    m = np.append(m, m_e)
+    fitted = m >= 2
+
+    msd_fit = pd.DataFrame({'alpha': np.where(fitted, alpha, np.nan),
+                            'D': np.where(fitted, np.exp(c) / (2 * n_dims), np.nan),
+                            'r2': np.where(fitted, r2, np.nan),
+                            'n': m.astype(np.int64)},
+                           index=pd.Index(np.append(track_ids, -1), name='trackID'))
+
+    return(msd_tracks, msd_ensemble, msd_fit)
@@ -1,9 +1,59 @@
 # Get parameters related to a single track
 
-from sklearn.linear_model import LinearRegression
-from sklearn.metrics import r2_score
 import numpy as np
 import pandas as pd
+from cvbi.stats.tracks import Tracks
+
+
+def _get_motility_bins(track_time):
+    """
+
+    :param track_time: Time since track start (seconds)
+    :return: 60s bin label (1 to 10) for every time point, NaN outside (-1, 599]
+    """
+
+    bins = np.arange(start=-1, stop=601, step=60)
+    labels = np.searchsorted(bins, track_time, side='left').astype(np.float64)
+    labels[(track_time <= bins[0]) | (track_time > bins[-1])] = np.nan
+
+    return(labels)
+
+
+def _get_linear_fits(x, y, codes, n_groups):
+    """
+
+    Ordinary least squares fit y = beta * x + c for every group, from segmented sums
+
+    :param x: Independent variable
+    :param y: Dependent variable
+    :param codes: Group (0 to n_groups - 1) of every observation
+    :param n_groups: Number of groups
+    :return: beta, c, r2 and number of observations for every group
+    """
+
+    m = np.bincount(codes, minlength=n_groups).astype(np.float64)
+    m_safe = np.maximum(m, 1)
+    x_mean = np.bincount(codes, weights=x, minlength=n_groups) / m_safe
+    y_mean = np.bincount(codes, weights=y, minlength=n_groups) / m_safe
+
+    # centered sums of squares and cross products
+    dx = x - x_mean[codes]
+    dy = y - y_mean[codes]
+    sxx = np.bincount(codes, weights=dx * dx, minlength=n_groups)
+    sxy = np.bincount(codes, weights=dx * dy, minlength=n_groups)
+    syy = np.bincount(codes, weights=dy * dy, minlength=n_groups)
+
+    # without variance in x the least squares (minimum norm) solution is a flat line
+    beta = np.where(sxx > 0, sxy / np.where(sxx > 0, sxx, 1), 0.0)
+    c = y_mean - beta * x_mean
+
+    # r2 as in sklearn.metrics.r2_score, 1 for perfect fits and 0 for constant y otherwise
+    ss_res = np.maximum(syy - beta * sxy, 0)
+    r2 = np.where(syy > 0, 1 - ss_res / np.where(syy > 0, syy, 1), np.where(ss_res > 0, 0.0, 1.0))
+    r2 = np.where(m > 0, r2, np.nan)
+
+    return(beta, c, r2, m)
+
 
 def get_motility(data_cell, time_limit=601):
     """
@@ -17,19 +67,14 @@ def get_motility(data_cell, time_limit=601):
     data_use = data_cell.loc[:, columns_use].copy()
     data_use.sort_values(by=['trackID', 'track_time'], inplace=True)
     data_use = data_use.loc[data_use.track_time.lt(time_limit).values, :].copy()
-    data_use['t_since_start'] = pd.cut(data_use.track_time.values,
-                                       bins=np.arange(start=-1, stop=601, step=60),
-                                       labels=np.arange(1, 11))
+    data_use['t_since_start'] = _get_motility_bins(data_use.track_time.values)
 
-    data_use_long = data_use.loc[:, ['trackID', 't_since_start', 'Displacement^2']].copy()
-    X = data_use_long.t_since_start.ravel().reshape(-1, 1).astype(np.float64)
-    y = data_use_long.loc[:, 'Displacement^2'].ravel().reshape(-1, 1).astype(np.float64)
+    data_use_long = data_use.loc[data_use.t_since_start.notnull().values, ['trackID', 't_since_start', 'Displacement^2']]
+    X = data_use_long.t_since_start.values.reshape(-1, 1).astype(np.float64)
+    y = data_use_long.loc[:, 'Displacement^2'].values.reshape(-1, 1).astype(np.float64)
 
-    model = LinearRegression(normalize=True)
-    model.fit(X=X, y=y)
-    beta = model.coef_[0][0]
-    c = model.intercept_[0]
-    r2 = r2_score(y, model.predict(X))
+    beta, c, r2, _ = _get_linear_fits(x=X.ravel(), y=y.ravel(), codes=np.zeros(X.shape[0], dtype=np.int64), n_groups=1)
+    beta, c, r2 = beta[0], c[0], r2[0]
 
     data_out = {}
     for t in range(X.shape[0]):
@@ -48,6 +93,56 @@ def get_motility(data_cell, time_limit=601):
     return(data_out)
 
 
+def get_motility_tracks(data_cells, time_limit=601):
+    """
+
+    :param data_cells: pandas dataframe containing trackID, track_time and Displacement^2 for all tracks,
+                       e.g. output of base_imaris.stats.get_statistics_cell, or Tracks holding Displacement^2
+    :param time_limit : Int64, time limit(in seconds) up to which track data is used,  default is 601s (10 minutes)
+    :return: pandas dataframe indexed by trackID with motility, beta, c, r2 and n for every track,
+             same fit as get_motility applied to every track (the per time point t00, t01, ... columns are not kept)
+    """
+
+    if isinstance(data_cells, Tracks):
+        track_ids, codes, n = data_cells.track_ids, data_cells.codes, data_cells.lengths
+        track_time = data_cells.track_time.astype(np.float64)
+        y = data_cells.columns['Displacement^2'].astype(np.float64)
+    else:
+        track_ids, codes, n = np.unique(data_cells.trackID.values, return_inverse=True, return_counts=True)
+        codes = codes.ravel()
+        track_time = data_cells.track_time.values.astype(np.float64)
+        y = data_cells.loc[:, 'Displacement^2'].values.astype(np.float64)
+
+    x = _get_motility_bins(track_time)
+
+    use = (track_time < time_limit) & ~np.isnan(x)
+    beta, c, r2, _ = _get_linear_fits(x=x[use], y=y[use], codes=codes[use], n_groups=len(track_ids))
+
+    data_out = pd.DataFrame({'beta': beta,
+                             'c': c,
+                             'motility': beta,
+                             'n': n,
+                             'r2': r2},
+                            index=pd.Index(track_ids, name='trackID'))
+    return(data_out)
+
+
+def get_motility_tracks_chunked(chunks, time_limit=601):
+    """
+
+    :param chunks: iterable of dataframes holding whole tracks,
+                   e.g. base_imaris.stats.iter_statistics_cell(..., by='track')
+    :param time_limit : Int64, time limit(in seconds) up to which track data is used,  default is 601s (10 minutes)
+    :return: get_motility_tracks of all chunks, one chunk in memory at a time
+    """
+
+    data_out = [get_motility_tracks(data_cells, time_limit=time_limit) for data_cells in chunks]
+    if len(data_out) == 0:
+        return(get_motility_tracks(pd.DataFrame({'trackID': [], 'track_time': [], 'Displacement^2': []})))
+
+    return(pd.concat(data_out).sort_index())
+
+
 def get_cell_angle(v1 , v2) :
     """
 
@@ -102,4 +197,57 @@ def get_track_angles(df_in , return_ids = False) :
         return (output)
 
     else :
-        return (output)
\ No newline at end of file
+        return (output)
+
+def get_tracks_angles(df_in , return_ids = False) :
+    """
+
+    :param df_in: pandas data frame containing trackID, time and position coordinates for all tracks,
+                  e.g. output of base_imaris.stats.get_statistics_cell, or Tracks
+    :param return_ids: whether individual [track, cell] combination IDs should be returned
+    :return: relative vector angles at every time point, aligned with the rows of df_in
+             (NaN for the first and last time point of every track), same values as get_track_angles per track
+    """
+    if isinstance( df_in , Tracks ) :
+        # already sorted by track and time
+        order = np.arange( df_in.n_points )
+        tracks_sorted = df_in.codes
+        coords = df_in.positions.astype( np.float64 )
+    else :
+        track_ids = df_in.trackID.values
+        times = df_in.time.values
+
+        # sort once by track and time, every track becomes a contiguous block
+        order = np.lexsort( ( times , track_ids ) )
+        tracks_sorted = track_ids[order]
+        coords = df_in.loc[: , ['Position X' , 'Position Y' , 'Position Z']].values[order].astype( np.float64 )
+
+    angles_sorted = np.full( coords.shape[0] , np.nan )
+
+    if coords.shape[0] >= 3 :
+        direction_current = coords[:-2] - coords[1 :-1]
+        direction_next = coords[1 :-1] - coords[2 :]
+
+        cosang = ( direction_current * direction_next ).sum( axis = 1 )
+        sinang = np.linalg.norm( np.cross( direction_current , direction_next ) , axis = 1 )
+        angles = np.rad2deg( np.arctan2( sinang , cosang ) )
+
+        # keep angles where previous, current and next point belong to the same track
+        same_track = ( tracks_sorted[:-2] == tracks_sorted[1 :-1] ) & ( tracks_sorted[1 :-1] == tracks_sorted[2 :] )
+        angles_sorted[1 :-1] = np.where( same_track , angles , np.nan )
+
+    output = np.empty( coords.shape[0] )
+    output[order] = angles_sorted
+
+    if return_ids and isinstance( df_in , Tracks ) :
+        output = pd.DataFrame( { 'angle' : output } , index = pd.Index( df_in.object_ids , name = 'objectID' ) )
+        return (output)
+
+    elif return_ids :
+        objectIDs = df_in.objectID
+        output = pd.DataFrame( { 'angle' : output } , index = objectIDs.values )
+        output.index.name = objectIDs.name
+        return (output)
+
+    else :
+        return (output)
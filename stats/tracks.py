@@ -0,0 +1,161 @@
+# Compact container for tracked cells, every track stored as a contiguous block (CSR layout)
+
+import numpy as np
+import pandas as pd
+
+POSITION_COLUMNS = ['Position X', 'Position Y', 'Position Z']
+
+
+class Tracks(object):
+    """
+
+    Positions, times and selected statistics of all cells in contiguous arrays sorted by track and time.
+    Rows offsets[i] : offsets[i+1] belong to track track_ids[i], per track arrays are views (no copies).
+
+    e.g. :
+
+    data_cells = get_statistics_cell(vImaris, 'spots', 'Th1')
+    tracks = Tracks.from_dataframe(data_cells, columns=['Speed', 'Displacement^2'])
+    tracks.get_track(1000000004)['positions']
+    get_motility_tracks(tracks)
+
+    :param track_ids: int64 array of size n_tracks
+    :param offsets: int64 array of size n_tracks + 1, first row of every track and the total number of rows
+    :param object_ids: int64 array of size n
+    :param time: int32 array of size n, time index
+    :param track_time: float32 array of size n, time since track start
+    :param positions: float32 array of size (n, 3)
+    :param columns: dictionary of statistic name -> array of size n
+    """
+
+    def __init__(self, track_ids, offsets, object_ids, time, track_time, positions, columns=None):
+        self.track_ids = track_ids
+        self.offsets = offsets
+        self.object_ids = object_ids
+        self.time = time
+        self.track_time = track_time
+        self.positions = positions
+        self.columns = columns if columns is not None else {}
+        self._track_index = None
+        self._codes = None
+
+    @classmethod
+    def from_dataframe(cls, data_cells, columns=None, dtype=np.float32):
+        """
+
+        :param data_cells: pandas dataframe containing trackID, objectID, time, track_time and position coordinates,
+                           e.g. output of base_imaris.stats.get_statistics_cell
+        :param columns: statistics kept besides positions and times,
+                        default is Speed, Displacement^2, Displacement Delta Length and cluster_label if present
+        :param dtype: dtype of positions, times since track start and statistics
+        :return: Tracks
+        """
+
+        if columns is None:
+            columns = [name for name in ['Speed', 'Displacement^2', 'Displacement Delta Length', 'cluster_label']
+                       if name in data_cells.columns]
+
+        track_values = np.asarray(data_cells.trackID.values, dtype=np.int64)
+        time = np.asarray(data_cells.time.values, dtype=np.float64).astype(np.int32)
+
+        # sort once by track and time
+        order = np.lexsort((time, track_values))
+        track_values = track_values[order]
+
+        starts = np.where(np.append(True, track_values[1:] != track_values[:-1]))[0] if len(order) else np.zeros(0)
+        offsets = np.append(starts, len(order)).astype(np.int64)
+
+        if 'track_time' in data_cells.columns:
+            track_time = data_cells.track_time.values
+        else:
+            track_time = data_cells.loc[:, 'Time Since Track Start'].values
+
+        return(cls(track_ids=track_values[offsets[:-1]],
+                   offsets=offsets,
+                   object_ids=pd.to_numeric(data_cells.objectID).values.astype(np.int64)[order],
+                   time=time[order],
+                   track_time=np.asarray(track_time, dtype=dtype)[order],
+                   positions=np.asarray(data_cells.loc[:, POSITION_COLUMNS].values, dtype=dtype)[order],
+                   columns=dict((name, np.asarray(data_cells.loc[:, name].values, dtype=dtype)[order])
+                                for name in columns)))
+
+    def to_dataframe(self):
+        """
+
+        :return: pandas dataframe with the columns of base_imaris.stats.get_statistics_cell kept in the container,
+                 sorted by trackID and time
+        """
+
+        df = pd.DataFrame({'trackID': self.codes_to_ids(),
+                           'objectID': self.object_ids})
+        for d, name in enumerate(POSITION_COLUMNS):
+            df[name] = self.positions[:, d].astype(np.float64)
+        df['Time Index'] = self.time.astype(np.float64)
+        df['Time Since Track Start'] = self.track_time.astype(np.float64)
+        for name, values in self.columns.items():
+            df[name] = values.astype(np.float64)
+        df['time'] = df.loc[:, 'Time Index'].values
+        df['track_time'] = df.loc[:, 'Time Since Track Start'].values
+
+        return(df)
+
+    def __len__(self):
+        return(len(self.track_ids))
+
+    @property
+    def n_points(self):
+        return(int(self.offsets[-1]))
+
+    @property
+    def lengths(self):
+        return(np.diff(self.offsets))
+
+    @property
+    def codes(self):
+        """
+
+        :return: track index (0 .. n_tracks-1) of every row
+        """
+
+        if self._codes is None:
+            self._codes = np.repeat(np.arange(len(self.track_ids)), self.lengths)
+        return(self._codes)
+
+    def codes_to_ids(self):
+        """
+
+        :return: trackID of every row
+        """
+
+        return(np.repeat(self.track_ids, self.lengths))
+
+    def get_track(self, trackID):
+        """
+
+        :param trackID: Imaris track ID
+        :return: dictionary of views on objectID, time, track_time, positions and the statistics of a track
+        """
+
+        if self._track_index is None:
+            self._track_index = dict((track, i) for i, track in enumerate(self.track_ids.tolist()))
+
+        i = self._track_index[trackID]
+        rows = slice(self.offsets[i], self.offsets[i + 1])
+
+        track = {'objectID': self.object_ids[rows],
+                 'time': self.time[rows],
+                 'track_time': self.track_time[rows],
+                 'positions': self.positions[rows]}
+        for name, values in self.columns.items():
+            track[name] = values[rows]
+
+        return(track)
+
+    def __iter__(self):
+        for trackID in self.track_ids.tolist():
+            yield(trackID, self.get_track(trackID))
+
+    @property
+    def nbytes(self):
+        return(sum(a.nbytes for a in [self.track_ids, self.offsets, self.object_ids, self.time,
+                                      self.track_time, self.positions] + list(self.columns.values())))
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the repository is the cvbi package, its parent directory makes it importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
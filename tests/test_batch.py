@@ -0,0 +1,82 @@
+# Statistics extraction from several fake Imaris applications at once
+
+import time
+import threading
+from cvbi.base_imaris.fake import FakeApplication, FakeServer, FakeImarisLib, FakeDataContainer, \
+    get_fake_tracked_object
+from cvbi.base_imaris.batch import get_statistics_instances
+
+
+class HangingApplication(FakeApplication):
+    """
+
+    Application whose ICE calls do not return until released
+
+    """
+
+    def __init__(self, file_name, scene=None):
+        FakeApplication.__init__(self, file_name, scene)
+        self.release = threading.Event()
+
+    def GetCurrentFileName(self):
+        self.release.wait()
+        return(FakeApplication.GetCurrentFileName(self))
+
+
+def get_scene(*children):
+    return(FakeDataContainer(children=list(children)))
+
+
+def test_hanging_application_times_out():
+    hanging = HangingApplication('hang.ims', get_scene(get_fake_tracked_object('Th1')))
+    server = FakeServer({0: FakeApplication('a.ims', get_scene(get_fake_tracked_object('Th1'))),
+                         1: hanging,
+                         2: FakeApplication('b.ims', get_scene(get_fake_tracked_object('Th1')))})
+
+    try:
+        start = time.time()
+        results, errors = get_statistics_instances(aImarisIds=[0, 1, 2], object_types=['spots'], max_instances=1,
+                                                   timeout=0.5, imaris_lib=lambda: FakeImarisLib(server))
+        elapsed = time.time() - start
+    finally:
+        hanging.release.set()
+
+    assert sorted(results) == [(0, 'a.ims'), (2, 'b.ims')]
+    assert results[(0, 'a.ims')]['Th1'].shape[0] == 50
+    assert list(errors) == [1] and isinstance(errors[1], TimeoutError)
+    assert elapsed < 5
+
+
+def test_hung_applications_are_limited():
+    hanging = [HangingApplication('hang' + str(i) + '.ims') for i in range(3)]
+    server = FakeServer(dict(enumerate(hanging)))
+
+    try:
+        results, errors = get_statistics_instances(object_types=['spots'], max_instances=1, timeout=0.2,
+                                                   imaris_lib=lambda: FakeImarisLib(server), max_hung=1)
+    finally:
+        for application in hanging:
+            application.release.set()
+
+    # the first application hangs, the others are not started
+    assert results == {}
+    assert isinstance(errors[0], TimeoutError)
+    assert isinstance(errors[1], RuntimeError) and isinstance(errors[2], RuntimeError)
+
+
+def test_objects_are_extracted_once():
+    first, second = get_fake_tracked_object('Th1', seed=1), get_fake_tracked_object('Th1', seed=2)
+    scene = get_scene(FakeDataContainer('Group 1', children=[first]), FakeDataContainer('Group 2', children=[second]),
+                      get_fake_tracked_object('Treg'))
+    server = FakeServer({0: FakeApplication('a.ims', scene)})
+
+    results, errors = get_statistics_instances(aImarisIds=[0, 0], object_types=['spots', 'Spots'],
+                                               imaris_lib=lambda: FakeImarisLib(server))
+
+    assert errors == {}
+    assert sorted(results[(0, 'a.ims')]) == ['Group 1/Th1', 'Group 2/Th1', 'Treg']
+    assert not results[(0, 'a.ims')]['Group 1/Th1'].equals(results[(0, 'a.ims')]['Group 2/Th1'])
+
+    results, errors = get_statistics_instances(aImarisIds=[0], object_names=['Th1'], object_types=['spots'],
+                                               imaris_lib=lambda: FakeImarisLib(server))
+    assert sorted(results[(0, 'a.ims')]) == ['Group 1/Th1', 'Group 2/Th1']
@@ -0,0 +1,32 @@
+# Comparison of benchmark results with a stored baseline
+
+import pandas as pd
+from cvbi.benchmarks.runner import save_baseline, load_baseline, compare_to_baseline
+
+
+def get_results(medians):
+    return(pd.DataFrame({'benchmark': [name for name, _ in medians],
+                         'size': [100] * len(medians),
+                         'best': [median * 0.9 for _, median in medians],
+                         'median': [median for _, median in medians],
+                         'repeat': [5] * len(medians)}))
+
+
+def test_identical_runs_do_not_regress(tmp_path):
+    results = get_results([('msd', 0.5), ('statistics_cell', 0.004)])
+    save_baseline(results, str(tmp_path / 'baseline.json'))
+
+    comparison = compare_to_baseline(results, load_baseline(str(tmp_path / 'baseline.json')))
+
+    assert comparison.ratio.tolist() == [1, 1]
+    assert not comparison.regression.any()
+
+
+def test_regressions_need_ratio_and_absolute_slowdown():
+    baseline = get_results([('msd', 0.5), ('orientation', 0.008), ('statistics_cell', 0.002)])
+    results = get_results([('msd', 1.0), ('orientation', 0.012), ('statistics_cell', 0.01)])
+
+    comparison = compare_to_baseline(results, baseline, tolerance=1.5, min_time=5e-3)
+
+    # orientation is 1.5x slower by only 4 ms, statistics_cell is below the noise floor
+    assert comparison.regression.tolist() == [True, False, False]
@@ -0,0 +1,63 @@
+# Orientation analysis over the slices of a fake dataset
+
+import numpy as np
+import pytest
+from cvbi.benchmarks.generators import get_fibre_image
+from cvbi.image.dataset import NumpyDataSet, get_dataset_angles, get_dataset_volume
+from cvbi.image.orientation import _get_angle_grid, get_order_parameter
+
+
+class SliceDataSet(NumpyDataSet):
+    """
+
+    Dataset serving slices only, as older Imaris versions
+
+    """
+
+    def __getattribute__(self, name):
+        if name == 'GetDataVolumeFloats':
+            raise AttributeError(name)
+        return(NumpyDataSet.__getattribute__(self, name))
+
+
+class BrokenDataSet(NumpyDataSet):
+    """
+
+    Dataset failing within its volume call
+
+    """
+
+    def GetDataVolumeFloats(self, aIndexC, aIndexT):
+        raise AttributeError('failure within the dataset')
+
+
+@pytest.fixture(scope='module')
+def data():
+    images = [get_fibre_image(shape=(64, 80), seed=seed)[0] for seed in range(8)]
+    return(np.stack(images).reshape((2, 2, 2, 64, 80)).astype(np.float32))
+
+
+def test_pool_matches_serial(data):
+    serial = get_dataset_angles(NumpyDataSet(data), order_param_width=[1, 2], processes=1)
+    pooled = get_dataset_angles(NumpyDataSet(data), order_param_width=[1, 2], processes=2, volumes_in_flight=1)
+
+    assert serial['angle'].shape == (2, 2, 2) + (len(serial['grid_row']), len(serial['grid_col']))
+    assert serial['order'].shape == (2, 2, 2, 2) + serial['angle'].shape[3:]
+    assert np.array_equal(serial['angle'], pooled['angle'])
+    assert np.array_equal(serial['order'], pooled['order'])
+
+    # same as the single image analysis
+    angle_matrix, _, _ = _get_angle_grid(data[1, 0, 1])
+    assert np.allclose(serial['angle'][1, 0, 1], angle_matrix)
+    assert np.allclose(serial['order'][1, 0, 1], get_order_parameter(angle_matrix, order_param_width=[1, 2]))
+
+
+def test_slice_fallback(data):
+    volume = get_dataset_volume(SliceDataSet(data), c=1, t=0, z_indices=[1])
+
+    assert np.array_equal(volume, data[0, 1, 1:2])
+
+
+def test_dataset_errors_are_raised(data):
+    with pytest.raises(AttributeError):
+        get_dataset_volume(BrokenDataSet(data), c=0, t=0)
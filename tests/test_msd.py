@@ -0,0 +1,34 @@
+# Mean squared displacement and velocity autocorrelation of simulated tracks
+
+import numpy as np
+from cvbi.benchmarks.generators import get_random_walk_tracks
+from cvbi.stats.msd import get_msd
+
+
+def test_no_infinite_values():
+    data_cells = get_random_walk_tracks(n_tracks=24, track_length=20)
+    rng = np.random.default_rng(0)
+    data_cells = data_cells.loc[rng.random(data_cells.shape[0]) > 0.1]
+
+    msd_tracks, msd_ensemble, msd_fit = get_msd(data_cells)
+
+    for df in [msd_tracks, msd_ensemble, msd_fit]:
+        assert not np.isinf(df.select_dtypes(include=[np.number]).values).any()
+
+    # lags without velocity pairs have no autocorrelation
+    assert msd_tracks.vacf.isna().values[msd_tracks.vacf_n.values == 0].all()
+    assert not msd_tracks.vacf.isna().values[msd_tracks.vacf_n.values > 0].any()
+    assert msd_ensemble.vacf_norm.values[0] == 1
+
+
+def test_matches_direct_sums():
+    data_cells = get_random_walk_tracks(n_tracks=3, track_length=12)
+
+    msd_tracks, _, _ = get_msd(data_cells)
+
+    for track_id, df in data_cells.groupby('trackID'):
+        positions = df.sort_values('time').loc[:, ['Position X', 'Position Y', 'Position Z']].values
+        curve = msd_tracks.loc[msd_tracks.trackID.values == track_id]
+        for lag in range(1, positions.shape[0]):
+            expected = ((positions[lag:] - positions[:-lag]) ** 2).sum(axis=1).mean()
+            assert np.isclose(curve.msd.values[lag], expected)
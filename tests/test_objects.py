@@ -0,0 +1,55 @@
+# Surpass scene catalog of the fake Imaris application
+
+import pytest
+from cvbi.base_imaris.fake import FakeApplication, FakeDataContainer, FakeSurpassObject, get_fake_tracked_object
+from cvbi.base_imaris.objects import GetSurpassObject, GetSurpassObjects, get_scene_catalog
+
+
+class RemovableObject(FakeSurpassObject):
+    """
+
+    Object whose proxy fails once it was deleted from the scene, as an ICE proxy of a deleted object
+
+    """
+
+    removed = False
+
+    def GetName(self):
+        if self.removed:
+            raise RuntimeError('ObjectNotExistException')
+        return(self.name)
+
+
+def get_object(name, seed=0):
+    tracked = get_fake_tracked_object(name, seed=seed)
+    return(RemovableObject(name, ids=tracked.ids, track_ids=tracked.track_ids, track_edges=tracked.track_edges,
+                           statistics=tracked.statistics))
+
+
+def test_replaced_object_with_same_name():
+    old = get_object('Th1')
+    app = FakeApplication('a.ims', FakeDataContainer(children=[old, get_object('Treg')]))
+    assert GetSurpassObject(app, 'spots', 'Th1') is old
+
+    # deleted and added again, the scene has the same number of objects and names
+    new = get_object('Th1', seed=1)
+    app.scene.RemoveChild(old)
+    old.removed = True
+    app.scene.AddChild(new, 0)
+
+    assert GetSurpassObject(app, 'spots', 'Th1') is new
+    assert GetSurpassObject(app, 'spots', 'Th1') is new
+
+
+def test_renamed_object_invalidates_catalog():
+    app = FakeApplication('b.ims', FakeDataContainer(children=[get_object('Th1'), get_object('Treg')]))
+    catalog = get_scene_catalog(app)
+    assert not catalog.is_stale()
+
+    app.scene.children[1].SetName('Tconv')
+
+    assert catalog.is_stale()
+    assert sorted(GetSurpassObjects(app, 'spots')) == ['Tconv', 'Th1']
+    assert get_scene_catalog(app) is not catalog
+    with pytest.raises(KeyError):
+        GetSurpassObject(app, 'spots', 'Treg')
@@ -0,0 +1,120 @@
+# ImarisSession against the local stand-in of the Imaris ICE API (base_imaris.fake)
+
+import pytest
+from cvbi.base_imaris.fake import FakeApplication, FakeServer, FakeImarisLib, FakeDataContainer, \
+    get_fake_tracked_object
+from cvbi.base_imaris.session import ImarisSession
+from cvbi.base_imaris.objects import GetSurpassObject
+from cvbi.base_imaris.stats import get_statistics_cell
+
+
+class CountingImarisLib(FakeImarisLib):
+    """
+
+    FakeImarisLib counting its instances and the proxies it hands out
+
+    """
+
+    counts = {'lib': 0, 'GetServer': 0, 'GetApplication': 0}
+
+    def __init__(self, server):
+        FakeImarisLib.__init__(self, server)
+        CountingImarisLib.counts['lib'] += 1
+
+    def GetServer(self):
+        CountingImarisLib.counts['GetServer'] += 1
+        return(FakeImarisLib.GetServer(self))
+
+    def GetApplication(self, aImarisId):
+        CountingImarisLib.counts['GetApplication'] += 1
+        return(FakeImarisLib.GetApplication(self, aImarisId))
+
+
+class StaleApplication(FakeApplication):
+    """
+
+    Application proxy which stops answering once stale is set, as after an Imaris restart
+
+    """
+
+    stale = False
+
+    def GetCurrentFileName(self):
+        if self.stale:
+            raise RuntimeError('proxy no longer valid')
+        return(FakeApplication.GetCurrentFileName(self))
+
+
+@pytest.fixture
+def server():
+    CountingImarisLib.counts = {'lib': 0, 'GetServer': 0, 'GetApplication': 0}
+    scene = FakeDataContainer(children=[get_fake_tracked_object('Th1')])
+    return(FakeServer({3: FakeApplication('a.ims', scene), 7: FakeApplication('b.ims')}))
+
+
+def get_session(server, aImarisId=None):
+    return(ImarisSession(aImarisId=aImarisId, imaris_lib=lambda: CountingImarisLib(server)))
+
+
+def test_proxies_are_reused(server):
+    session = get_session(server)
+
+    vImaris = session.get_application()
+    for _ in range(5):
+        assert session.get_application() is vImaris
+        session.get_object_ids()
+
+    assert session.aImarisId == 3
+    assert CountingImarisLib.counts == {'lib': 1, 'GetServer': 1, 'GetApplication': 1}
+
+
+def test_file_names(server):
+    session = get_session(server)
+
+    assert session.get_file_names() == {3: 'a.ims', 7: 'b.ims'}
+    assert session.get_file_names() == {3: 'a.ims', 7: 'b.ims'}
+    assert CountingImarisLib.counts == {'lib': 1, 'GetServer': 1, 'GetApplication': 2}
+
+
+def test_reconnect_after_stale_proxy(server):
+    stale = StaleApplication('a.ims', server.applications[3].scene)
+    server.applications[3] = stale
+    session = get_session(server, aImarisId=3)
+
+    assert session.get_application(check=True) is stale
+    assert CountingImarisLib.counts['GetApplication'] == 1
+
+    # Imaris restarted, the cached proxy fails and a new one is fetched
+    stale.stale = True
+    fresh = FakeApplication('a.ims', stale.scene)
+    server.applications[3] = fresh
+
+    assert session.get_application(check=True) is fresh
+    assert CountingImarisLib.counts == {'lib': 2, 'GetServer': 0, 'GetApplication': 2}
+    assert session.get_application(check=True) is fresh
+    assert CountingImarisLib.counts['GetApplication'] == 2
+
+
+def test_unknown_application(server):
+    session = get_session(server, aImarisId=42)
+
+    with pytest.raises(RuntimeError):
+        session.get_application()
+
+
+def test_no_application():
+    session = ImarisSession(imaris_lib=lambda: FakeImarisLib(FakeServer()))
+
+    with pytest.raises(RuntimeError):
+        session.get_application()
+
+
+def test_helpers_accept_session(server):
+    session = get_session(server)
+
+    assert GetSurpassObject(session, 'spots', 'Th1') is server.applications[3].scene.children[0]
+
+    data_cells = get_statistics_cell(session, 'spots', 'Th1')
+    assert data_cells.shape[0] == 50
+    assert data_cells.groupby('trackID').size().tolist() == [5] * 10
+    assert CountingImarisLib.counts == {'lib': 1, 'GetServer': 1, 'GetApplication': 1}
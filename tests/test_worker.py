@@ -0,0 +1,75 @@
+# Resident worker serving jobs on the fake Imaris server
+
+import time
+import threading
+import pytest
+from cvbi.base_imaris.fake import FakeApplication, FakeServer, FakeImarisLib, FakeDataContainer, \
+    get_fake_tracked_object
+from cvbi.worker import Worker, submit
+
+AUTHKEY = b'cvbi-test'
+
+
+def start_worker(idle_timeout=None):
+    scene = FakeDataContainer(children=[get_fake_tracked_object('Th1', n_tracks=20, track_length=10)])
+    server = FakeServer({0: FakeApplication('a.ims', scene)})
+    worker = Worker(address=('127.0.0.1', 0), authkey=AUTHKEY, imaris_lib=lambda: FakeImarisLib(server),
+                    idle_timeout=idle_timeout)
+
+    ready = threading.Event()
+    thread = threading.Thread(target=worker.serve_forever, kwargs={'ready': ready})
+    thread.daemon = True
+    thread.start()
+    assert ready.wait(5)
+    return(worker, thread)
+
+
+@pytest.fixture
+def worker():
+    worker, thread = start_worker()
+    yield(worker)
+    if thread.is_alive():
+        submit('shutdown', address=worker.address, authkey=AUTHKEY)
+        thread.join(5)
+
+
+def test_track_metrics_are_cached(worker):
+    kwargs = {'address': worker.address, 'authkey': AUTHKEY, 'aImarisId': 0, 'object_type': 'spots',
+              'object_name': 'Th1'}
+
+    first, second = [], []
+    result = submit('track_metrics', progress=first.append, **kwargs)
+    cached = submit('track_metrics', progress=second.append, **kwargs)
+
+    assert result['cells'].shape[0] == 200
+    assert result['motility'].shape[0] == 20
+    assert 'Using cached result' not in first
+    assert second == ['Using cached result']
+    assert cached['cells'].equals(result['cells'])
+
+
+def test_unknown_job(worker):
+    with pytest.raises(RuntimeError) as error:
+        submit('unknown', address=worker.address, authkey=AUTHKEY)
+
+    assert 'Unknown job' in str(error.value)
+
+
+def test_shutdown():
+    worker, thread = start_worker()
+
+    assert submit('shutdown', address=worker.address, authkey=AUTHKEY)
+    thread.join(5)
+    assert not thread.is_alive()
+
+
+def test_idle_timeout_waits_for_running_jobs():
+    worker, thread = start_worker(idle_timeout=0.2)
+    worker.jobs['sleep'] = lambda progress, seconds: time.sleep(seconds) or True
+
+    assert submit('sleep', address=worker.address, authkey=AUTHKEY, seconds=1.5)
+    assert thread.is_alive()
+
+    # idle once the job finished
+    thread.join(5)
+    assert not thread.is_alive()
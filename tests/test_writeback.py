@@ -0,0 +1,53 @@
+# Custom statistics written back into the fake Imaris objects
+
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+from cvbi.base_imaris.fake import FakeApplication, FakeDataContainer, get_fake_tracked_object
+from cvbi.base_imaris.writeback import StatisticsWriter
+
+
+@pytest.fixture
+def app():
+    return(FakeApplication('a.ims', FakeDataContainer(children=[get_fake_tracked_object('Th1')])))
+
+
+def get_metrics(app, scale=1.0):
+    ids = np.asarray(app.GetSurpassScene().children[0].GetIds())
+    return(pd.DataFrame({'objectID': ids,
+                         'time': np.arange(len(ids)) % 5,
+                         'meandering_index': np.linspace(0, 1, len(ids)) * scale,
+                         'Speed': np.ones(len(ids)) * scale}))
+
+
+def get_values(app, name):
+    return(app.GetSurpassScene().children[0].GetStatisticsByName(name).mValues)
+
+
+def test_unchanged_columns_are_not_sent(app):
+    writer = StatisticsWriter()
+
+    assert writer.write(app, 'spots', 'Th1', get_metrics(app)) == ['meandering_index', 'Speed']
+    assert writer.write(app, 'spots', 'Th1', get_metrics(app)) == []
+    assert len(get_values(app, 'cvbi Speed')) == 50
+
+
+def test_new_writer_replaces_earlier_run(app):
+    StatisticsWriter().write(app, 'spots', 'Th1', get_metrics(app))
+
+    # e.g. the next XTension run, with new values
+    assert StatisticsWriter().write(app, 'spots', 'Th1', get_metrics(app, scale=2.0)) == ['meandering_index',
+                                                                                          'Speed']
+    assert sorted(set(get_values(app, 'cvbi Speed'))) == [2.0]
+
+
+def test_existing_statistics_without_prefix(app):
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        written = StatisticsWriter().write(app, 'spots', 'Th1', get_metrics(app), prefix='')
+
+    # Speed is an Imaris statistic of the object and is left alone
+    assert written == ['meandering_index']
+    assert len(caught) == 1 and 'Speed' in str(caught[0].message)
+    assert len(get_values(app, 'Speed')) == 50 and 1.0 not in get_values(app, 'Speed')
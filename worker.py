@@ -0,0 +1,405 @@
+# Resident worker process keeping imports, Imaris sessions and results warm between XTension runs
+#
+# Start it once (ensure_worker starts it on demand) :
+#
+# python -m cvbi.worker --port 46551
+#
+# XTension stub :
+#
+# from cvbi.worker import ensure_worker, submit
+#
+# def XT_track_metrics(aImarisId):
+#     ensure_worker()
+#     results = submit('track_metrics', aImarisId=aImarisId, object_type='spots', object_name='Th1', progress=print)
+
+import os
+import sys
+import time
+import secrets
+import argparse
+import importlib
+import threading
+import traceback
+import subprocess
+from multiprocessing.connection import Listener, Client
+
+ADDRESS = ('127.0.0.1', 46551)
+KEY_FILE = os.path.join(os.path.expanduser('~'), '.cvbi', 'worker.key')
+
+
+def get_authkey(path=KEY_FILE):
+    """
+
+    Key shared by the worker and its clients. Messages are pickled, so the key is what keeps other local
+    processes out: it is random, created on first use and readable by the current user only.
+
+    :param path: Key file, CVBI_WORKER_KEY overrides it
+    :return: Key as bytes
+    """
+
+    if os.environ.get('CVBI_WORKER_KEY'):
+        return(os.environ['CVBI_WORKER_KEY'].encode())
+
+    if not os.path.exists(path):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), mode=0o700)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                f.write(secrets.token_hex(32))
+        except FileExistsError:
+            # created by a concurrent client or worker
+            pass
+
+    with open(path) as f:
+        return(f.read().strip().encode())
+
+
+def _get_imaris_lib(spec):
+    """
+
+    :param spec: 'module:callable' creating an ImarisLib object, e.g. for a fake Imaris server
+    :return: Callable
+    """
+
+    module_name, attribute = spec.split(':')
+    return(getattr(importlib.import_module(module_name), attribute))
+
+
+class Worker(object):
+    """
+
+    Serves jobs sent by submit over a local socket. Imaris sessions and job results are kept in memory,
+    results are reused while the fingerprint of the Imaris object (IDs, tracks and statistic names) is unchanged.
+
+    :param address: (host, port) to listen on
+    :param authkey: Key shared with the clients, default is get_authkey()
+    :param imaris_lib: Callable creating the ImarisLib object, default is ImarisLib.ImarisLib
+    :param idle_timeout: Seconds without jobs (since the last one finished) after which the worker exits,
+                         None keeps it running
+    :param max_results: Number of job results kept, least recently used first out
+    """
+
+    def __init__(self, address=ADDRESS, authkey=None, imaris_lib=None, idle_timeout=3600, max_results=32):
+        self.address = address
+        self.authkey = authkey if authkey is not None else get_authkey()
+        self.imaris_lib = imaris_lib
+        self.idle_timeout = idle_timeout
+        self.max_results = max_results
+
+        self.sessions = {}
+        self.results = {}
+        self.incremental = None
+        self.lock = threading.RLock()
+        self.last_job = time.time()
+        self.active_jobs = 0
+        self.active_lock = threading.Lock()
+        self.running = False
+        self.listener = None
+
+        self.jobs = {'ping': self.job_ping,
+                     'statistics': self.job_statistics,
+                     'track_metrics': self.job_track_metrics,
+                     'incremental_metrics': self.job_incremental_metrics,
+                     'clear': self.job_clear,
+                     'shutdown': self.job_shutdown}
+
+        # answered while a long job holds the lock, e.g. the ping of ensure_worker
+        self.unlocked_jobs = set(['ping', 'shutdown'])
+
+    def get_session(self, aImarisId):
+        from cvbi.base_imaris.session import ImarisSession
+
+        if aImarisId not in self.sessions:
+            self.sessions[aImarisId] = ImarisSession(aImarisId=aImarisId, imaris_lib=self.imaris_lib)
+        return(self.sessions[aImarisId])
+
+    def _get_cached(self, job, aImarisId, object_type, object_name, key, compute, progress, fingerprint=None):
+        """
+
+        :param fingerprint: Fingerprint of the object if already known, e.g. within another job
+        :return: Result of compute(session, fingerprint, progress), reused while the object fingerprint is unchanged
+        """
+
+        from cvbi.base_imaris.objects import GetSurpassObject
+        from cvbi.base_imaris.cache import get_object_fingerprint
+
+        session = self.get_session(aImarisId)
+        vImaris = session.get_application(check=True)
+        if fingerprint is None:
+            object_cells = GetSurpassObject(vImaris=session, search=object_type, name=object_name)
+            fingerprint = get_object_fingerprint(object_cells)
+
+        cache_key = (job, aImarisId, vImaris.GetCurrentFileName(), object_type.lower(), object_name, key, fingerprint)
+
+        if cache_key in self.results:
+            progress('Using cached result')
+            result = self.results.pop(cache_key)
+        else:
+            result = compute(session, fingerprint, progress)
+
+        # most recently used last
+        self.results[cache_key] = result
+        while len(self.results) > self.max_results:
+            del self.results[next(iter(self.results))]
+
+        return(result)
+
+    def job_ping(self, progress):
+        return({'pid': os.getpid(), 'sessions': len(self.sessions), 'results': len(self.results)})
+
+    def _get_statistics(self, progress, aImarisId, object_type, object_name, names=None, level='cell',
+                        fingerprint=None):
+
+        def compute(session, fingerprint, progress):
+            from cvbi.base_imaris.stats import get_statistics
+            progress('Fetching ' + level + ' statistics of ' + object_name)
+            return(get_statistics(vImaris=session, object_type=object_type, object_name=object_name,
+                                  names=names, level=level))
+
+        key = (tuple(sorted(names)) if names is not None else None, level)
+        return(self._get_cached('statistics', aImarisId, object_type, object_name, key, compute, progress,
+                                fingerprint=fingerprint))
+
+    def job_statistics(self, progress, aImarisId, object_type, object_name, names=None, level='cell'):
+        """
+
+        :return: base_imaris.stats.get_statistics of the object
+        """
+
+        return(self._get_statistics(progress, aImarisId, object_type, object_name, names=names, level=level))
+
+    def job_track_metrics(self, progress, aImarisId, object_type, object_name, time_limit=601):
+        """
+
+        :return: dictionary with cells = stats.movement.get_metrics_cells and
+                 motility = stats.track.get_motility_tracks of the object
+        """
+
+        def compute(session, fingerprint, progress):
+            from cvbi.stats.movement import get_metrics_cells
+            from cvbi.stats.track import get_motility_tracks
+
+            data_cells = self._get_statistics(progress, aImarisId, object_type, object_name, level='cell',
+                                              fingerprint=fingerprint)
+            if 'cluster_label' not in data_cells.columns:
+                data_cells = data_cells.assign(cluster_label=-1)
+
+            progress('Computing cell metrics')
+            cells = get_metrics_cells(data_cells)
+            progress('Computing motility')
+            motility = get_motility_tracks(data_cells, time_limit=time_limit)
+            return({'cells': cells, 'motility': motility})
+
+        return(self._get_cached('track_metrics', aImarisId, object_type, object_name, time_limit, compute,
+                                progress))
+
+    def job_incremental_metrics(self, progress, aImarisId, object_type, object_name, cell_moving=None, t_limit=60,
+                                force=False):
+        """
+
+        :return: base_imaris.incremental.IncrementalMetrics.update of the object, tracks unchanged since the
+                 previous job on the same object are not recomputed
+        """
+
+        from cvbi.base_imaris.incremental import IncrementalMetrics
+
+        if self.incremental is None:
+            self.incremental = IncrementalMetrics()
+
+        progress('Updating metrics of ' + object_name)
+        result = self.incremental.update(self.get_session(aImarisId), object_type, object_name,
+                                         cell_moving=cell_moving, t_limit=t_limit, force=force)
+        progress(str(len(result['added'])) + ' tracks recomputed, ' + str(len(result['removed'])) + ' removed')
+        return(result)
+
+    def job_clear(self, progress):
+        n = len(self.results)
+        self.results.clear()
+        self.sessions.clear()
+        if self.incremental is not None:
+            self.incremental.clear()
+        return(n)
+
+    def job_shutdown(self, progress):
+        self.running = False
+        return(True)
+
+    def handle(self, conn):
+        """
+
+        :param conn: Client connection, receives (job, kwargs) and answers with progress messages and one
+                     result or error message
+        """
+
+        try:
+            job, kwargs = conn.recv()
+
+            def progress(message):
+                conn.send(('progress', message))
+
+            # jobs in flight keep the worker alive past the idle timeout
+            with self.active_lock:
+                self.active_jobs += 1
+            try:
+                if job not in self.jobs:
+                    raise ValueError('Unknown job ' + str(job) + ', expected one of ' + str(sorted(self.jobs)))
+                if job in self.unlocked_jobs:
+                    result = self.jobs[job](progress, **kwargs)
+                else:
+                    with self.lock:
+                        result = self.jobs[job](progress, **kwargs)
+                conn.send(('result', result))
+            except Exception:
+                conn.send(('error', traceback.format_exc()))
+            finally:
+                with self.active_lock:
+                    self.active_jobs -= 1
+                    self.last_job = time.time()
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    def serve_forever(self, ready=None):
+        """
+
+        :param ready: threading.Event set once the worker listens
+        :return: Serves jobs until a shutdown job or the idle timeout
+        """
+
+        self.listener = Listener(self.address, authkey=self.authkey)
+        self.address = self.listener.address
+        self.running = True
+        if ready is not None:
+            ready.set()
+
+        # accept() blocks, a watcher wakes it up with a connection once the worker should stop
+        def watch():
+            while self.running:
+                time.sleep(0.5)
+                with self.active_lock:
+                    idle = self.idle_timeout is not None and self.active_jobs == 0 and \
+                        time.time() - self.last_job > self.idle_timeout
+                if idle:
+                    self.running = False
+            try:
+                Client(self.address, authkey=self.authkey).close()
+            except OSError:
+                pass
+
+        watcher = threading.Thread(target=watch)
+        watcher.daemon = True
+        watcher.start()
+
+        try:
+            while self.running:
+                try:
+                    conn = self.listener.accept()
+                except Exception:
+                    continue
+                if not self.running:
+                    conn.close()
+                    break
+                thread = threading.Thread(target=self.handle, args=(conn,))
+                thread.daemon = True
+                thread.start()
+        finally:
+            self.listener.close()
+
+
+def submit(job, progress=None, address=ADDRESS, authkey=None, **kwargs):
+    """
+
+    :param job: Job name, one of ping, statistics, track_metrics, incremental_metrics, clear, shutdown
+    :param progress: Callable receiving progress messages, e.g. print
+    :param address: Worker (host, port)
+    :param authkey: Key shared with the worker, default is get_authkey()
+    :param kwargs: Job arguments, e.g. aImarisId, object_type, object_name
+    :return: Job result, raises RuntimeError with the worker traceback if the job failed
+    """
+
+    conn = Client(address, authkey=authkey if authkey is not None else get_authkey())
+    try:
+        conn.send((job, kwargs))
+        while True:
+            kind, value = conn.recv()
+            if kind == 'progress':
+                if progress is not None:
+                    progress(value)
+            elif kind == 'result':
+                return(value)
+            else:
+                raise RuntimeError('cvbi worker job ' + job + ' failed\n' + value)
+    finally:
+        conn.close()
+
+
+def ensure_worker(address=ADDRESS, authkey=None, timeout=30, imaris_lib=None, idle_timeout=3600):
+    """
+
+    Start a worker process unless one already answers on address
+
+    :param address: Worker (host, port)
+    :param authkey: Key shared with the worker, default is get_authkey()
+    :param timeout: Seconds to wait for a new worker to answer
+    :param imaris_lib: 'module:callable' creating the ImarisLib object of a new worker, default is ImarisLib
+    :param idle_timeout: Seconds without jobs after which a new worker exits
+    :return: Worker process ID
+    """
+
+    if authkey is None:
+        authkey = get_authkey()
+
+    try:
+        return(submit('ping', address=address, authkey=authkey)['pid'])
+    except (OSError, EOFError):
+        pass
+
+    command = [sys.executable, '-m', 'cvbi.worker', '--host', address[0], '--port', str(address[1]),
+               '--idle-timeout', str(idle_timeout)]
+    if imaris_lib is not None:
+        command += ['--imaris-lib', imaris_lib]
+
+    cvbi_parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = cvbi_parent + os.pathsep + env.get('PYTHONPATH', '')
+    env['CVBI_WORKER_KEY'] = authkey.decode()
+    # detached, the worker outlives the XTension process
+    subprocess.Popen(command, env=env, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL, close_fds=True, start_new_session=(os.name != 'nt'),
+                     creationflags=getattr(subprocess, 'DETACHED_PROCESS', 0))
+
+    start = time.time()
+    while time.time() - start < timeout:
+        try:
+            return(submit('ping', address=address, authkey=authkey)['pid'])
+        except (OSError, EOFError):
+            time.sleep(0.1)
+
+    raise RuntimeError('cvbi worker did not start within ' + str(timeout) + 's')
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='cvbi resident worker')
+    parser.add_argument('--host', default=ADDRESS[0])
+    parser.add_argument('--port', type=int, default=ADDRESS[1])
+    parser.add_argument('--idle-timeout', type=float, default=3600, help='seconds without jobs before exiting')
+    parser.add_argument('--imaris-lib', help="'module:callable' creating the ImarisLib object")
+    parser.add_argument('--preload', action='store_true', help='import numpy, pandas and cvbi.stats at start')
+    args = parser.parse_args(argv)
+
+    imaris_lib = _get_imaris_lib(args.imaris_lib) if args.imaris_lib else None
+
+    if args.preload:
+        import cvbi.base_imaris.stats
+        import cvbi.stats.movement
+        import cvbi.stats.track
+
+    Worker(address=(args.host, args.port), imaris_lib=imaris_lib, idle_timeout=args.idle_timeout).serve_forever()
+    return(0)
+
+
+if __name__ == '__main__':
+    sys.exit(main())